@@ -0,0 +1,95 @@
+import numpy as np
+
+import explainaboard.data_utils as du
+import explainaboard.error_analysis as ea
+import explainaboard.explainaboard_main as em
+
+
+class Bucket:
+    """
+    The performance of a system on one bucket of an aspect, in percent
+    """
+
+    def __init__(self, obj_bucket):
+        self.name = obj_bucket["bucket_name"]
+        self.performance = float(obj_bucket["bucket_value"])
+        self.num = obj_bucket["num"]
+        self.confidence_low = float(obj_bucket["confidence_low"])
+        self.confidence_up = float(obj_bucket["confidence_up"])
+        self.error_cases = obj_bucket.get("bucket_error_case", [])
+
+    def __repr__(self):
+        return f'Bucket({self.name!r}, performance={self.performance}, num={self.num})'
+
+
+class Report:
+    """
+    A single-system report with the numbers of its json parsed: the performances, in percent, as floats and the
+    buckets of every aspect as ``Bucket``s. ``obj_json`` is the report as it is written to a file
+    """
+
+    def __init__(self, obj_json):
+        self.obj_json = obj_json
+        results = obj_json["model"]["results"]
+        overall = results["overall"]
+        self.task = obj_json["task"]
+        self.dataset_name = obj_json["data"]["name"]
+        self.model_name = obj_json["model"]["name"]
+        self.language = obj_json["data"].get("language")
+        self.bias = {aspect: float(val) for aspect, val in obj_json["data"]["bias"].items()}
+        self.performance = float(overall["performance"])
+        self.confidence_low = float(overall["confidence_low"])
+        self.confidence_up = float(overall["confidence_up"])
+        self.error_cases = overall.get("error_case", [])
+        self.fine_grained = {aspect: [Bucket(obj_bucket) for obj_bucket in buckets]
+                             for aspect, buckets in results["fine_grained"].items()}
+        # the template holds an ECE of 0 unless it was computed
+        calibration = results.get("calibration", {})
+        self.ece = float(calibration["ECE"]) if "details" in calibration else None
+        self.calibration_bins = calibration.get("details", [])
+
+    def __repr__(self):
+        return f'Report({self.task!r}, performance={self.performance}, aspects={list(self.fine_grained)})'
+
+    def save(self, path, path_cases=None):
+        """
+        Write the report as ``run_explainaboard`` does, see ``error_analysis.save_json``
+        """
+        ea.save_json(self.obj_json, path, path_cases)
+
+
+def is_sentences(column):
+    return len(column) > 0 and isinstance(column[0], (list, tuple, np.ndarray))
+
+
+def analyze(task, columns, sent_lens=None, name='in_memory.tsv', dataset_name='dataset_name',
+            model_name='model_name', is_print_ci=False, is_print_case=False, is_print_ece=False,
+            ci_mode='independent', n_workers=1, cache_dir=None, max_cases=None, stratify_cases=False, output=None,
+            stats_file=None, bucket_stats=None):
+    '''
+    Single-system analysis of a system output held in memory, e.g. the predictions of a model during training,
+    without writing and reading back a tsv file or the json report
+
+    Args:
+      task: The ID of the task
+      columns: the columns of the system output in the order of the task's tsv format, each a list or numpy array
+        with one field per row, e.g. tokens, gold tags and predicted tags for ner, or text, gold label, predicted
+        label, probability and correctness for tc. For the span tasks (ner, pos, chunk, cws) every column may also
+        be a list of sentences
+      sent_lens: the number of rows of every sentence of a span task whose columns have one field per token, None
+        for sentence columns
+      name: the file name of the system output as the report shows it
+      output: the path the json report is also written to, None to only return it
+      the other arguments are those of run_explainaboard
+
+    Returns:
+      the Report
+    '''
+    if sent_lens is None and len(columns) and is_sentences(columns[0]):
+        system = du.InMemoryTsv.from_sentences(columns, name)
+    else:
+        system = du.InMemoryTsv(columns, sent_lens, name)
+    return Report(em.run_explainaboard(task, [system], output, dataset_name, model_name, 'single', is_print_ci,
+                                       is_print_case, is_print_ece, ci_mode, n_workers, cache_dir,
+                                       max_cases=max_cases, stratify_cases=stratify_cases, stats_file=stats_file,
+                                       bucket_stats=bucket_stats))
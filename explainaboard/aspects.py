@@ -0,0 +1,191 @@
+import numpy as np
+
+import explainaboard.error_analysis as ea
+import explainaboard.precomputed as pc
+import explainaboard.span_table as st
+
+# aspect -> task -> function, the task None standing for every span task
+_aspect_funcs = {}
+
+
+def register_aspect(aspect, tasks=None):
+    """
+    Decorator that registers a function computing the values of an aspect for all spans of a span task at once
+
+    The function takes the ``SpanColumns`` of one tag sequence and returns one value per span, as a sequence or a
+    numpy array. An aspect listed in a task's ``conf.aspects`` is computed by the function registered for that task,
+    or else by the one registered for all tasks, so custom aspects are added by registering them and listing them
+    in ``conf.aspects``, without touching the task module.
+    :param tasks: the tasks the function is for, None for all span tasks
+    """
+    def decorator(func):
+        for task in (tasks or [None]):
+            _aspect_funcs.setdefault(aspect, {})[task] = func
+        return func
+    return decorator
+
+
+def get_aspect_func(task, aspect):
+    dict_task2func = _aspect_funcs.get(aspect, {})
+    if task in dict_task2func:
+        return dict_task2func[task]
+    if None in dict_task2func:
+        return dict_task2func[None]
+    raise ValueError(f'{aspect} is not a known aspect of {task}')
+
+
+class SpanColumns:
+    """
+    The spans of one tag sequence and their test set, as whole columns
+
+    Derived columns are computed on first use and then kept, so every aspect function can use them without
+    recomputing them for the others.
+    """
+
+    def __init__(self, span_table, test_word_sequences, test_word_sequences_sent, dict_precomputed_path):
+        """
+        :param span_table: the spans, see ``SpanTable``
+        :param test_word_sequences: the flattened words of the test set
+        :param test_word_sequences_sent: the words of the test set, grouped by sentence
+        :param dict_precomputed_path: aspect -> path of its precomputed statistics, as returned by ``load_task_conf``
+        """
+        self.span_table = span_table
+        self.words = test_word_sequences
+        self.words_sent = test_word_sequences_sent
+        self.dict_precomputed_path = dict_precomputed_path
+        self._columns = {}
+
+    def get_column(self, name, compute):
+        if name not in self._columns:
+            self._columns[name] = compute()
+        return self._columns[name]
+
+    @property
+    def sent_lengths(self):
+        """
+        The number of tokens of every sentence
+        """
+        return self.get_column("sent_lengths", lambda: np.array([len(sent) for sent in self.words_sent],
+                                                                dtype=np.int64))
+
+    @property
+    def token_sent_id(self):
+        return self.get_column("token_sent_id", lambda: st.get_token_sent_id(self.sent_lengths))
+
+    @property
+    def token_position(self):
+        return self.get_column("token_position", lambda: st.get_token_position(self.sent_lengths))
+
+    @property
+    def span_sent_length(self):
+        """
+        The length of the sentence of every span
+        """
+        return self.get_column("span_sent_length", lambda: self.sent_lengths[self.span_table.sent_id])
+
+    @property
+    def span_text(self):
+        """
+        The words of every span, joined by spaces
+        """
+        return self.get_column("span_text", lambda: [' '.join(self.words[start:end]) for start, end in
+                                                     zip(self.span_table.start.tolist(), self.span_table.end.tolist())])
+
+    @property
+    def span_text_lower(self):
+        return self.get_column("span_text_lower", lambda: [text.lower() for text in self.span_text])
+
+    @property
+    def span_type(self):
+        """
+        The type name of every span
+        """
+        type_names = self.span_table.type_names
+        return self.get_column("span_type", lambda: [type_names[code] for code in self.span_table.type_code.tolist()])
+
+    def get_precomputed(self, aspect):
+        """
+        The ``PrecomputedStore`` of an aspect marked ``is_precomputed`` in ``conf.aspects``
+        """
+        if aspect not in self.dict_precomputed_path:
+            raise ValueError(f'{aspect} is not precomputed, set is_precomputed to yes in conf.aspects')
+        return pc.load_store(self.dict_precomputed_path[aspect])
+
+
+def get_aspect_values(task, dict_aspect_func, columns):
+    """
+    Values of the aspects of ``conf.aspects`` for all spans, each aspect computed in one call of its function
+    :param dict_aspect_func: the aspects to compute, as returned by ``load_task_conf``
+    :param columns: the ``SpanColumns`` of the spans
+    :return: aspect -> numpy array of the values of the spans, by row in the span table
+    """
+    dict_span2aspect_val = {}
+    for aspect in dict_aspect_func.keys():
+        dict_span2aspect_val[aspect] = np.asarray(get_aspect_func(task, aspect)(columns))
+    return dict_span2aspect_val
+
+
+# Sentence Length: sLen
+@register_aspect("sLen")
+def get_sentence_length(columns):
+    return columns.span_sent_length.astype(np.float64)
+
+
+# Relative Position: rPos
+@register_aspect("rPos")
+def get_relative_position(columns):
+    return columns.token_position[columns.span_table.start] / columns.span_sent_length.astype(np.float64)
+
+
+# Entity Length: eLen
+@register_aspect("eLen")
+def get_span_length(columns):
+    return columns.span_table.length.astype(np.float64)
+
+
+# Entity Density: eDen, the share of the tokens of the sentence that are inside a span
+@register_aspect("eDen")
+def get_span_density(columns):
+    table = columns.span_table
+    n_span_tokens = np.bincount(table.sent_id, weights=table.length, minlength=len(columns.sent_lengths))
+    return (n_span_tokens / columns.sent_lengths)[table.sent_id]
+
+
+# Tag: tag
+@register_aspect("tag")
+def get_tag(columns):
+    return columns.span_type
+
+
+# Token Length: tLen
+@register_aspect("tLen")
+def get_token_length(columns):
+    return [float(len(columns.words[start])) for start in columns.span_table.start.tolist()]
+
+
+# Capitalization: capital
+@register_aspect("capital")
+def get_capitalization(columns):
+    return [ea.cap_feature(text) for text in columns.span_text]
+
+
+# OOV Density: oDen, the share of the words of the sentence that are not in the training vocabulary
+@register_aspect("oDen")
+def get_oov_density(columns):
+    is_oov = ~columns.get_precomputed("oDen").contains(columns.words)
+    n_oov = np.bincount(columns.token_sent_id, weights=is_oov, minlength=len(columns.sent_lengths))
+    return (n_oov / columns.sent_lengths)[columns.span_table.sent_id]
+
+
+# Span-level Frequency: eFre, how often the span is a span in the training set
+@register_aspect("eFre")
+def get_span_frequency(columns):
+    return columns.get_precomputed("eFre").lookup(columns.span_text_lower)
+
+
+# Label Consistency: eCon, how often the span has its type when it is a span in the training set
+@register_aspect("eCon")
+def get_label_consistency(columns):
+    # label consistencies are stored under "span\tlabel"
+    return columns.get_precomputed("eCon").lookup([text + "\t" + span_type for text, span_type in
+                                                   zip(columns.span_text_lower, columns.span_type)])
@@ -0,0 +1,137 @@
+import numpy as np
+
+# upper bound on the number of cells materialized per block of resamples
+MAX_BLOCK_CELLS = 2 ** 24
+
+
+def get_sample_rate(n_data):
+    res = 0.8
+    if n_data > 300000:
+        res = 0.1
+    elif n_data > 100000 and n_data < 300000:
+        res = 0.2
+
+    return res
+
+
+def get_n_sampling(n_data):
+    """
+    The number of units drawn in each bootstrap replicate of a dataset with ``n_data`` units
+    """
+    return max(1, int(n_data * get_sample_rate(n_data)))
+
+
+def get_rng(seed=None):
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def encode_correctness(true_label_list, pred_label_list):
+    """
+    Encode a pair of label lists into an integer vector with 1 where the labels agree
+    :param true_label_list: gold labels
+    :param pred_label_list: predicted labels
+    :return: numpy int8 array of the length of the shorter list
+    """
+    if isinstance(true_label_list, np.ndarray) and isinstance(pred_label_list, np.ndarray):
+        # label codes, see ``MappedTsv.get_codes``
+        n_data = min(len(true_label_list), len(pred_label_list))
+        return (true_label_list[:n_data] == pred_label_list[:n_data]).astype(np.int8)
+    return np.fromiter((t == p for t, p in zip(true_label_list, pred_label_list)), dtype=np.int8)
+
+
+def resample_counts(n_data, n_sampling, n_rows, rng):
+    """
+    Draw ``n_rows`` bootstrap replicates as a multinomial count matrix
+    :return: array of shape (n_rows, n_data), where cell (i, j) is how often unit j was drawn in replicate i
+    """
+    index = rng.integers(0, n_data, size=(n_rows, n_sampling))
+    index += np.arange(n_rows)[:, None] * n_data
+    return np.bincount(index.ravel(), minlength=n_rows * n_data).reshape(n_rows, n_data)
+
+
+def resample_sums(stats, n_sampling, n_times=1000, seed=None):
+    """
+    Sum per-unit statistics over bootstrap replicates without materializing the resampled data
+    :param stats: array of shape (n_data,) or (n_data, k) with one row of sufficient statistics per unit
+    :param n_sampling: the number of units drawn (with replacement) in each replicate
+    :param n_times: the number of replicates
+    :param seed: a seed or ``numpy.random.Generator``
+    :return: array of shape (n_times,) or (n_times, k) with the summed statistics of each replicate
+    """
+    rng = get_rng(seed)
+    stats = np.asarray(stats, dtype=np.float64)
+    n_data = stats.shape[0]
+    sums = np.zeros((n_times,) + stats.shape[1:])
+    if n_data == 0:
+        return sums
+    block = max(1, MAX_BLOCK_CELLS // max(n_data, n_sampling))
+    for start in range(0, n_times, block):
+        n_rows = min(block, n_times - start)
+        sums[start:start + n_rows] = resample_counts(n_data, n_sampling, n_rows, rng) @ stats
+    return sums
+
+
+def summarize_replicates(performance, n_times=1000):
+    """
+    Turn the bootstrap replicates of a metric into a confidence interval. With the default
+    1000 replicates this is the 2.5/97.5 percentile interval, otherwise a t-interval on the replicates.
+    :param performance: array of shape (n_times,) or (n_times, k)
+    :return: (confidence_low, confidence_up), scalars or arrays of length k
+    """
+    performance = np.asarray(performance, dtype=np.float64)
+    if n_times != 1000:
+        m = performance.mean(axis=0)
+        import scipy.stats
+        h = scipy.stats.sem(performance, axis=0) * scipy.stats.t.ppf((1 + 0.95) / 2., n_times - 1)
+        return m - h, m + h
+    performance = np.sort(performance, axis=0)
+    return performance[24], performance[974]
+
+
+def accuracy_confidence_interval(correct, n_sampling=None, n_times=1000, seed=None):
+    """
+    Bootstrap confidence interval of accuracy (in percent)
+    :param correct: 0/1 vector with one entry per example, e.g. from ``encode_correctness``
+    """
+    correct = np.asarray(correct)
+    if n_sampling is None:
+        n_sampling = get_n_sampling(len(correct))
+    performance = resample_sums(correct, n_sampling, n_times, seed) / n_sampling * 100
+    return summarize_replicates(performance, n_times)
+
+
+def f1_from_counts(n_correct, n_pred, n_true):
+    """
+    Span-level F1 from (possibly bootstrapped) counts, following ``evaluate_chunk_level``:
+    2PR/(P+R) reduces to 2TP/(#pred + #true), and F1 is 0 whenever there is no true positive
+    """
+    n_correct = np.asarray(n_correct, dtype=np.float64)
+    denominator = np.asarray(n_pred, dtype=np.float64) + np.asarray(n_true, dtype=np.float64)
+    f1 = np.zeros(np.broadcast(n_correct, denominator).shape)
+    np.divide(2 * n_correct, denominator, out=f1, where=n_correct > 0)
+    return f1
+
+
+def f1_confidence_interval(stats, n_sampling=None, n_times=1000, seed=None):
+    """
+    Bootstrap confidence interval of span-level F1 from per-unit sufficient statistics
+    :param stats: array of shape (n_data, 3) holding the true-positive, predicted and gold counts of each unit
+    """
+    stats = np.asarray(stats)
+    if n_sampling is None:
+        n_sampling = get_n_sampling(len(stats))
+    sums = resample_sums(stats, n_sampling, n_times, seed)
+    return summarize_replicates(f1_from_counts(sums[:, 0], sums[:, 1], sums[:, 2]), n_times)
+
+
+def ratio_from_counts(numerator, denominator):
+    """
+    Element-wise ratio that is 0 where the denominator is 0, e.g. the accuracy of a bucket that a replicate missed
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    ratio = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator, denominator, out=ratio, where=denominator > 0)
+    return ratio
@@ -0,0 +1,237 @@
+import copy
+import json
+import os
+
+import numpy as np
+
+import explainaboard.error_analysis as ea
+
+# bump when the layout of the statistics files changes
+STATS_FORMAT = 1
+
+
+def get_seqeval_stats(labels, predictions):
+    """
+    The counts the micro F1 of seqeval, see ``error_analysis.f1``, is computed from
+    """
+    from seqeval.metrics.sequence_labeling import get_entities
+    entities_true, entities_pred = set(get_entities(labels)), set(get_entities(predictions))
+    return {"n_correct": len(entities_true & entities_pred), "n_pred": len(entities_pred),
+            "n_true": len(entities_true)}
+
+
+def get_span_stats(list_true_tags_sent, list_pred_tags_sent, table_true, table_pred):
+    """
+    The counts the F1 of ``error_analysis.span_f1`` is computed from
+    :param table_true: the gold span table, aligned with ``table_pred`` by ``span_table.align_span_tables``
+    """
+    if not ea.is_seqeval_spans(list_true_tags_sent, list_pred_tags_sent, table_true, table_pred):
+        return get_seqeval_stats(list_true_tags_sent, list_pred_tags_sent)
+    return {"n_correct": int(np.count_nonzero(table_true.match >= 0)), "n_pred": len(table_pred),
+            "n_true": len(table_true)}
+
+
+def get_accuracy_stats(labels, predictions):
+    n_correct, n_total = ea.accuracy_counts(labels, predictions)
+    return {"n_correct": n_correct, "n_total": n_total}
+
+
+def get_performance(counts):
+    """
+    F1 or accuracy in percent from the counts of a bucket or a whole run
+    :param counts: {"n_correct", "n_pred", "n_true"} for F1, {"n_correct", "n_total"} for accuracy
+    """
+    if "n_total" in counts:
+        return ea.accuracy_from_counts(counts["n_correct"], counts["n_total"])
+    return float(ea.evaluate_chunk_counts(counts["n_correct"], counts["n_pred"], counts["n_true"])[0]) * 100
+
+
+def get_num(counts):
+    # the number of gold spans or samples
+    return counts["n_total"] if "n_total" in counts else counts["n_true"]
+
+
+def get_counts(bucket):
+    return {key: val for key, val in bucket.items() if key != "interval"}
+
+
+def add_counts(counts, counts_other):
+    if counts.keys() != counts_other.keys():
+        raise ValueError('can not add up F1 and accuracy counts')
+    return {key: counts[key] + counts_other[key] for key in counts.keys()}
+
+
+def is_discrete(buckets):
+    return any(isinstance(bucket["interval"][0], str) for bucket in buckets)
+
+
+def get_bias_stats(dict_aspect2vals):
+    """
+    The data bias of the numeric aspects as sum and count, whose ratio is the mean ``numpy.average`` reports
+    :param dict_aspect2vals: aspect -> gold aspect values
+    """
+    return {aspect: {"sum": float(np.sum(vals, dtype=np.float64)), "count": len(vals)}
+            for aspect, vals in dict_aspect2vals.items() if len(vals) and not isinstance(vals[0], str)}
+
+
+def get_stats(obj_json, overall, dict_aspect2bucket2perf, dict_span2aspect_val, ece_bins=None,
+              performance_format=None):
+    """
+    The sufficient statistics of a report: every number in it but the confidence intervals and the error cases is
+    computed from counts that can be added up across runs on disjoint data, see ``merge_stats``
+    :param obj_json: the report of the run
+    :param overall: the counts of the whole run, e.g. from ``get_span_stats`` or ``get_accuracy_stats``
+    :param dict_aspect2bucket2perf: aspect -> bucket interval -> bucket record, whose last element holds the counts
+        of the bucket
+    :param dict_span2aspect_val: aspect -> gold aspect values of the spans, for the data bias: an array by row of the
+        span table, or a span -> value dict of the classification tasks
+    :param ece_bins: the per-bin sums of ``error_analysis.get_ece_bins_by_file``, None if the ECE is not computed
+    :param performance_format: the format of the overall performance in the report, None if it is a number
+    """
+    bias = get_bias_stats({aspect: ea.get_att_vals(vals) if isinstance(vals, dict) else vals
+                           for aspect, vals in dict_span2aspect_val.items()})
+
+    fine_grained = {}
+    for aspect, dict_bucket2perf in dict_aspect2bucket2perf.items():
+        # numpy scalars in bucket intervals are stored as the python numbers they stand for
+        fine_grained[aspect] = [dict(interval=[val.item() if isinstance(val, np.generic) else val
+                                               for val in bucket_interval], **v[-1])
+                                for bucket_interval, v in dict_bucket2perf.items()]
+
+    calibration = None
+    if ece_bins is not None:
+        dic_calibration = obj_json["model"]["results"]["calibration"]
+        calibration = {"dataset": dic_calibration["dataset-name"], "model": dic_calibration["model-name"],
+                       "bins": [[float(total_probability), float(total_right), count]
+                                for total_probability, total_right, count in ece_bins]}
+
+    return {"format": STATS_FORMAT, "task": obj_json["task"], "dataset_name": obj_json["data"]["name"],
+            "model_name": obj_json["model"]["name"], "output": obj_json["data"].get("output"),
+            "language": obj_json["data"]["language"],
+            "performance_format": performance_format, "overall": overall, "bias": bias,
+            "fine_grained": fine_grained, "calibration": calibration}
+
+
+def save_stats(stats, path):
+    with open(path, "w") as fout:
+        json.dump(stats, fout, indent=4, ensure_ascii=False)
+
+
+def load_stats(path):
+    with open(path, "r") as fin:
+        stats = json.load(fin)
+    if stats.get("format") != STATS_FORMAT:
+        raise ValueError(f'{path} is not a statistics file of this version of ExplainaBoard')
+    return stats
+
+
+def get_bucket_intervals(stats):
+    """
+    The intervals of the numeric aspects of a run, to bucket further runs by the same intervals so that their
+    statistics can be merged with it
+    :return: aspect -> list of bucket intervals
+    """
+    dict_aspect2intervals = {}
+    for aspect, buckets in stats["fine_grained"].items():
+        if not is_discrete(buckets):
+            # the report lists buckets by interval, but where intervals overlap the single values, which are
+            # bucketed before the ranges, win
+            dict_aspect2intervals[aspect] = sorted((tuple(bucket["interval"]) for bucket in buckets), key=len)
+    return dict_aspect2intervals
+
+
+def merge_stats(list_stats):
+    """
+    Add up the statistics of several runs of a task on disjoint data, e.g. the shards of a test set, or a test set
+    and data appended to it later. The names and the output of the merged statistics are those of the first run
+
+    The numeric aspects of all runs must be bucketed by the same intervals, which later runs get by being
+    evaluated with the statistics of the first one as ``bucket_stats``. The buckets of discrete aspects (e.g. tags)
+    are merged by value; a bucket missing from a run, e.g. a tag too rare to get a bucket there, counts nothing.
+    """
+    stats = copy.deepcopy(list_stats[0])
+    for stats_other in list_stats[1:]:
+        if stats_other["task"] != stats["task"]:
+            raise ValueError(f'can not merge the statistics of {stats["task"]} and {stats_other["task"]}')
+        stats["overall"] = add_counts(stats["overall"], stats_other["overall"])
+
+        for aspect, dict_bias in stats_other["bias"].items():
+            dict_bias_merged = stats["bias"].setdefault(aspect, {"sum": 0., "count": 0})
+            dict_bias_merged["sum"] += dict_bias["sum"]
+            dict_bias_merged["count"] += dict_bias["count"]
+
+        if stats_other["fine_grained"].keys() != stats["fine_grained"].keys():
+            raise ValueError('can not merge the statistics of runs with different aspects')
+        for aspect, buckets_other in stats_other["fine_grained"].items():
+            buckets = stats["fine_grained"][aspect]
+            if is_discrete(buckets) or is_discrete(buckets_other):
+                dict_bucket2counts = {tuple(bucket["interval"]): get_counts(bucket) for bucket in buckets}
+                for bucket in buckets_other:
+                    interval, counts = tuple(bucket["interval"]), get_counts(bucket)
+                    if interval in dict_bucket2counts:
+                        counts = add_counts(dict_bucket2counts[interval], counts)
+                    dict_bucket2counts[interval] = counts
+                stats["fine_grained"][aspect] = [dict(interval=list(interval), **counts) for interval, counts in
+                                                 sorted(dict_bucket2counts.items())]
+            elif [bucket["interval"] for bucket in buckets] == [bucket["interval"] for bucket in buckets_other]:
+                stats["fine_grained"][aspect] = [
+                    dict(interval=bucket["interval"], **add_counts(get_counts(bucket), get_counts(bucket_other)))
+                    for bucket, bucket_other in zip(buckets, buckets_other)]
+            else:
+                raise ValueError(f'the buckets of {aspect} differ between the runs: evaluate the later runs with '
+                                 f'the statistics of the first one as bucket_stats')
+
+        calibration, calibration_other = stats["calibration"], stats_other["calibration"]
+        if (calibration is None) != (calibration_other is None):
+            raise ValueError('can not merge runs with and without calibration statistics')
+        if calibration is not None:
+            if len(calibration["bins"]) != len(calibration_other["bins"]):
+                raise ValueError('can not merge calibration statistics with different numbers of bins')
+            calibration["bins"] = [[a + b for a, b in zip(bin_sums, bin_sums_other)]
+                                   for bin_sums, bin_sums_other in zip(calibration["bins"],
+                                                                       calibration_other["bins"])]
+    return stats
+
+
+def get_report(stats):
+    """
+    The report of (merged) statistics, in the format of the task's reports, with confidence intervals of 0 and no
+    error cases since neither can be computed from counts
+    """
+    task_dir = os.path.join(os.path.dirname(__file__), "tasks", stats["task"])
+    dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=task_dir)
+
+    dict_fine_grained = {}
+    for aspect, buckets in stats["fine_grained"].items():
+        dict_fine_grained[aspect] = []
+        for bucket in buckets:
+            dict_fine_grained[aspect].append({"bucket_name": ea.beautify_interval(tuple(bucket["interval"])),
+                                              "bucket_value": format(get_performance(bucket), '.4g'),
+                                              "num": get_num(bucket), "confidence_low": format(0, '.4g'),
+                                              "confidence_up": format(0, '.4g'), "bucket_error_case": []})
+
+    holistic_performance = get_performance(stats["overall"])
+    if stats["performance_format"] is not None:
+        holistic_performance = format(holistic_performance, stats["performance_format"])
+
+    obj_json["task"] = stats["task"]
+    obj_json["data"]["name"] = stats["dataset_name"]
+    if stats["output"] is not None:
+        obj_json["data"]["output"] = stats["output"]
+    obj_json["data"]["language"] = stats["language"]
+    obj_json["data"]["bias"] = {aspect: dict_bias["sum"] / dict_bias["count"]
+                                for aspect, dict_bias in stats["bias"].items()}
+
+    obj_json["model"]["name"] = stats["model_name"]
+
+    obj_json["model"]["results"]["overall"]["error_case"] = []
+    obj_json["model"]["results"]["overall"]["performance"] = holistic_performance
+    obj_json["model"]["results"]["overall"]["confidence_low"] = 0
+    obj_json["model"]["results"]["overall"]["confidence_up"] = 0
+    obj_json["model"]["results"]["fine_grained"] = dict_fine_grained
+
+    calibration = stats["calibration"]
+    if calibration is not None:
+        ece, dic_calibration = ea.get_calibration(calibration["bins"], calibration["dataset"], calibration["model"])
+        obj_json["model"]["results"]["calibration"] = dic_calibration
+    return obj_json
@@ -0,0 +1,139 @@
+import json
+import os
+import random
+import threading
+
+
+class CaseSample(list):
+    """
+    The error cases kept by a ``CaseSampler``, in their original order, with the exact counts of all cases
+    """
+
+    def __init__(self, cases, n_cases, max_cases=None, dict_stratum2count=None):
+        super().__init__(cases)
+        self.n_cases = n_cases
+        self.max_cases = max_cases
+        self.dict_stratum2count = dict_stratum2count
+
+
+class CaseIndex(dict):
+    """
+    The offset index {"offset": byte offset of the first case, "count": number of cases} of a list of error cases
+    written by a ``CaseWriter``, with the exact counts of its ``CaseSample``
+    """
+
+    def __init__(self, offset, count, n_cases=None, max_cases=None, dict_stratum2count=None):
+        super().__init__(offset=offset, count=count)
+        self.n_cases = n_cases
+        self.max_cases = max_cases
+        self.dict_stratum2count = dict_stratum2count
+
+
+class CaseWriter:
+    """
+    Binary JSON lines file of error cases, one JSON-encoded case per line, written list by list
+
+    A sampler holding the writer writes its cases as soon as they are final, so a report only keeps their offset
+    index in memory. Writes are serialized across threads. The file is not shared with forked worker processes
+    (see ``parallel.map_tasks``): there the cases are returned as they are and written later by the parent.
+    """
+
+    def __init__(self, path_cases):
+        self.path_cases = path_cases
+        self._fout = open(path_cases, "wb")
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def write(self, cases):
+        """
+        :param cases: a list of cases, e.g. a ``CaseSample``
+        :return: the ``CaseIndex`` of the written cases, or ``cases`` itself in a forked worker process
+        """
+        if os.getpid() != self._pid:
+            return cases
+        with self._lock:
+            offset = self._fout.tell()
+            for case in cases:
+                self._fout.write(json.dumps(case, ensure_ascii=False).encode("utf-8") + b"\n")
+        return CaseIndex(offset, len(cases), getattr(cases, "n_cases", None), getattr(cases, "max_cases", None),
+                         getattr(cases, "dict_stratum2count", None))
+
+    def close(self):
+        self._fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def count_cases(cases):
+    # the number of cases of a list of cases or of the ``CaseIndex`` of written ones
+    return cases["count"] if isinstance(cases, CaseIndex) else len(cases)
+
+
+class CaseSampler:
+    """
+    Exact count and bounded uniform sample of the error cases of a bucket or of the whole test set
+
+    Cases are offered one at a time and reservoir sampling (algorithm R) keeps a uniform sample of at most
+    ``max_cases`` of them, or one such sample per stratum (e.g. per pair of true and predicted label) if
+    ``is_stratified``, so that rare kinds of errors are not crowded out by frequent ones. The memory is bounded by
+    the sample size whatever the size of the test set, and since ``offer`` decides whether a case is kept before it
+    is built, the text of the cases that are not kept is never built at all. The seed makes reports reproducible.
+    """
+
+    def __init__(self, max_cases=None, is_stratified=False, seed=0, writer=None):
+        """
+        :param max_cases: the maximum number of cases kept (per stratum if ``is_stratified``), None keeps all of them
+        :param writer: the ``CaseWriter`` the kept cases are written to by ``get_cases``, None to keep them
+        """
+        self.max_cases = max_cases
+        self.is_stratified = is_stratified
+        self.writer = writer
+        self.n_cases = 0
+        self._random = random.Random(seed)
+        # stratum -> [number of cases offered, [[case number, case], ...]]
+        self._reservoirs = {}
+
+    def offer(self, stratum=None):
+        """
+        Count one case and decide whether it is kept
+        :param stratum: the hashable stratum of the case, ignored unless ``is_stratified``
+        :return: the slot to ``put`` the case into, or None if it is not kept
+        """
+        reservoir = self._reservoirs.setdefault(stratum if self.is_stratified else None, [0, []])
+        n_offered, cases = reservoir
+        reservoir[0] += 1
+        slot = [self.n_cases, None]
+        self.n_cases += 1
+        if self.max_cases is None or n_offered < self.max_cases:
+            cases.append(slot)
+            return slot
+        i_case = self._random.randrange(n_offered + 1)
+        if i_case < self.max_cases:
+            cases[i_case] = slot
+            return slot
+        return None
+
+    @staticmethod
+    def put(slot, case):
+        slot[1] = case
+
+    def add(self, case, stratum=None):
+        slot = self.offer(stratum)
+        if slot is not None:
+            self.put(slot, case)
+
+    def get_cases(self):
+        """
+        :return: the kept cases as a ``CaseSample``, with the per-stratum counts if ``is_stratified``, or their
+            ``CaseIndex`` once written if the sampler has a ``writer``
+        """
+        slots = sorted(slot for _, cases in self._reservoirs.values() for slot in cases)
+        dict_stratum2count = None
+        if self.is_stratified:
+            dict_stratum2count = {stratum: n_offered for stratum, (n_offered, _) in self._reservoirs.items()}
+        sample = CaseSample([case for _, case in slots], self.n_cases, self.max_cases, dict_stratum2count)
+        return sample if self.writer is None else self.writer.write(sample)
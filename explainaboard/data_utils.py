@@ -1,6 +1,10 @@
-import pandas as pd
+import mmap
+
 import numpy as np
 
+# number of bytes scanned (or label cells gathered) at a time when indexing a memory-mapped file
+BLOCK_SIZE = 2 ** 22
+
 
 def get_probability_right_or_not(file_path, prob_col, right_or_not_col=None, answer_cols=None):
     """
@@ -18,7 +22,18 @@ def get_probability_right_or_not(file_path, prob_col, right_or_not_col=None, ans
 
     Either right_or_not_col or answer_cols must be populated
     """
+    if isinstance(file_path, InMemoryTsv):
+        probability_list = [float(field) for field in file_path.columns[prob_col]]
+        if right_or_not_col is not None:
+            right_or_not_list = [to_number(field) for field in file_path.columns[right_or_not_col]]
+        elif answer_cols is not None:
+            right_or_not_list = [true == pred for true, pred in zip(file_path.columns[answer_cols[0]],
+                                                                   file_path.columns[answer_cols[1]])]
+        else:
+            raise ValueError('right_or_not_cols or answer_cols must not be None')
+        return probability_list, right_or_not_list
 
+    import pandas as pd
     result = pd.read_csv(file_path, sep='\t', header=None)
 
     probability_list = np.array(result[prob_col]).tolist()
@@ -35,13 +50,19 @@ def get_probability_right_or_not(file_path, prob_col, right_or_not_col=None, ans
 def tsv_to_lists(path_file, col_ids, fail_on_short_line=True):
     """
     Grab a list of columns from a tsv file
-    :param path_file: The path to the file
+    :param path_file: The path to the file, or an ``InMemoryTsv``
     :param col_ids: The integer column IDs
     :param fail_on_short_line: Whether to fail if there is a line that's too short
     :return:
     """
     ret_lists = tuple([] for _ in col_ids)
     max_col = max(col_ids)
+    if isinstance(path_file, InMemoryTsv):
+        if max_col < len(path_file.columns):
+            return tuple(list(path_file.columns[col_id]) for col_id in col_ids)
+        elif fail_on_short_line:
+            raise ValueError(f'Illegal short line in {path_file.name}: it has {len(path_file.columns)} columns')
+        return ret_lists
     with open(path_file, "r") as fin:
         for line in fin:
             line = line.rstrip("\n")
@@ -52,3 +73,313 @@ def tsv_to_lists(path_file, col_ids, fail_on_short_line=True):
             elif fail_on_short_line:
                 raise ValueError(f'Illegal short line in {path_file}\n{line}')
     return ret_lists
+
+
+def conll_to_lists(path_file, col_ids, n_cols=3):
+    """
+    Grab a list of columns from a CoNLL-style tsv file, where sentences are separated by blank lines
+    :param path_file: The path to the file, or an ``InMemoryTsv``
+    :param col_ids: The integer column IDs
+    :param n_cols: The expected number of columns; lines with another number of columns are printed
+    :return: one (sentence-grouped list, flat list) pair per column ID. The sentences are slices of the flat list.
+    """
+    if isinstance(path_file, InMemoryTsv):
+        sent_starts, sent_ends = path_file.sent_starts.tolist(), path_file.sent_ends.tolist()
+        return tuple(([path_file.columns[col_id][start:end] for start, end in zip(sent_starts, sent_ends)],
+                      list(path_file.columns[col_id])) for col_id in col_ids)
+    with MappedTsv(path_file) as tsv:
+        for row in np.flatnonzero(tsv.n_cols != n_cols).tolist():
+            print(tsv.buffer[tsv.line_start[row]:tsv.line_end[row]].decode(tsv.encoding))
+        # the columns are decoded through label codes, so every distinct token or tag is decoded only once and
+        # its rows share one string
+        codes, label_names = tsv.get_codes(col_ids)
+        sent_starts, sent_ends = tsv.sent_starts.tolist(), tsv.sent_ends.tolist()
+    label_names = np.array(label_names, dtype=object)
+    ret_lists = []
+    for col_codes in codes:
+        col_list = label_names[col_codes].tolist()
+        ret_lists.append(([col_list[start:end] for start, end in zip(sent_starts, sent_ends)], col_list))
+    return tuple(ret_lists)
+
+
+def iter_conll_sentences(path_file, col_ids, delimiter=None):
+    """
+    Stream the sentences of a CoNLL-style file, e.g. a training set, holding one sentence in memory at a time
+    :param path_file: The path to the file
+    :param col_ids: The integer column IDs, negative ones count from the last column
+    :param delimiter: The column separator, None for any whitespace as in the CoNLL shared task files
+    :return: generator of one list per column ID for every sentence; -DOCSTART- lines are skipped
+    """
+    cols_sent = [[] for _ in col_ids]
+    with open(path_file, "r") as fin:
+        for line in fin:
+            line = line.strip()
+            if line and not line.startswith("-DOCSTART-"):
+                cols = line.split(delimiter)
+                for col_id, col_list in zip(col_ids, cols_sent):
+                    col_list.append(cols[col_id])
+            elif cols_sent[0]:
+                yield cols_sent
+                cols_sent = [[] for _ in col_ids]
+    if cols_sent[0]:
+        yield cols_sent
+
+
+class TsvColumn:
+    """
+    Lazily decoded view of one column of a ``MappedTsv``
+
+    Indexing with an integer decodes a single field, indexing with a slice returns a list. Nothing is decoded
+    until it is accessed, so the column can be kept around for rendering error cases at almost no memory cost.
+    """
+
+    def __init__(self, tsv, start, end, transform=None):
+        self._tsv = tsv
+        self.start = start
+        self.end = end
+        self._transform = transform
+
+    def __len__(self):
+        return len(self.start)
+
+    def _decode(self, row):
+        value = self._tsv.buffer[self.start[row]:self.end[row]].decode(self._tsv.encoding)
+        return self._transform(value) if self._transform else value
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self._decode(i) for i in range(*row.indices(len(self)))]
+        return self._decode(row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self._decode(row)
+
+    def map(self, transform):
+        """
+        A view of the same fields that applies ``transform`` to every decoded value
+        """
+        return TsvColumn(self._tsv, self.start, self.end, transform)
+
+
+class MappedTsv:
+    """
+    Memory-mapped tsv file with a line and column offset index
+
+    The file is scanned once, block by block, for newlines and tabs; only their offsets are kept, as uint32 for
+    files under 4 GiB. Every non-blank line is a row, and blank lines separate the sentences of CoNLL-style files
+    (``sent_starts``). Columns are exposed as lazily decoded ``TsvColumn`` views, and label columns can be decoded
+    straight into integer codes with ``get_codes``. The index still takes a few bytes per line and per tab in
+    memory. ``close`` releases the mapping, which can also be done by using the ``MappedTsv`` as a context manager.
+    """
+
+    def __init__(self, path_file, encoding="utf-8"):
+        self.path_file = path_file
+        self.encoding = encoding
+        with open(path_file, "rb") as fin:
+            try:
+                self.buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file can not be mapped
+                self.buffer = b""
+        self._bytes = np.frombuffer(self.buffer, dtype=np.uint8)
+        size = len(self._bytes)
+        offset_dtype = np.uint32 if size < 2 ** 32 else np.uint64
+
+        newlines, self._tabs = [], []
+        for offset in range(0, size, BLOCK_SIZE):
+            block = self._bytes[offset:offset + BLOCK_SIZE]
+            newlines.append((np.flatnonzero(block == ord("\n")) + offset).astype(offset_dtype))
+            self._tabs.append((np.flatnonzero(block == ord("\t")) + offset).astype(offset_dtype))
+        newlines = np.concatenate(newlines + [np.zeros(0, dtype=offset_dtype)]).astype(np.int64)
+        # a sentinel tab past the end of the file keeps the tab lookups in range
+        self._tabs = np.concatenate(self._tabs + [np.array([size], dtype=offset_dtype)])
+        if size and self._bytes[-1] != ord("\n"):
+            newlines = np.append(newlines, size)
+
+        line_start = np.concatenate([[0], newlines + 1])[:len(newlines)].astype(np.int64)
+        line_end = newlines.astype(np.int64)
+        is_cr = line_end > line_start
+        is_cr[is_cr] = self._bytes[line_end[is_cr] - 1] == ord("\r")
+        line_end -= is_cr
+
+        is_blank = line_end == line_start
+        self.line_start = line_start[~is_blank].astype(offset_dtype)
+        self.line_end = line_end[~is_blank].astype(offset_dtype)
+        # a row starts a sentence if it is the first row or follows a blank line
+        is_first = np.concatenate([[True], is_blank[:-1]])[:len(is_blank)][~is_blank]
+        self.sent_starts = np.flatnonzero(is_first)
+        first_tab = np.searchsorted(self._tabs, self.line_start)
+        self.n_cols = (np.searchsorted(self._tabs, self.line_end) - first_tab + 1).astype(np.int32)
+        self._first_tab = first_tab.astype(offset_dtype)
+
+    def __len__(self):
+        return len(self.line_start)
+
+    def close(self):
+        """
+        Release the memory mapping; the columns of the file can not be decoded afterwards
+        """
+        self._bytes = None
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def sent_ends(self):
+        return np.append(self.sent_starts[1:], len(self)) if len(self.sent_starts) else self.sent_starts
+
+    def check_columns(self, n_cols):
+        """
+        Raise a ValueError if a row has fewer than ``n_cols`` columns
+        """
+        short = np.flatnonzero(self.n_cols < n_cols)
+        if len(short):
+            line = self.buffer[self.line_start[short[0]]:self.line_end[short[0]]].decode(self.encoding)
+            raise ValueError(f'Illegal short line in {self.path_file}\n{line}')
+
+    def get_offsets(self, col_id):
+        """
+        Byte offsets of the fields of one column, empty fields for rows that are too short
+        :return: (start, end) numpy arrays of the offset type with one entry per row
+        """
+        if col_id == 0:
+            start = self.line_start.copy()
+        else:
+            tab = np.minimum(self._first_tab + col_id - 1, len(self._tabs) - 1)
+            start = np.where(self.n_cols > col_id, self._tabs[tab] + 1, self.line_end)
+        tab = np.minimum(self._first_tab + col_id, len(self._tabs) - 1)
+        end = np.where(self.n_cols > col_id + 1, self._tabs[tab], self.line_end)
+        return start, end
+
+    def get_column(self, col_id):
+        return TsvColumn(self, *self.get_offsets(col_id))
+
+    def get_codes(self, col_ids):
+        """
+        Decode label columns straight into integer codes over one shared vocabulary
+        :param col_ids: the integer column IDs
+        :return: (one numpy int32 code array per column, vocabulary list of the labels). Codes are assigned block
+            by block of rows, in byte order of the labels within a block
+        """
+        dict_label2code = {}
+        ret_codes = []
+        for col_id in col_ids:
+            start, end = self.get_offsets(col_id)
+            codes = np.zeros(len(start), dtype=np.int32)
+            width = max(int((end - start).max()) if len(start) else 0, 1)
+            n_rows = max(1, BLOCK_SIZE // max(width, 1))
+            for first in range(0, len(start), n_rows):
+                block_start, block_end = start[first:first + n_rows], end[first:first + n_rows]
+                # copy every field into a zero-padded fixed-width cell and hash the cells with np.unique
+                index = block_start[:, None].astype(np.int64) + np.arange(width)
+                cells = self._bytes[np.minimum(index, len(self._bytes) - 1)]
+                cells[index >= block_end[:, None]] = 0
+                labels, inverse = np.unique(np.ascontiguousarray(cells).view(f"S{width}").ravel(),
+                                            return_inverse=True)
+                label_codes = np.fromiter((dict_label2code.setdefault(label, len(dict_label2code))
+                                           for label in labels), dtype=np.int32, count=len(labels))
+                codes[first:first + n_rows] = label_codes[inverse.ravel()]
+            ret_codes.append(codes)
+        return ret_codes, [label.decode(self.encoding) for label in dict_label2code]
+
+
+def to_number(field):
+    # the number in a field, an int if it is one, as pandas reads it
+    try:
+        return int(field)
+    except ValueError:
+        return float(field)
+
+
+class InMemoryColumn(list):
+    """
+    One column of an ``InMemoryTsv``, with the ``map`` of ``TsvColumn``
+    """
+
+    def map(self, transform):
+        return InMemoryColumn(transform(value) for value in self)
+
+
+class InMemoryTsv:
+    """
+    A system output held in memory, which the readers of this module take wherever they take the path of a tsv file
+
+    Every column is a sequence of fields, e.g. a list or numpy array of tokens, labels or probabilities, in the
+    column order of the task's tsv format. The fields are kept as the strings a tsv file would hold, so an output
+    analyzed in memory gets the report of the same output written to a file. CoNLL-style outputs give the number
+    of rows of every sentence.
+    """
+
+    def __init__(self, columns, sent_lens=None, name="in_memory.tsv"):
+        self.name = name
+        self.path_file = name
+        self.columns = [InMemoryColumn(str(field) for field in (column.tolist() if isinstance(column, np.ndarray)
+                                                                else column)) for column in columns]
+        n_rows = len(self.columns[0]) if self.columns else 0
+        if any(len(column) != n_rows for column in self.columns):
+            raise ValueError(f'the columns of {name} differ in length')
+        sent_lens = np.asarray([n_rows] if sent_lens is None else sent_lens, dtype=np.int64)
+        if sent_lens.sum() != n_rows:
+            raise ValueError(f'the sentences of {name} have {sent_lens.sum()} rows, its columns {n_rows}')
+        self.sent_ends = np.cumsum(sent_lens)
+        self.sent_starts = self.sent_ends - sent_lens
+
+    @classmethod
+    def from_sentences(cls, columns, name="in_memory.tsv"):
+        """
+        A CoNLL-style output from columns of sentences, e.g. lists of the tokens and tags of every sentence
+        """
+        sent_lens = [len(sent) for sent in columns[0]] if columns else []
+        return cls([[field for sent in column for field in sent] for column in columns], sent_lens, name)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def check_columns(self, n_cols):
+        """
+        Raise a ValueError if there are fewer than ``n_cols`` columns
+        """
+        if len(self.columns) < n_cols:
+            raise ValueError(f'Illegal short line in {self.name}: it has {len(self.columns)} columns')
+
+    def get_column(self, col_id):
+        return self.columns[col_id]
+
+    def close(self):
+        # nothing to release, for the callers of ``open_tsv``
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_codes(self, col_ids):
+        """
+        Label columns as integer codes over one shared vocabulary, in order of first occurrence
+        :return: (one numpy int32 code array per column, vocabulary list of the labels)
+        """
+        dict_label2code = {}
+        ret_codes = [np.fromiter((dict_label2code.setdefault(label, len(dict_label2code))
+                                  for label in self.columns[col_id]), dtype=np.int32, count=len(self))
+                     for col_id in col_ids]
+        return ret_codes, list(dict_label2code)
+
+
+def open_tsv(path_file):
+    """
+    A ``MappedTsv`` of a tsv file, or the ``InMemoryTsv`` given instead of its path
+    """
+    return path_file if isinstance(path_file, InMemoryTsv) else MappedTsv(path_file)
+
+
+def get_file_name(path_file):
+    # the name of a system output as reports show it
+    return path_file.name if isinstance(path_file, InMemoryTsv) else path_file.split("/")[-1]
@@ -1,16 +1,18 @@
 import numpy as np
 import os
-import scipy.stats as statss
+import copy
 import json
 import collections
+import itertools
 
-from seqeval.metrics import precision_score, recall_score, f1_score
-from nltk.tokenize import TweetTokenizer
 
 import explainaboard.data_utils as du
+import explainaboard.bootstrap as bs
+import explainaboard.case_sampling as cs
+import explainaboard.parallel as par
+import explainaboard.span_table as st
+from explainaboard.bootstrap import get_sample_rate
 
-from random import choices
-import scipy.stats
 
 
 def get_chunks(seq):
@@ -140,16 +142,11 @@ def evaluate_chunk_level(pred_chunks, true_chunks):
     # if len(pred_chunks) != len(true_chunks):
     # 	print("Error!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!: len(pred_chunks) != len(true_chunks)")
     # 	exit()
-    correct_preds, total_correct, total_preds = 0., 0., 0.
     correct_preds = len(set(true_chunks) & set(pred_chunks))
-    total_preds = len(pred_chunks)
-    total_correct = len(true_chunks)
+    return evaluate_chunk_counts(correct_preds, len(pred_chunks), len(true_chunks))
 
-    # print("****** debug *************")
-    # print("correct_preds:\t", correct_preds)
-    # print("total_preds:\t", total_preds)
-    # print("total_correct:\t", total_correct)
 
+def evaluate_chunk_counts(correct_preds, total_preds, total_correct):
     p = correct_preds / total_preds if correct_preds > 0 else 0
     r = correct_preds / total_correct if correct_preds > 0 else 0
     f1 = 2 * p * r / (p + r) if correct_preds > 0 else 0
@@ -270,218 +267,306 @@ def dict_char2word(sentence):
     return dict_c2w
 
 
-def get_sample_rate(n_data):
-    res = 0.8
-    if n_data > 300000:
-        res = 0.1
-    elif n_data > 100000 and n_data < 300000:
-        res = 0.2
-
-    return res
-
-
 def mean_confidence_interval(data, confidence=0.95):
     a = 1.0 * np.array(data)
     n = len(a)
+    import scipy.stats
     m, se = np.mean(a), scipy.stats.sem(a)
     h = se * scipy.stats.t.ppf((1 + confidence) / 2., n - 1)
     return m - h, m + h
 
 
-def compute_confidence_interval_acc(true_label_list, pred_label_list, n_times=1000):
-    n_data = len(true_label_list)
-    sample_rate = get_sample_rate(n_data)
-    n_sampling = int(n_data * sample_rate)
-    if n_sampling == 0:
-        n_sampling = 1
+def compute_confidence_interval_acc(true_label_list, pred_label_list, n_times=1000, seed=None):
+    n_data = min(len(true_label_list), len(pred_label_list))
+    n_sampling = bs.get_n_sampling(n_data)
     print("n_data:\t", n_data)
-    print("sample_rate:\t", sample_rate)
     print("n_sampling:\t", n_sampling)
 
-    performance_list = []
-    confidence_low, confidence_up = 0, 0
-    for i in range(n_times):
-        sample_index_list = choices(range(n_data), k=n_sampling)
-
-        performance = accuracy(list(np.array(true_label_list)[sample_index_list]),
-                               list(np.array(pred_label_list)[sample_index_list]))
-        performance_list.append(performance)
-
-    if n_times != 1000:
-        confidence_low, confidence_up = mean_confidence_interval(performance_list)
-    else:
-        performance_list.sort()
-        confidence_low = performance_list[24]
-        confidence_up = performance_list[974]
+    # labels are compared once, each replicate is then a weighted sum of the correctness vector
+    correct = bs.encode_correctness(true_label_list, pred_label_list)
+    confidence_low, confidence_up = bs.accuracy_confidence_interval(correct, n_sampling, n_times, seed)
 
     print("\n")
     print("confidence_low:\t", confidence_low)
     print("confidence_up:\t", confidence_up)
 
-    return confidence_low, confidence_up
+    return float(confidence_low), float(confidence_up)
+
+
+def get_correct_spans(spans_true, spans_pred, table_true, table_pred):
+    """
+    The gold spans of a bucket whose identical predicted span falls into the same bucket
+    :param spans_true: rows of ``table_true`` in the bucket
+    :param spans_pred: rows of ``table_pred`` in the bucket
+    :return: numpy array of rows of ``table_true``
+    """
+    spans_true = np.asarray(spans_true, dtype=np.int64)
+    in_bucket_pred = np.zeros(len(table_pred) + 1, dtype=bool)
+    in_bucket_pred[np.asarray(spans_pred, dtype=np.int64)] = True
+    # unmatched spans (-1) look up the trailing False
+    return spans_true[in_bucket_pred[table_true.match[spans_true]]]
 
 
-# 1000
-def compute_confidence_interval_f1(spans_true, spans_pred, dict_span2sid, dict_span2sid_pred, n_times=1000):
-    n_data = len(dict_span2sid)
-    sample_rate = get_sample_rate(n_data)
-    n_sampling = int(n_data * sample_rate)
-    print("sample_rate:\t", sample_rate)
+def get_sentence_f1_stats(spans_true, spans_pred, table_true, table_pred):
+    """
+    Count true-positive, predicted and gold spans per sentence
+    :param spans_true: rows of ``table_true`` falling into the evaluated bucket
+    :param spans_pred: rows of ``table_pred`` falling into the evaluated bucket
+    :return: array of shape (n_sents, 3)
+    """
+    n_data = table_true.n_sents
+    spans_correct = get_correct_spans(spans_true, spans_pred, table_true, table_pred)
+    sids_true = table_true.sent_id[np.asarray(spans_true, dtype=np.int64)]
+    sids_pred = table_pred.sent_id[np.asarray(spans_pred, dtype=np.int64)]
+    return np.stack([np.bincount(table_true.sent_id[spans_correct], minlength=n_data),
+                     np.bincount(sids_pred, minlength=n_data),
+                     np.bincount(sids_true, minlength=n_data)], axis=1)
+
+
+def compute_confidence_interval_f1(spans_true, spans_pred, table_true, table_pred, n_times=1000, seed=None):
+    # sentences are the resampling unit, each replicate is a weighted sum of per-sentence span counts
+    stats = get_sentence_f1_stats(spans_true, spans_pred, table_true, table_pred)
+    n_sampling = bs.get_n_sampling(len(stats))
     print("n_sampling:\t", n_sampling)
 
-    dict_sid2span_salient = {}
-    for span in spans_true:
-        # print(span)
-        if len(span.split("_")) != 3:
-            break
-        sid = dict_span2sid[span]
-        if sid in dict_sid2span_salient.keys():
-            dict_sid2span_salient[sid].append(span)
-        else:
-            dict_sid2span_salient[sid] = [span]
+    confidence_low, confidence_up = bs.f1_confidence_interval(stats, n_sampling, n_times, seed)
+    return float(confidence_low), float(confidence_up)
 
-    dict_sid2span_salient_pred = {}
-    for span in spans_pred:
-        sid = dict_span2sid_pred[span]
-        if sid in dict_sid2span_salient_pred.keys():
-            dict_sid2span_salient_pred[sid].append(span)
-        else:
-            dict_sid2span_salient_pred[sid] = [span]
 
-    performance_list = []
-    confidence_low, confidence_up = 0, 0
-    for i in range(n_times):
-        sample_index_list = choices(range(n_data), k=n_sampling)
+def compute_shared_confidence_interval_f1(dict_aspect2bucket2span, dict_aspect2bucket2span_pred, table_true,
+                                          table_pred, n_times=1000, seed=None):
+    """
+    Confidence intervals of the overall F1 and of every bucket of every aspect, all computed from one set of
+    sentence resamples in a single pass
+    :param dict_aspect2bucket2span: aspect -> bucket interval -> rows of ``table_true``
+    :param dict_aspect2bucket2span_pred: aspect -> bucket interval -> rows of ``table_pred``
+    :return: (confidence_low, confidence_up) of the overall F1,
+             and aspect -> bucket interval -> (confidence_low, confidence_up)
+    """
+    groups = [(None, None)]
+    stats = [get_sentence_f1_stats(np.arange(len(table_true)), np.arange(len(table_pred)), table_true, table_pred)]
+    for aspect, dict_bucket2span in dict_aspect2bucket2span.items():
+        for bucket_interval, spans_true in dict_bucket2span.items():
+            spans_pred = dict_aspect2bucket2span_pred[aspect][bucket_interval]
+            groups.append((aspect, bucket_interval))
+            stats.append(get_sentence_f1_stats(spans_true, spans_pred, table_true, table_pred))
 
-        true_label_bootstrap_list = []
-        pred_label_bootstrap_list = []
-        for ind, sid in enumerate(sample_index_list):
+    sums = bs.resample_sums(np.concatenate(stats, axis=1), bs.get_n_sampling(table_true.n_sents), n_times, seed)
+    performance = bs.f1_from_counts(sums[:, 0::3], sums[:, 1::3], sums[:, 2::3])
+    return split_shared_intervals(groups, *bs.summarize_replicates(performance, n_times))
 
-            if sid in dict_sid2span_salient.keys():
-                true_label_list = dict_sid2span_salient[sid]
-                true_label_list_revised = [true_label + "_" + str(ind) for true_label in true_label_list]
-                true_label_bootstrap_list += true_label_list_revised
 
-            if sid in dict_sid2span_salient_pred.keys():
-                pred_label_list = dict_sid2span_salient_pred[sid]
-                pred_label_list_revised = [pred_label + "_" + str(ind) for pred_label in pred_label_list]
-                pred_label_bootstrap_list += pred_label_list_revised
+def compute_shared_confidence_interval_acc(dict_aspect2bucket2span, dict_aspect2bucket2span_pred, true_label_list,
+                                           pred_label_list, n_times=1000, seed=None):
+    """
+    Confidence intervals of the overall accuracy and of every bucket of every aspect, all computed from one set of
+    example resamples in a single pass. A bucket's accuracy in a replicate is over the resampled examples that fall
+    into it.
+    :param dict_aspect2bucket2span: aspect -> bucket interval -> gold sample ids ("2345|||Positive")
+    :param dict_aspect2bucket2span_pred: aspect -> bucket interval -> predicted sample ids
+    :return: (confidence_low, confidence_up) of the overall accuracy,
+             and aspect -> bucket interval -> (confidence_low, confidence_up)
+    """
+    correct = bs.encode_correctness(true_label_list, pred_label_list)
+    n_data = len(correct)
+    groups = [(None, None)]
+    stats = [correct, np.ones(n_data)]
+    for aspect, dict_bucket2span in dict_aspect2bucket2span.items():
+        for bucket_interval, spans_true in dict_bucket2span.items():
+            sids = np.fromiter((int(info.split("|||")[0]) for info in spans_true), dtype=np.int64)
+            in_bucket = np.bincount(sids, minlength=n_data)
+            groups.append((aspect, bucket_interval))
+            stats += [in_bucket * correct, in_bucket]
+
+    sums = bs.resample_sums(np.stack(stats, axis=1), bs.get_n_sampling(n_data), n_times, seed)
+    performance = bs.ratio_from_counts(sums[:, 0::2], sums[:, 1::2]) * 100
+    return split_shared_intervals(groups, *bs.summarize_replicates(performance, n_times))
+
+
+def split_shared_intervals(groups, confidence_low, confidence_up):
+    dict_aspect2ci = {}
+    for (aspect, bucket_interval), low, up in zip(groups[1:], confidence_low[1:], confidence_up[1:]):
+        dict_aspect2ci.setdefault(aspect, {})[bucket_interval] = (float(low), float(up))
+    return (float(confidence_low[0]), float(confidence_up[0])), dict_aspect2ci
+
+
+def update_bucket_confidence_interval(dict_aspect2bucket2perf, dict_aspect2ci):
+    """
+    Write shared confidence intervals into the [performance, num, confidence_low, confidence_up, ...] bucket records
+    """
+    for aspect, dict_bucket2ci in dict_aspect2ci.items():
+        for bucket_interval, (confidence_low, confidence_up) in dict_bucket2ci.items():
+            dict_aspect2bucket2perf[aspect][bucket_interval][2] = confidence_low
+            dict_aspect2bucket2perf[aspect][bucket_interval][3] = confidence_up
 
-        f1, p, r = evaluate_chunk_level(pred_label_bootstrap_list, true_label_bootstrap_list)
-        performance_list.append(f1)
 
-    if n_times != 1000:
-        confidence_low, confidence_up = mean_confidence_interval(performance_list)
-    else:
-        performance_list.sort()
-        confidence_low = performance_list[24]
-        confidence_up = performance_list[974]
+def get_aspect_bucket_perf(get_bucket_perf, dict_aspect2bucket2span, dict_aspect2bucket2span_pred, n_workers=1):
+    """
+    Bucket-wise performance of every aspect
+    :param get_bucket_perf: (dict_bucket2span, dict_bucket2span_pred) -> bucket interval -> bucket record,
+        e.g. a partial of ``get_bucket_f1``
+    :param n_workers: with more than one worker, every bucket of every aspect is evaluated as a separate task in a
+        process pool, see ``parallel.map_tasks``
+    :return: aspect -> bucket interval -> bucket record, buckets sorted by interval
+    """
+    if n_workers <= 1:
+        return {aspect: get_bucket_perf(dict_bucket2span, dict_aspect2bucket2span_pred[aspect])
+                for aspect, dict_bucket2span in dict_aspect2bucket2span.items()}
 
-    # print("\n")
-    # print("confidence_low:\t", confidence_low)
-    # print("confidence_up:\t", confidence_up)
+    def get_one_bucket_perf(task):
+        aspect, bucket_interval = task
+        # a bucket missing from the predictions is left to get_bucket_perf to report
+        dict_bucket2span_pred = {interval: spans for interval, spans in dict_aspect2bucket2span_pred[aspect].items()
+                                 if interval == bucket_interval}
+        return get_bucket_perf({bucket_interval: dict_aspect2bucket2span[aspect][bucket_interval]},
+                               dict_bucket2span_pred)
 
-    return confidence_low, confidence_up
+    tasks = [(aspect, bucket_interval) for aspect, dict_bucket2span in dict_aspect2bucket2span.items()
+             for bucket_interval in dict_bucket2span.keys()]
+    dict_aspect2bucket2perf = {aspect: {} for aspect in dict_aspect2bucket2span.keys()}
+    for (aspect, bucket_interval), dict_bucket2perf in zip(tasks, par.map_tasks(get_one_bucket_perf, tasks,
+                                                                                 n_workers)):
+        dict_aspect2bucket2perf[aspect].update(dict_bucket2perf)
+    return {aspect: sort_dict(dict_bucket2perf) for aspect, dict_bucket2perf in dict_aspect2bucket2perf.items()}
+
+
+def outside_label(table, span):
+    return "O"
 
 
 ################       Calculate Bucket-wise F1 Score:
-def get_bucket_f1(dict_bucket2span, dict_bucket2span_pred, dict_span2sid, dict_span2sid_pred):
-    print('------------------ attribute')
+def get_bucket_f1(dict_bucket2span, dict_bucket2span_pred, table_true, table_pred, get_span_case, is_print_ci,
+                  is_print_case, get_missing_label=outside_label, n_times=1000, new_sampler=cs.CaseSampler):
+    """
+    Span-level F1, confidence interval and error cases of every bucket of one aspect
+    :param dict_bucket2span: bucket interval -> rows of ``table_true``
+    :param dict_bucket2span_pred: bucket interval -> rows of ``table_pred``
+    :param get_span_case: (table, span) -> "span|||sentence" text used in error cases
+    :param get_missing_label: (table, span) -> the label reported for the other side when it has no span at the
+        same position; the case is skipped if it returns None
+    :param new_sampler: () -> the ``CaseSampler`` of the error cases of one bucket
+    :return: bucket interval -> [f1, #gold spans, confidence_low, confidence_up, error cases, counts], sorted by
+        interval, where the counts ``{"n_correct", "n_pred", "n_true"}`` of the bucket can be summed across runs
+    """
     dict_bucket2f1 = {}
-    for bucket_interval, spans_true in dict_bucket2span.items():
-        spans_pred = []
 
-        # print('bucket_interval: ',bucket_interval)
+    for bucket_interval, spans_true in dict_bucket2span.items():
         if bucket_interval not in dict_bucket2span_pred.keys():
-            # print(bucket_interval)
             raise ValueError("Predict Label Bucketing Errors")
-        else:
-            spans_pred = dict_bucket2span_pred[bucket_interval]
+        spans_pred = dict_bucket2span_pred[bucket_interval]
 
-        # print("debug----------")
-        # print(len(dict_span2sid))
-        # print(len(dict_span2sid_pred))
-
-        confidence_low, confidence_up = compute_confidence_interval_f1(spans_true, spans_pred, dict_span2sid,
-                                                                       dict_span2sid_pred)
+        confidence_low, confidence_up = 0, 0
+        if is_print_ci:
+            confidence_low, confidence_up = compute_confidence_interval_f1(spans_true, spans_pred, table_true,
+                                                                           table_pred, n_times)
 
         confidence_low = format(confidence_low, '.3g')
         confidence_up = format(confidence_up, '.3g')
 
-        f1, p, r = evaluate_chunk_level(spans_pred, spans_true)
-        print("-----------print spans_pred -------------")
-        print(spans_pred)
-
-        print("confidence_low:\t", confidence_low)
-        print("confidence_up:\t", confidence_up)
-        print("F1:\t", f1)
+        spans_correct = get_correct_spans(spans_true, spans_pred, table_true, table_pred)
+        f1, p, r = evaluate_chunk_counts(len(spans_correct), len(spans_pred), len(spans_true))
 
-        print("------------------------------------------")
+        error_entity_list = []
+        if is_print_case:
+            error_entity_list = get_bucket_error_case(spans_true, spans_correct, table_true, table_pred,
+                                                      get_span_case, get_missing_label, new_sampler())
 
-        dict_bucket2f1[bucket_interval] = [f1, len(spans_true), confidence_low, confidence_up]
+        dict_bucket2f1[bucket_interval] = [f1, len(spans_true), confidence_low, confidence_up, error_entity_list,
+                                           {"n_correct": len(spans_correct), "n_pred": len(spans_pred),
+                                            "n_true": len(spans_true)}]
 
-    # if bucket_interval[0] == 1.0:
-    # 	print("debug-f1:",f1)
-    # 	print(spans_pred[0:20])
-    # 	print(spans_true[0:20])
-    # print("dict_bucket2f1: ",dict_bucket2f1)
     return sort_dict(dict_bucket2f1)
 
 
-# dict_chunkid2span_sent:  2_3 -> New York|||This is New York city
-# dict_pos2tag: 2_3 -> NER
-def get_error_case(dict_pos2tag, dict_pos2tag_pred, dict_chunkid2span_sent, dict_chunkid2span_sent_pred):
-    error_case_list = []
-    for pos, tag in dict_pos2tag.items():
-
-        true_label = tag
-        pred_label = ""
-        # print(dict_chunkid2span_sent.keys())
-        if pos + "_" + tag not in dict_chunkid2span_sent.keys():
+def get_bucket_error_case(spans_true, spans_correct, table_true, table_pred, get_span_case,
+                          get_missing_label=outside_label, sampler=None):
+    """
+    The gold spans of a bucket that are not correctly predicted inside it and whose span at the same position is
+    missing or has another type, as "span|||sentence|||true label|||predicted label"
+    :param spans_true: rows of ``table_true`` in the bucket
+    :param spans_correct: the subset of ``spans_true`` returned by ``get_correct_spans``
+    :param sampler: the ``CaseSampler`` keeping the cases, stratified by label pair; None keeps all of them. A
+        sampler with a ``CaseWriter`` writes them as soon as the bucket is done and returns their ``CaseIndex``
+    """
+    sampler = sampler or cs.CaseSampler()
+    spans_true = np.asarray(spans_true, dtype=np.int64)
+    span_pred = table_true.pos_match[spans_true]
+    # the type vocabulary is shared, so equal labels have equal codes
+    is_same_type = np.zeros(len(spans_true), dtype=bool)
+    has_pred = span_pred >= 0
+    is_same_type[has_pred] = table_true.type_code[spans_true[has_pred]] == table_pred.type_code[span_pred[has_pred]]
+    is_error = ~np.isin(spans_true, spans_correct) & ~is_same_type
+
+    for span_true in spans_true[is_error]:
+        tag_true = table_true.get_type(span_true)
+        span_pred = table_true.pos_match[span_true]
+        tag_pred = table_pred.get_type(span_pred) if span_pred >= 0 else get_missing_label(table_true, span_true)
+        if tag_pred is None:
             continue
-        span_sentence = dict_chunkid2span_sent[pos + "_" + tag]
-
-        if pos in dict_pos2tag_pred.keys():
-            pred_label = dict_pos2tag_pred[pos]
-            if true_label == pred_label:
-                continue
-        else:
-            pred_label = "O"
-        error_case = span_sentence + "|||" + true_label + "|||" + pred_label
-        error_case_list.append(error_case)
+        # the case text is only built if the case is kept
+        slot = sampler.offer((tag_true, tag_pred))
+        if slot is not None:
+            sampler.put(slot, get_span_case(table_true, span_true) + "|||" + tag_true + "|||" + tag_pred)
 
-    for pos, tag in dict_pos2tag_pred.items():
+    return sampler.get_cases()
 
-        true_label = ""
-        pred_label = tag
-        if pos + "_" + tag not in dict_chunkid2span_sent_pred.keys():
-            continue
-        span_sentence = dict_chunkid2span_sent_pred[pos + "_" + tag]
 
-        if pos in dict_pos2tag.keys():
-            true_label = dict_pos2tag[pos]
-            if true_label == pred_label:
+def get_error_case(table_true, table_pred, get_span_case, get_missing_label=outside_label, is_print_pred=True,
+                   sampler=None):
+    """
+    Every gold span (and, if ``is_print_pred``, every predicted span) whose counterpart at the same position is
+    missing or has another type, as "span|||sentence|||true label|||predicted label"
+    :param get_span_case: (table, span) -> "span|||sentence" text of a span
+    :param get_missing_label: (table, span) -> the label reported for the other side when it has no span at the
+        same position; the case is skipped if it returns None
+    :param sampler: the ``CaseSampler`` keeping the cases, stratified by label pair; None keeps all of them. A
+        sampler with a ``CaseWriter`` writes them once they are all found and returns their ``CaseIndex``
+    """
+    sampler = sampler or cs.CaseSampler()
+    sides = [(table_true, table_pred, False)]
+    if is_print_pred:
+        sides.append((table_pred, table_true, True))
+    for table, table_other, is_pred in sides:
+        # only spans without an identical counterpart can be errors
+        for span in np.flatnonzero(table.match < 0):
+            span_other = table.pos_match[span]
+            label_other = table_other.get_type(span_other) if span_other >= 0 else get_missing_label(table, span)
+            if label_other is None:
                 continue
-        else:
-            true_label = "O"
-        error_case = span_sentence + "|||" + true_label + "|||" + pred_label
-        error_case_list.append(error_case)
-
-    # print(error_case_list)
-    return error_case_list
-
-
-def get_error_case_classification(true_label_list, pred_label_list, out1_list, out2_list=None):
-    error_case_list = []
-    if out2_list:
+            label = table.get_type(span)
+            true_label, pred_label = (label_other, label) if is_pred else (label, label_other)
+            slot = sampler.offer((true_label, pred_label))
+            if slot is not None:
+                sampler.put(slot, get_span_case(table, span) + "|||" + true_label + "|||" + pred_label)
+
+    return sampler.get_cases()
+
+
+def get_error_case_classification(true_label_list, pred_label_list, out1_list, out2_list=None, sampler=None,
+                                  label_names=None):
+    # label_names: the vocabulary of the labels if they are numpy code arrays, see ``MappedTsv.get_codes``
+    sampler = sampler or cs.CaseSampler()
+    if label_names is not None:
+        # only the wrong predictions are visited, and only their labels are looked up
+        for i in np.flatnonzero(true_label_list != pred_label_list).tolist():
+            true_label, pred_label = label_names[true_label_list[i]], label_names[pred_label_list[i]]
+            slot = sampler.offer((true_label, pred_label))
+            if slot is not None:
+                outs = [out1_list[i]] if out2_list is None else [out1_list[i], out2_list[i]]
+                sampler.put(slot, '|||'.join([true_label, pred_label] + [format4json2(out) for out in outs]))
+    elif out2_list:
         for true_label, pred_label, out1, out2 in zip(true_label_list, pred_label_list, out1_list, out2_list):
             if true_label != pred_label:
-                error_case_list.append('|||'.join([true_label, pred_label, format4json2(out1), format4json2(out2)]))
+                slot = sampler.offer((true_label, pred_label))
+                if slot is not None:
+                    sampler.put(slot, '|||'.join([true_label, pred_label, format4json2(out1), format4json2(out2)]))
     else:
         for true_label, pred_label, out1 in zip(true_label_list, pred_label_list, out1_list):
             if true_label != pred_label:
-                error_case_list.append('|||'.join([true_label, pred_label, format4json2(out1)]))
-    return error_case_list
+                slot = sampler.offer((true_label, pred_label))
+                if slot is not None:
+                    sampler.put(slot, '|||'.join([true_label, pred_label, format4json2(out1)]))
+    return sampler.get_cases()
 
 
 def get_bucket_acc(dict_bucket2span, dict_bucket2span_pred):
@@ -557,12 +642,28 @@ def compute_holistic_f1(fn_result, delimiter=" "):
     return f1
 
 
-def accuracy(labels, predictions, language=None):
-    correct = sum([int(p == l) for p, l in zip(predictions, labels)])
-    accuracy = float(correct) / len(predictions)
+def accuracy_counts(labels, predictions):
+    """
+    :return: (number of correct predictions, number of predictions)
+    """
+    if isinstance(labels, np.ndarray) and isinstance(predictions, np.ndarray):
+        # label codes are compared in one vectorized pass
+        return int(np.count_nonzero(labels == predictions)), len(predictions)
+    return sum([int(p == l) for p, l in zip(predictions, labels)]), len(predictions)
+
+
+def accuracy_from_counts(correct, total):
+    # an empty bucket, which only bucketing by fixed intervals can produce, scores 0
+    if total == 0:
+        return 0.
+    accuracy = float(correct) / total
     return accuracy * 100
 
 
+def accuracy(labels, predictions, language=None):
+    return accuracy_from_counts(*accuracy_counts(labels, predictions))
+
+
 def get_ci_interval(confidence_val, confidence_delta):
     info = "(" + str(confidence_val) + "-" + str(confidence_delta) + ", " + str(confidence_val) + "+" + str(
         confidence_delta) + ")"
@@ -605,6 +706,7 @@ def get_avg(res):
 
 
 def word_segment2(sent):
+    from nltk.tokenize import TweetTokenizer
     tknzr = TweetTokenizer()
     token_list = tknzr.tokenize(sent)
     return token_list
@@ -683,162 +785,209 @@ def tuple2str(triplet):
     return res.rstrip("|||")
 
 
-def bucket_attribute_specified_bucket_value(dict_span2att_val, n_buckets, hardcoded_bucket_values):
-    ################       Bucketing different Attributes
-
-    # hardcoded_bucket_values = [set([float(0), float(1)])]
-    # print("!!!debug-7--")
+def get_equal_frequency_buckets(att_vals, n_buckets, hardcoded_bucket_values):
+    """
+    Split numeric attribute values into roughly equal-sized buckets of consecutive values
+    Every value listed in ``hardcoded_bucket_values`` that occurs gets a bucket ``(v,)`` of its own. The remaining
+    values are walked in ascending order and a bucket is closed as soon as it holds more than its share of spans.
+    The last bucket is left open towards 1.0 (for ratios) or towards infinity.
+    :param att_vals: attribute value of each span
+    :param n_buckets: the number of buckets, including the hardcoded ones
+    :param hardcoded_bucket_values: values that get a bucket of their own
+    :return: (intervals, list of index arrays into ``att_vals``), spans ordered by value inside each bucket
+    """
     p_infinity = 1000000
     n_infinity = -1000000
-    n_spans = len(dict_span2att_val)
-    dict_att_val2span = reverse_dict(dict_span2att_val)
-    dict_att_val2span = sort_dict(dict_att_val2span)
-    dict_bucket2span = {}
-
-    for backet_value in hardcoded_bucket_values:
-        if backet_value in dict_att_val2span.keys():
-            # print("------------work!!!!---------")
-            # print(backet_value)
-            dict_bucket2span[(backet_value,)] = dict_att_val2span[backet_value]
-            n_spans -= len(dict_att_val2span[backet_value])
+    att_vals = np.asarray(att_vals, dtype=np.float64)
+    n_spans = len(att_vals)
+    intervals, bucket_spans = [], []
+
+    is_hardcoded = np.zeros(n_spans, dtype=bool)
+    for bucket_value in hardcoded_bucket_values:
+        is_value = att_vals == float(bucket_value)
+        if is_value.any():
+            intervals.append((bucket_value,))
+            bucket_spans.append(np.flatnonzero(is_value))
+            is_hardcoded |= is_value
+            n_spans -= int(is_value.sum())
             n_buckets -= 1
 
-    avg_entity = n_spans * 1.0 / n_buckets
-    n_tmp = 0
-    entity_list = []
-    val_list = []
-
-    #
-    # print("-----avg_entity----------")
-    # print(avg_entity)
+    # the other spans by ascending value, keeping the input order among equal values
+    rest = np.flatnonzero(~is_hardcoded)
+    rest = rest[np.argsort(att_vals[rest], kind="stable")]
+    distinct_vals, val_starts, val_counts = np.unique(att_vals[rest], return_index=True, return_counts=True)
+    if len(distinct_vals) == 0:
+        return intervals, bucket_spans
 
-    for att_val, entity in dict_att_val2span.items():
-        if att_val in hardcoded_bucket_values:
-            continue
-
-        # print("debug-att_val:\t",att_val)
-        val_list.append(att_val)
-        entity_list += entity
-        n_tmp += len(entity)
-
-        # print(att_val)
-        # print(n_tmp, avg_entity)
-
-        if n_tmp > avg_entity:
+    # a bucket is closed once it holds more than avg_entity spans, i.e. at least min_size of them
+    avg_entity = n_spans * 1.0 / n_buckets
+    min_size = max(int(np.floor(avg_entity)) + 1, 1)
+    cum_counts = np.cumsum(val_counts)
+    first = 0
+    while first < len(distinct_vals):
+        n_before = cum_counts[first - 1] if first > 0 else 0
+        last = int(np.searchsorted(cum_counts, n_before + min_size))
+        if last >= len(distinct_vals):
+            break
+        if last > first:
+            intervals.append((float(distinct_vals[first]), float(distinct_vals[last])))
+        else:
+            intervals.append((float(distinct_vals[first]),))
+        bucket_spans.append(rest[val_starts[first]:val_starts[last] + val_counts[last]])
+        first = last + 1
 
-            if len(val_list) >= 2:
-                key_bucket = (val_list[0], val_list[-1])
-                dict_bucket2span[key_bucket] = entity_list
-            # print("debug key bucket:\t", key_bucket)
-            else:
-                dict_bucket2span[(val_list[0],)] = entity_list
-            entity_list = []
-            n_tmp = 0
-            val_list = []
-    if n_tmp != 0:
+    if first < len(distinct_vals):
         if n_buckets == 1:
-            dict_bucket2span[(n_infinity, p_infinity)] = entity_list
+            intervals.append((n_infinity, p_infinity))
         else:
-            if val_list[0] <= 1:
+            if distinct_vals[first] <= 1:
                 p_infinity = 1.0
-            # print("!!!!!-debug-2")
-            if len(val_list) >= 2:
-                key_bucket = (val_list[0], p_infinity)
-                dict_bucket2span[key_bucket] = entity_list
-            else:
-                dict_bucket2span[(val_list[0], p_infinity)] = entity_list  # fix bugs
-    #
-    #
-    #
-    # [(0,), (0.1, 0.2), (0.3,0.4), (0.5, 0.6)] --> [(0,), (0,0.2), (0.2, 0.4), (0.4, 0.6)]
-    # dict_old2new = interval_transformer(dict_bucket2span.keys())
-    # dict_bucket2span_new = {}
-    # for inter_list, span_list in dict_bucket2span.items():
-    # 	dict_bucket2span_new[dict_old2new[inter_list]] = span_list
+            intervals.append((float(distinct_vals[first]), p_infinity))
+        bucket_spans.append(rest[val_starts[first]:])
 
-    return dict_bucket2span
+    return intervals, bucket_spans
 
 
-def bucket_attribute_discrete_value(dict_span2att_val=None, n_buckets=100000000, n_entities=1):
-    ################          Bucketing different Attributes
+def bucket_attribute_specified_bucket_value(att_vals, n_buckets, hardcoded_bucket_values):
+    """
+    Equal-frequency buckets of numeric attribute values, see ``get_equal_frequency_buckets``
+    :param att_vals: attribute value of each span, e.g. by row of the span table
+    :return: interval -> index array into ``att_vals``
+    """
+    intervals, bucket_spans = get_equal_frequency_buckets(att_vals, n_buckets, hardcoded_bucket_values)
+    return dict(zip(intervals, bucket_spans))
 
-    # print("!!!!!debug---------")
-    # 	hardcoded_bucket_values = [set([float(0), float(1)])]
-    n_spans = len(dict_span2att_val)
-    dict_bucket2span = {}
 
-    dict_att_val2span = reverse_dict_discrete(dict_span2att_val)
-    dict_att_val2span = sort_dict(dict_att_val2span, flag="value")
+def get_att_vals(dict_span2att_val):
+    """
+    The attribute values of a span -> value dict as an array, in the order of its spans
+    """
+    return np.asarray(list(dict_span2att_val.values()))
 
-    # dict["q_id"] = 2
 
-    avg_entity = n_spans * 1.0 / n_buckets
-    n_tmp = 0
-    entity_list = []
-    val_list = []
+def name_buckets(dict_bucket2index, spans):
+    """
+    Buckets of span indices as buckets of the spans at these indices, e.g. the "2345|||Positive" ids of the
+    classification tasks
+    :return: interval -> list of spans
+    """
+    return {interval: [spans[i] for i in index.tolist()] for interval, index in dict_bucket2index.items()}
 
-    n_total = 1
-    for att_val, entity in dict_att_val2span.items():
 
-        if len(entity) < n_entities or n_total > n_buckets:
-            break
-        dict_bucket2span[(att_val,)] = entity
+def bucket_attribute_discrete_value(att_vals, n_buckets=100000000, n_entities=1):
+    """
+    One bucket ``(v,)`` per distinct value, e.g. per tag, for the n_buckets most frequent values that occur at least
+    n_entities times; values equally frequent keep the order they first occur in
+    :param att_vals: attribute value of each span, e.g. by row of the span table
+    :return: interval -> index array into ``att_vals``, spans in their order
+    """
+    att_vals = np.asarray(att_vals)
+    distinct_vals, first, inverse, counts = np.unique(att_vals, return_index=True, return_inverse=True,
+                                                      return_counts=True)
+    by_val = np.argsort(inverse, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(counts)])
 
-        n_total += 1
+    dict_bucket2span = {}
+    for n_total, i in enumerate(np.lexsort((first, -counts)).tolist(), 1):
+        if counts[i] < n_entities or n_total > n_buckets:
+            break
+        dict_bucket2span[(distinct_vals[i].item(),)] = by_val[bounds[i]:bounds[i + 1]]
 
     return dict_bucket2span
 
 
-def bucket_attribute_specified_bucket_interval(dict_span2att_val, intervals):
-    ################       Bucketing different Attributes
+def get_bucket_ids(att_vals, intervals):
+    """
+    Assign every attribute value to the first interval that contains it, as ``find_key`` does:
+    ``(v,)`` holds exactly v and ``(lo, hi)`` is the closed interval [lo, hi]
+    :param att_vals: numeric attribute values
+    :param intervals: bucket intervals, earlier ones win where they overlap
+    :return: numpy int64 array with the index into ``intervals`` of each value, -1 if it falls into no bucket
+    """
+    att_vals = np.asarray(att_vals, dtype=np.float64)
+    n_intervals = len(intervals)
+    # n_intervals stands for "no bucket" so that np.minimum keeps the earliest match
+    bucket_ids = np.full(len(att_vals), n_intervals, dtype=np.int64)
+
+    singles = [(k[0], i) for i, k in enumerate(intervals) if len(k) == 1]
+    if len(singles) > 0:
+        single_vals = np.array([v for v, i in singles], dtype=np.float64)
+        single_ids = np.array([i for v, i in singles], dtype=np.int64)
+        order = np.lexsort((single_ids, single_vals))
+        single_vals, first = np.unique(single_vals[order], return_index=True)
+        single_ids = single_ids[order][first]
+        pos = np.minimum(np.searchsorted(single_vals, att_vals), len(single_vals) - 1)
+        bucket_ids = np.where(single_vals[pos] == att_vals, single_ids[pos], bucket_ids)
+
+    ranges = sorted((k[0], k[1], i) for i, k in enumerate(intervals) if len(k) == 2)
+    if len(ranges) > 0:
+        lows = np.array([r[0] for r in ranges], dtype=np.float64)
+        highs = np.array([r[1] for r in ranges], dtype=np.float64)
+        range_ids = np.array([r[2] for r in ranges], dtype=np.int64)
+        if np.all(highs[:-1] < lows[1:]):
+            # disjoint intervals: the only candidate is the last one starting at or below the value
+            pos = np.searchsorted(lows, att_vals, side="right") - 1
+            pos_valid = np.maximum(pos, 0)
+            in_range = (pos >= 0) & (att_vals <= highs[pos_valid])
+            bucket_ids = np.where(in_range, np.minimum(bucket_ids, range_ids[pos_valid]), bucket_ids)
+        else:
+            for low, high, i in ranges:
+                in_range = (att_vals >= low) & (att_vals <= high)
+                bucket_ids = np.where(in_range, np.minimum(bucket_ids, i), bucket_ids)
 
-    # hardcoded_bucket_values = [set([float(0), float(1)])]
+    bucket_ids[bucket_ids == n_intervals] = -1
+    return bucket_ids
 
-    # intervals = [0, (0,0.5], (0.5,0.9], (0.99,1]]
 
-    dict_bucket2span = {}
-    n_spans = len(dict_span2att_val)
-
-    # print("!!!!!!!enter into bucket_attribute_SpecifiedBucketInterval")
-
-    # print(intervals)
-
-    if type(list(intervals)[0][0]) == type("string"):  # discrete value, such as entity tags
-        dict_att_val2span = reverse_dict_discrete(dict_span2att_val)
-        dict_att_val2span = sort_dict(dict_att_val2span, flag="value")
-        for att_val, entity in dict_att_val2span.items():
-            att_val_tuple = (att_val,)
-            if att_val_tuple in intervals:
-                if att_val_tuple not in dict_bucket2span.keys():
-                    dict_bucket2span[att_val_tuple] = entity
-                else:
-                    dict_bucket2span[att_val_tuple] += entity
-
-        for val in intervals:
-            if val not in dict_bucket2span.keys():
-                dict_bucket2span[val] = []
-    # print("dict_bucket2span: ",dict_bucket2span)
-    else:
-        # print("---debug----5")
-        # print(intervals)
-        dict_att_val2span = reverse_dict(dict_span2att_val)
-        dict_att_val2span = sort_dict(dict_att_val2span)
-        for v in intervals:
-            if len(v) == 1:
-                dict_bucket2span[v] = []
-            else:
-                dict_bucket2span[v] = []
+def group_by_bucket(bucket_ids, intervals, order=None):
+    """
+    Collect spans into their buckets
+    :param bucket_ids: index into ``intervals`` of each span, -1 to leave a span out
+    :param order: optional permutation of the spans giving their order inside each bucket
+    :return: interval -> index array of the spans, with every interval present
+    """
+    bucket_ids = np.asarray(bucket_ids, dtype=np.int64)
+    spans = np.arange(len(bucket_ids))
+    if order is not None:
+        spans = spans[order]
+        bucket_ids = bucket_ids[order]
+    # a stable sort keeps the given order of spans within a bucket
+    by_bucket = np.argsort(bucket_ids, kind="stable")
+    bounds = np.searchsorted(bucket_ids[by_bucket], np.arange(len(intervals) + 1))
 
-        # print("debug-interval:\t", intervals)
+    dict_bucket2span = {}
+    for i, interval in enumerate(intervals):
+        dict_bucket2span[interval] = spans[by_bucket[bounds[i]:bounds[i + 1]]]
+    return dict_bucket2span
 
-        for att_val, entity in dict_att_val2span.items():
-            res_key = find_key(dict_bucket2span, att_val)
-            # print("res-key:\t"+ str(res_key))
-            if res_key == None:
-                continue
-            dict_bucket2span[res_key] += entity
 
-    return dict_bucket2span
+def bucket_attribute_specified_bucket_interval(att_vals, intervals):
+    """
+    Bucket spans by given intervals, e.g. the predicted spans by the buckets found on the gold side
+    :param att_vals: attribute value of each span, e.g. by row of the span table, or a span -> value dict whose
+        buckets then hold its spans
+    :param intervals: tuples of discrete values ``(tag,)``, or of numbers ``(v,)`` and ``(lo, hi)``
+    :return: interval -> index array into ``att_vals``, spans ordered by attribute value
+    """
+    if isinstance(att_vals, dict):
+        return name_buckets(bucket_attribute_specified_bucket_interval(get_att_vals(att_vals), intervals),
+                            list(att_vals.keys()))
+    att_vals = np.asarray(att_vals)
+    intervals = list(intervals)
+    if len(intervals) == 0:
+        return {}
+
+    if type(intervals[0][0]) == type("string"):  # discrete value, such as entity tags
+        dict_val2bucket = {}
+        for i, interval in enumerate(intervals):
+            dict_val2bucket.setdefault(interval[0], i)
+        bucket_ids = np.fromiter((dict_val2bucket.get(att_val, -1) for att_val in att_vals.tolist()),
+                                 dtype=np.int64, count=len(att_vals))
+        return group_by_bucket(bucket_ids, intervals)
+
+    att_vals = np.asarray(att_vals, dtype=np.float64)
+    bucket_ids = get_bucket_ids(att_vals, intervals)
+    return group_by_bucket(bucket_ids, intervals, order=np.argsort(att_vals, kind="stable"))
 
 
 def print_dict(dict_obj, info="dict"):
@@ -889,8 +1038,8 @@ def beautify_interval(interval):
 
 
 def ensure_dir(f):
-    if not os.path.exists(f):
-        os.makedirs(f)
+    # concurrent runs, e.g. the threads of the server, may make it at the same time
+    os.makedirs(f, exist_ok=True)
 
 
 def load_json(path):
@@ -900,14 +1049,98 @@ def load_json(path):
     return json_template
 
 
-def save_json(obj_json, path):
-    with open(path, "w") as f:
-        json.dump(obj_json, f, indent=4, ensure_ascii=False)
+# report keys holding lists of error cases
+ERROR_CASE_KEYS = ("error_case", "bucket_error_case")
+
+
+def save_json(obj_json, path, path_cases=None):
+    """
+    Write a report; json.dump encodes it chunk by chunk straight into the file
+    :param path: the report file, None to only finish the report in memory (the error case counts)
+    :param path_cases: if given, the error cases are moved out of the report into this JSON lines file, see
+        ``save_error_cases``, and the report refers to it, relative to its own directory, under "error_case_file".
+        Either a path, or the ``CaseWriter`` the samplers have already written most cases to, which is closed. The
+        report, which then only holds offset indices, is written without indentation
+    """
+    add_case_counts(obj_json)
+    if path_cases is not None:
+        case_writer = path_cases if isinstance(path_cases, cs.CaseWriter) else cs.CaseWriter(path_cases)
+        with case_writer:
+            save_error_cases(obj_json, case_writer)
+        obj_json["error_case_file"] = os.path.relpath(case_writer.path_cases, os.path.dirname(os.path.abspath(path)))
+    if path is not None:
+        with open(path, "w") as f:
+            json.dump(obj_json, f, indent=None if path_cases is not None else 4, ensure_ascii=False)
+
+
+def add_case_counts(obj_json):
+    """
+    Next to every list of error cases sampled with a cap, see ``CaseSampler``, add the exact number of cases under
+    "<key>_num", and under "<key>_strata" the number per "true label|||predicted label" if the sample is stratified
+    """
+    if isinstance(obj_json, dict):
+        for key, value in list(obj_json.items()):
+            if key in ERROR_CASE_KEYS and isinstance(value, (cs.CaseSample, cs.CaseIndex)):
+                if value.max_cases is not None:
+                    obj_json[key + "_num"] = value.n_cases
+                if value.dict_stratum2count is not None:
+                    obj_json[key + "_strata"] = {"|||".join(stratum): count for stratum, count in
+                                                 value.dict_stratum2count.items()}
+            else:
+                add_case_counts(value)
+    elif isinstance(obj_json, list):
+        for value in obj_json:
+            add_case_counts(value)
+
+
+def save_error_cases(obj_json, case_writer):
+    """
+    Move every list of error cases of a report that is still in memory into a ``CaseWriter``, one JSON-encoded case
+    per line, and replace it with its offset index {"offset": byte offset of its first case, "count": number of
+    cases}, so that a reader seeks straight to the cases of one bucket, see ``load_error_cases``. The lists are
+    released as they are written
+    """
+    if isinstance(obj_json, dict):
+        for key, value in obj_json.items():
+            if key in ERROR_CASE_KEYS and isinstance(value, list):
+                obj_json[key] = case_writer.write(value)
+            else:
+                save_error_cases(value, case_writer)
+    elif isinstance(obj_json, list):
+        for value in obj_json:
+            save_error_cases(value, case_writer)
+
+
+def load_error_cases(path_cases, index):
+    """
+    Read the error cases of one offset index written by ``save_error_cases``
+    """
+    with open(path_cases, "rb") as fin:
+        fin.seek(index["offset"])
+        return [json.loads(fin.readline()) for _ in range(index["count"])]
+
+
+# the parsed configurations of the tasks, by task directory and modification times of its files
+_loaded_task_confs = {}
 
 
 def load_task_conf(task_dir):
+    """
+    The aspect configuration, the paths of the precomputed statistics and a fresh report template of a task. The
+    files are parsed once per process, and again when they change, so that a long-running process such as the
+    server only reads them once
+    :return: (dict_aspect_func, dict_precomputed_path, obj_json), which the caller may modify
+    """
     path_aspect_conf = os.path.join(task_dir, "conf.aspects")
     path_json_input = os.path.join(task_dir, "template.json")
+    key = (os.path.abspath(task_dir), os.stat(path_aspect_conf).st_mtime_ns, os.stat(path_json_input).st_mtime_ns)
+    if key not in _loaded_task_confs:
+        _loaded_task_confs[key] = parse_task_conf(path_aspect_conf, path_json_input)
+    dict_aspect_func, dict_precomputed_path, obj_json = _loaded_task_confs[key]
+    return dict(dict_aspect_func), dict(dict_precomputed_path), copy.deepcopy(obj_json)
+
+
+def parse_task_conf(path_aspect_conf, path_json_input):
     # config file
     dict_aspect_func = load_conf(path_aspect_conf)
     print("dict_aspect_func: ", dict_aspect_func)
@@ -1032,22 +1265,7 @@ def read_tag(file):
 
 
 def read_single_column(file, k):
-    labels = []
-    example = []
-    labels_holistic = []
-    with open(file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                if len(line.split("\t")) != 3:
-                    print(line)
-                example.append(line.split("\t")[k])
-                labels_holistic.append(line.split("\t")[k])
-            else:
-                labels.append(example)
-                example = []
-    if example:
-        labels.append(example)
+    (labels, labels_holistic), = du.conll_to_lists(file, (k,))
     return labels, labels_holistic
 
 
@@ -1065,13 +1283,52 @@ def bucc_f1(labels, predictions, language=None):
 
 
 def f1(labels, predictions, language=None):
+    from seqeval.metrics import precision_score, recall_score, f1_score
     f1 = f1_score(labels, predictions)
     precision = precision_score(labels, predictions)
     recall = recall_score(labels, predictions)
     return {'f1': f1 * 100, 'precision': precision * 100, 'recall': recall * 100}
 
 
-def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict_sid2sent, is_print_ci, is_print_case):
+def is_seqeval_spans(list_true_tags_sent, list_pred_tags_sent, table_true, table_pred):
+    """
+    Whether the gold and predicted spans, extracted with ``get_chunks``, are exactly the entities seqeval extracts
+
+    The two agree for IOB tags whose type has no hyphen and types that do not differ only in case (the span tasks
+    lowercase them), as long as no span runs across a sentence boundary: seqeval ends every entity with its sentence
+    """
+    tags = set(itertools.chain.from_iterable(list_true_tags_sent)) | set(
+        itertools.chain.from_iterable(list_pred_tags_sent))
+    types = {tag[2:] for tag in tags if tag != 'O'}
+    if not all(tag == 'O' or (tag[:2] in ('B-', 'I-') and '-' not in tag[2:]) for tag in tags) or \
+            len(types) != len({span_type.lower() for span_type in types}):
+        return False
+    sent_ends = np.cumsum([len(sent) for sent in list_true_tags_sent], dtype=np.int64)
+    return not any(np.any(table.end > sent_ends[table.sent_id]) for table in (table_true, table_pred))
+
+
+def span_f1(list_true_tags_sent, list_pred_tags_sent, table_true, table_pred):
+    """
+    Holistic P/R/F1 in percent, identical to ``f1``, counted from the gold and predicted span tables of the run
+    instead of extracting the entities again from the tags; falls back to ``f1`` when the spans are not seqeval's
+    """
+    if not is_seqeval_spans(list_true_tags_sent, list_pred_tags_sent, table_true, table_pred):
+        return f1(list_true_tags_sent, list_pred_tags_sent)
+    match = table_true.match if table_true.match is not None else st.match_spans(table_true, table_pred)
+    n_correct = int(np.count_nonzero(match >= 0))
+    # seqeval's zero-division handling: every undefined score is 0
+    precision = n_correct / len(table_pred) if len(table_pred) else 0.
+    recall = n_correct / len(table_true) if len(table_true) else 0.
+    f1_score = 2 * precision * recall / (precision + recall) if precision + recall else 0.
+    return {'f1': f1_score * 100, 'precision': precision * 100, 'recall': recall * 100}
+
+
+def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, sent_list, is_print_ci, is_print_case,
+                                   new_sampler=cs.CaseSampler, label_names=None):
+    # sent_list holds the text of each sample, indexed by sentence id
+    # new_sampler: () -> the CaseSampler of the error cases of one bucket
+    # label_names: the vocabulary of the labels if the spans hold label codes, which are looked up for error cases
+    # the last element of a bucket record holds the counts {"n_correct", "n_total"} the accuracy is computed from
     # The structure of span_true or span_pred
     # 2345|||Positive
     # 2345 represents sentence id
@@ -1089,23 +1346,28 @@ def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict
         # loop over samples from a given bucket
         error_case_bucket_list = []
         if is_print_case:
+            sampler = new_sampler()
             for info_true, info_pred in zip(spans_true, spans_pred):
                 sid_true, label_true = info_true.split("|||")
                 sid_pred, label_pred = info_pred.split("|||")
                 if sid_true != sid_pred:
                     continue
 
-                sent = dict_sid2sent[sid_true]
                 if label_true != label_pred:
-                    error_case_info = label_true + "|||" + label_pred + "|||" + sent
-                    error_case_bucket_list.append(error_case_info)
-
-        accuracy_each_bucket = accuracy(spans_pred, spans_true)
+                    if label_names is not None:
+                        label_true, label_pred = label_names[int(label_true)], label_names[int(label_pred)]
+                    slot = sampler.offer((label_true, label_pred))
+                    if slot is not None:
+                        sampler.put(slot, label_true + "|||" + label_pred + "|||" + sent_list[int(sid_true)])
+            error_case_bucket_list = sampler.get_cases()
+
+        n_correct, n_total = accuracy_counts(spans_pred, spans_true)
+        accuracy_each_bucket = accuracy_from_counts(n_correct, n_total)
         confidence_low, confidence_up = 0, 0
         if is_print_ci:
             confidence_low, confidence_up = compute_confidence_interval_acc(spans_pred, spans_true)
         dict_bucket2f1[bucket_interval] = [accuracy_each_bucket, len(spans_true), confidence_low, confidence_up,
-                                           error_case_bucket_list]
+                                           error_case_bucket_list, {"n_correct": n_correct, "n_total": n_total}]
 
     return sort_dict(dict_bucket2f1)
 
@@ -1217,13 +1479,31 @@ def calculate_ece_by_file(file_path, prob_col, right_or_not_col=None, answer_col
     dic :the details of the ECE information in json format
     """
 
+    return get_calibration(get_ece_bins_by_file(file_path, prob_col, right_or_not_col, answer_cols, size_of_bin),
+                           dataset, model)
+
+
+def get_ece_bins_by_file(file_path, prob_col, right_or_not_col=None, answer_cols=None, size_of_bin=10):
+    """
+    The per-bin sums of ``calculate_ece_by_file``, which can be added up across files
+    :return: [total probability, total right, count] of every bin
+    """
     probability_list, right_or_not_list = du.get_probability_right_or_not(file_path, prob_col=prob_col,
                                                                           right_or_not_col=right_or_not_col,
                                                                           answer_cols=answer_cols)
 
     raw_list = list(zip(probability_list, right_or_not_list))
 
-    bin_list = divide_into_bin(size_of_bin, raw_list)
+    return get_bin_sums(size_of_bin, raw_list)
+
+
+def get_calibration(bin_sums, dataset='atis', model='lstm-self-attention'):
+    """
+    ECE and its details in json format from the per-bin sums of ``get_ece_bins_by_file``
+    :return: (ece, dic) as returned by ``calculate_ece_by_file``
+    """
+    size_of_bin = len(bin_sums)
+    bin_list = get_bin_averages(bin_sums)
 
     ece = calculate_ece(bin_list)
     dic = collections.OrderedDict()
@@ -1243,6 +1523,10 @@ def calculate_ece_by_file(file_path, prob_col, right_or_not_col=None, answer_col
 
 
 def divide_into_bin(size_of_bin, raw_list):
+    return get_bin_averages(get_bin_sums(size_of_bin, raw_list))
+
+
+def get_bin_sums(size_of_bin, raw_list):
     bin_list = []
     basic_width = 1 / size_of_bin
 
@@ -1262,29 +1546,49 @@ def divide_into_bin(size_of_bin, raw_list):
     result_list = []
     for i in range(0, size_of_bin):
         value = bin_list[i]
-        if len(value) == 0:
-            result_list.append([None, None, 0])
-            continue
         total_probability = 0
         total_right = 0
         for result in value:
             total_probability = total_probability + result[0]
             total_right = total_right + result[1]
-        result_list.append([total_probability / len(value), total_right / (len(value)), len(value)])
+        result_list.append([total_probability, total_right, len(value)])
+
+    return result_list
+
+
+def get_bin_averages(bin_sums):
+    result_list = []
+    for total_probability, total_right, count in bin_sums:
+        if count == 0:
+            result_list.append([None, None, 0])
+            continue
+        result_list.append([total_probability / count, total_right / count, count])
 
     return result_list
 
 
-def select_bucketing_func(func_name, func_setting, dict_obj):
+def select_bucketing_func(func_name, func_setting, att_vals, intervals=None):
+    """
+    Bucket the spans of one aspect with the bucketing function of its configuration
+    :param att_vals: attribute value of each span, e.g. by row of the span table, or a span -> value dict, such as
+        the "2345|||Positive" spans of the classification tasks, whose buckets then hold its spans
+    :param intervals: fixed bucket intervals used instead, e.g. those of an earlier run (see ``bucket_stats``)
+    :return: interval -> index array into ``att_vals``
+    """
+    if isinstance(att_vals, dict):
+        return name_buckets(select_bucketing_func(func_name, func_setting, get_att_vals(att_vals), intervals),
+                            list(att_vals.keys()))
+    if intervals is not None:
+        return bucket_attribute_specified_bucket_interval(att_vals, intervals)
     if func_name == "bucket_attribute_SpecifiedBucketInterval":
-        return bucket_attribute_specified_bucket_interval(dict_obj, eval(func_setting))
+        return bucket_attribute_specified_bucket_interval(att_vals, eval(func_setting))
     else:
         fs1, fs2 = func_setting.split("\t")
         if func_name == "bucket_attribute_SpecifiedBucketValue":
             n_buckets, specified_bucket_value_list = int(fs1), eval(fs2)
-            return bucket_attribute_specified_bucket_value(dict_obj, n_buckets, specified_bucket_value_list)
+            return bucket_attribute_specified_bucket_value(att_vals, n_buckets, specified_bucket_value_list)
         elif func_name == "bucket_attribute_DiscreteValue":  # now the discrete value is R-tag..
             topK_buckets, min_buckets = int(fs1), int(fs2)
-            return bucket_attribute_discrete_value(dict_obj, topK_buckets, min_buckets)
+            return bucket_attribute_discrete_value(att_vals, topK_buckets, min_buckets)
         else:
             raise ValueError(f'Illegal bucketing function {func_name}')
@@ -1,47 +1,261 @@
+import os
 import sys
+import json
 import string
 import argparse
+import importlib
+import explainaboard.bucket_stats as bst
+import explainaboard.error_analysis as ea
+import explainaboard.precomputed as pc
+import explainaboard.report_cache as rc
+import explainaboard.sharding as sh
 import explainaboard.tasks
 
 
+def get_eval_module(task):
+    '''
+    Import the evaluation module of a task on first use, so that a run only loads its own task
+    '''
+    return importlib.import_module(f'explainaboard.tasks.{task}.eval_spec')
+
+
 def run_explainaboard(task, systems, output, dataset_name = 'dataset_name', model_name = 'model_name',
                       analysis_type='single', is_print_ci=False, is_print_case=False,
-                      is_print_ece=False):
+                      is_print_ece=False, ci_mode='independent', n_workers=1, cache_dir=None,
+                      report_cache_dir=None, case_file=None, max_cases=None, stratify_cases=False,
+                      stats_file=None, bucket_stats=None, n_shards=None):
     '''
     Run ExplainaBoard analysis suite
 
     Args:
       task: The ID of the task
-      systems: A path to the system files
-      output: The output path where the files should be written out
-      analysis_type: analysis type: single|pair|combine
+      systems: A path to the system files, or system outputs held in memory as data_utils.InMemoryTsv
+      output: The output path where the files should be written out, None to only return the report
+      analysis_type: analysis type: single|pair|combine. "pair" compares two systems on the same test set and
+        reports their per-bucket differences, "combine" analyzes any number of systems together and reports
+        per-bucket oracle-ensemble, all-fail and unique-win statistics
       dataset_name (str): the name of dataset
       model_name (str): the name of mdoel
       is_print_ci: TODO
       is_print_case: TODO
       is_print_ece: TODO
+      ci_mode: independent|shared. "shared" draws one set of bootstrap resamples per run and computes the overall
+        confidence interval and those of all buckets from it in a single pass
+      n_workers: the number of worker processes the buckets of all aspects are evaluated in, 1 evaluates them
+        in this process
+      cache_dir: directory where the span tasks (ner, pos, chunk, cws) cache the gold-side aspect values and buckets
+        of each test set, so that further systems on the same test set skip that work; None disables the cache
+      report_cache_dir: directory of finished reports keyed by the content of the system files, the task
+        configuration, the analysis options and the library version; a run whose report is there only copies it to
+        the output path. None disables the cache
+      case_file: a JSON lines file the error cases are written to, one per line, instead of the report; the report
+        then holds the offset and count of the cases of every bucket. None keeps them in the report
+      max_cases: the maximum number of error cases reported overall and per bucket, a uniform sample drawn by
+        reservoir sampling; the report then also holds the exact number of cases. None reports all of them
+      stratify_cases: whether max_cases applies to every pair of true and predicted label separately, so that rare
+        errors are sampled too; the report then also holds the number of cases per label pair
+      stats_file: a JSON file the per-bucket counts the report is computed from are written to (correct, predicted
+        and gold spans for F1, correct and total samples for accuracy, the ECE bin sums); the statistics of runs on
+        disjoint data can be merged into one report with run_merge. None does not write them
+      bucket_stats: the statistics file of an earlier run, whose intervals the numeric aspects are bucketed by
+        instead of their bucketing function, so that the statistics of this run can be merged with it
+      n_shards: split the system output into this many shards, at sentence boundaries, that are evaluated in
+        parallel, one worker process each, and whose bucket statistics are added up into the report; the buckets
+        are those of the whole test set, so the report equals that of a run without shards, but has no confidence
+        intervals or error cases. None evaluates the system output in this process
+
+    Returns:
+      the report, as the json object written to output
     '''
 
     # TODO: This could probably be modified to directly find the directories in "tasks"
     valid_tasks = ['absa', 'ner', 'pos', 'chunk', 'cws', 'tc', 'nli', 're']
     if task not in valid_tasks:
         raise ValueError(f'{task} is not a known ExplainaBoard task')
+    # tasks that implement the multi-system analysis types
+    analysis_tasks = {'single': valid_tasks, 'pair': ['ner', 'pos', 'chunk', 'cws'],
+                      'combine': ['ner', 'pos', 'chunk', 'cws']}
+    if analysis_type not in analysis_tasks:
+        raise ValueError(f'{analysis_type} is not a known analysis type')
+    if task not in analysis_tasks[analysis_type]:
+        raise ValueError(f'{analysis_type} analysis is not supported for {task}')
+    if ci_mode not in ('independent', 'shared'):
+        raise ValueError(f'{ci_mode} is not a known confidence interval mode')
+    if (stats_file is not None or bucket_stats is not None) and (analysis_type != 'single' or task == 're'):
+        raise ValueError(f'bucket statistics are not supported for {analysis_type} analysis of {task}')
+    bucket_intervals = None
+    if bucket_stats is not None:
+        bucket_intervals = bst.get_bucket_intervals(bst.load_stats(bucket_stats))
+    is_in_memory = any(not isinstance(path_text, str) for path_text in systems)
+    if output is None and case_file is not None:
+        raise ValueError('the error cases can only be written to a case file next to an output file')
+    if (is_in_memory or output is None) and (report_cache_dir is not None or n_shards is not None):
+        raise ValueError('the report cache and sharding need system output files and an output file')
+    if n_shards is not None:
+        if analysis_type != 'single' or task == 're':
+            raise ValueError(f'sharding is not supported for {analysis_type} analysis of {task}')
+        if len(systems) != 1 or is_print_ci or is_print_case or case_file is not None:
+            raise ValueError('sharding only supports one system, without confidence intervals or error cases')
 
-    eval_func = getattr(sys.modules[f'explainaboard.tasks.{task}.eval_spec'], 'evaluate')
-    eval_func(task_type=task,
-              systems=systems,
-              output_filename=output,
-              dataset_name= dataset_name,
-              model_name = model_name,
-              analysis_type=analysis_type,
-              is_print_ci=is_print_ci,
-              is_print_case=is_print_case,
-              is_print_ece=is_print_ece)
+    eval_module = get_eval_module(task)
+    if report_cache_dir is not None:
+        # the worker count and the gold-side cache do not change the report
+        options = {'analysis_type': analysis_type, 'dataset_name': dataset_name, 'model_name': model_name,
+                   'is_print_ci': is_print_ci, 'is_print_case': is_print_case, 'is_print_ece': is_print_ece,
+                   'ci_mode': ci_mode, 'max_cases': max_cases, 'stratify_cases': stratify_cases,
+                   # the report names the system files, so equal files under other names make another report
+                   'system_names': [os.path.basename(path_text) for path_text in systems]}
+        if case_file is not None:
+            # the report refers to the case file by its path relative to the report
+            options['case_file'] = os.path.relpath(case_file, os.path.dirname(os.path.abspath(output)))
+        if stats_file is not None:
+            options['stats'] = True
+        if bucket_intervals is not None:
+            options['bucket_intervals'] = sorted(bucket_intervals.items())
+        if n_shards is not None:
+            # the number of shards does not change the report either
+            options['sharded'] = True
+        path_report = rc.get_report_path(report_cache_dir, task, systems, os.path.dirname(eval_module.__file__),
+                                         options)
+        if rc.load_report(path_report, output, case_file, stats_file):
+            with open(path_report, 'r') as fin:
+                return json.load(fin)
+
+    if n_shards is not None:
+        obj_json = sh.evaluate_sharded(task, eval_module, systems[0], output, n_shards, dataset_name, model_name,
+                                       is_print_ece, cache_dir, stats_file, bucket_intervals)
+        if report_cache_dir is not None:
+            rc.save_report(path_report, output, case_file, stats_file)
+        return obj_json
+
+    eval_func = getattr(eval_module, 'evaluate')
+    obj_json = eval_func(task_type=task,
+                         systems=systems,
+                         output_filename=output,
+                         dataset_name= dataset_name,
+                         model_name = model_name,
+                         analysis_type=analysis_type,
+                         is_print_ci=is_print_ci,
+                         is_print_case=is_print_case,
+                         is_print_ece=is_print_ece,
+                         ci_mode=ci_mode,
+                         n_workers=n_workers,
+                         cache_dir=cache_dir,
+                         case_file=case_file,
+                         max_cases=max_cases,
+                         stratify_cases=stratify_cases,
+                         stats_file=stats_file,
+                         bucket_intervals=bucket_intervals)
+    if report_cache_dir is not None:
+        rc.save_report(path_report, output, case_file, stats_file)
+    return obj_json
+
+
+def run_merge(stats_files, output, stats_output=None):
+    '''
+    Merge the bucket statistics of runs of a task on disjoint data, e.g. the shards of a test set or data appended
+    to it later, and write the report of the merged statistics, without confidence intervals or error cases. The
+    system outputs of the runs are not read again
+
+    Args:
+      stats_files: the statistics files of the runs, see the stats_file of run_explainaboard. Runs after the first
+        must have been evaluated with the statistics of the first as bucket_stats
+      output: The output path of the merged report, None to only return it
+      stats_output: a path the merged statistics are written to, so that later runs can be merged into them; None
+        does not write them
+
+    Returns:
+      the merged report
+    '''
+    stats = bst.merge_stats([bst.load_stats(path) for path in stats_files])
+    if stats_output is not None:
+        bst.save_stats(stats, stats_output)
+    obj_json = bst.get_report(stats)
+    ea.save_json(obj_json, output)
+    return obj_json
+
+
+def run_precompute(task, path_train, output_dir='.', aspects=('eFre', 'eCon', 'oDen'), tag_col=-1, delimiter=None,
+                   max_items=pc.MAX_ITEMS):
+    '''
+    Compute the training-set statistics of the precomputed aspects (eFre, eCon, oDen) of a span task in one
+    streaming pass with bounded memory, and write them where the evaluator loads them from
+
+    Args:
+      task: The ID of a span task: ner|pos|chunk|cws
+      path_train: A path to the CoNLL-style training set
+      output_dir: The directory the evaluator is run from
+      aspects: The statistics to compute
+      tag_col: The tag column of the training set, the words being in the first column
+      delimiter: The column separator of the training set, None for any whitespace
+      max_items: The number of distinct keys per statistic held in memory before they are spilled to disk
+    '''
+    span_tasks = ['ner', 'pos', 'chunk', 'cws']
+    if task not in span_tasks:
+        raise ValueError(f'precomputed statistics are not supported for {task}')
+    get_span_chunks = getattr(get_eval_module(task), 'get_span_chunks')
+    return pc.build_precomputed(path_train, get_span_chunks, output_dir, aspects, col_ids=(0, tag_col),
+                                delimiter=delimiter, max_items=max_items)
+
+
+def precompute_main(argv):
+    # explainaboard precompute --task ner --train ./train.conll
+    parser = argparse.ArgumentParser(prog='explainaboard precompute',
+                                     description='Precompute the training-set statistics of the eFre, eCon and '
+                                                 'oDen aspects')
+
+    parser.add_argument('--task', type=str, required=True,
+                        help="ner|pos|chunk|cws")
+
+    parser.add_argument('--train', type=str, required=True,
+                        help="the CoNLL-style training set, words in the first column")
+
+    parser.add_argument('--output_dir', type=str, required=False, default=".",
+                        help="the directory the evaluator is run from, where the statistics are written")
+
+    parser.add_argument('--aspects', type=str, required=False, default="eFre,eCon,oDen",
+                        help="the statistics to compute, separated by comma")
+
+    parser.add_argument('--tag_col', type=int, required=False, default=-1,
+                        help="the tag column of the training set")
+
+    parser.add_argument('--max_items', type=int, required=False, default=pc.MAX_ITEMS,
+                        help="the number of distinct keys per statistic held in memory before spilling to disk")
+
+    args = parser.parse_args(argv)
+    run_precompute(args.task, args.train, args.output_dir, args.aspects.split(","), args.tag_col,
+                   max_items=args.max_items)
+
+
+def merge_main(argv):
+    # explainaboard merge --stats ./a.stats.json,./b.stats.json --output ./merged.json
+    parser = argparse.ArgumentParser(prog='explainaboard merge',
+                                     description='Merge the bucket statistics of several runs into one report')
+
+    parser.add_argument('--stats', type=str, required=True,
+                        help="the statistics files of the runs, separated by comma")
+
+    parser.add_argument('--output', type=str, required=True,
+                        help="analysis output file")
+
+    parser.add_argument('--stats_output', type=str, required=False, default=None,
+                        help="file the merged statistics are written to, to merge further runs into later")
+
+    args = parser.parse_args(argv)
+    run_merge(args.stats.split(","), args.output, args.stats_output)
 
 
-    
 #if __name__ == '__main__':
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'precompute':
+        return precompute_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        return merge_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        # the server imports this module
+        import explainaboard.server as srv
+        return srv.serve_main(sys.argv[2:])
+
     # python explainaboard_main.py --task absa  --systems ./test-laptop.tsv --output ./output/a.json
     # python explainaboard_main.py --task ner --systems ./test-conll03.tsv --output ./a.json
     # python explainaboard_main.py --task re --systems ./test_re.tsv --output ./a.json
@@ -60,6 +274,36 @@ def main():
     parser.add_argument('--ece', type=str, required=False, default=False,
                         help="True|False")
 
+    parser.add_argument('--ci_mode', type=str, required=False, default="independent",
+                        help="independent|shared: whether all confidence intervals reuse one set of bootstrap resamples")
+
+    parser.add_argument('--workers', type=int, required=False, default=1,
+                        help="the number of worker processes used to evaluate the buckets of all aspects")
+
+    parser.add_argument('--cache_dir', type=str, required=False, default=None,
+                        help="directory of the gold-side cache shared by all systems on the same test set")
+
+    parser.add_argument('--report_cache_dir', type=str, required=False, default=None,
+                        help="directory of cached reports, reused when the same system output is analyzed again")
+
+    parser.add_argument('--case_file', type=str, required=False, default=None,
+                        help="JSON lines file the error cases are written to instead of the analysis output file")
+
+    parser.add_argument('--max_cases', type=int, required=False, default=None,
+                        help="the maximum number of error cases reported overall and per bucket, sampled uniformly")
+
+    parser.add_argument('--stratify_cases', action='store_true',
+                        help="apply --max_cases to every pair of true and predicted label separately")
+
+    parser.add_argument('--stats_file', type=str, required=False, default=None,
+                        help="JSON file the per-bucket counts of the analysis are written to, see explainaboard merge")
+
+    parser.add_argument('--bucket_stats', type=str, required=False, default=None,
+                        help="statistics file of an earlier run whose bucket intervals are reused")
+
+    parser.add_argument('--shards', type=int, required=False, default=None,
+                        help="the number of shards the system output is split into and evaluated in parallel")
+
     parser.add_argument('--type', type=str, required=False, default="single",
                         help="analysis type: single|pair|combine")
     parser.add_argument('--systems', type=str, required=True,
@@ -79,6 +323,16 @@ def main():
     is_print_ci = args.ci
     is_print_case = args.case
     is_print_ece = args.ece
+    ci_mode = args.ci_mode
+    n_workers = args.workers
+    cache_dir = args.cache_dir
+    report_cache_dir = args.report_cache_dir
+    case_file = args.case_file
+    max_cases = args.max_cases
+    stratify_cases = args.stratify_cases
+    stats_file = args.stats_file
+    bucket_stats = args.bucket_stats
+    n_shards = args.shards
 
     task = args.task
     analysis_type = args.type
@@ -92,7 +346,9 @@ def main():
     print("type", analysis_type)
     print("systems", systems)
 
-    run_explainaboard(task, systems, output, dataset_name, model_name, analysis_type, is_print_ci, is_print_case, is_print_ece)
+    run_explainaboard(task, systems, output, dataset_name, model_name, analysis_type, is_print_ci, is_print_case, is_print_ece,
+                      ci_mode, n_workers, cache_dir, report_cache_dir, case_file, max_cases, stratify_cases,
+                      stats_file, bucket_stats, n_shards)
     
     
 if __name__ == '__main__':
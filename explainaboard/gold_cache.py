@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+import explainaboard
+import explainaboard.data_utils as du
+import explainaboard.error_analysis as ea
+import explainaboard.precomputed as pc
+import explainaboard.span_table as st
+
+# bump when the layout of the cache files or the meaning of what is stored in them changes
+CACHE_FORMAT = 2
+
+
+def update_precomputed_digest(digest, dict_precomputed_path):
+    """
+    Add the precomputed statistics of a task to a hash, each identified by its path and modification time
+    """
+    for aspect, path in sorted(dict_precomputed_path.items()):
+        digest.update(json.dumps([aspect, os.path.abspath(path), pc.get_mtime(path)]).encode("utf-8"))
+
+
+def get_gold_key(task_dir, list_text_sent, list_true_tags_sent, dict_aspect_func, dict_precomputed_path):
+    """
+    Content hash of everything the gold side of a span task run depends on: the task, its aspect configuration,
+    the precomputed statistics, the library version and the gold text and tag columns
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([CACHE_FORMAT, explainaboard.__version__, os.path.basename(os.path.normpath(task_dir)),
+                              list(dict_aspect_func.items())]).encode("utf-8"))
+    update_precomputed_digest(digest, dict_precomputed_path)
+    # tab and newline can not occur inside a field of the tsv the columns were read from
+    for column in (list_text_sent, list_true_tags_sent):
+        digest.update("\n".join("\t".join(sent) for sent in column).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def save_gold_side(path_cache, dict_span2aspect_val, span_table, dict_bucket2span):
+    """
+    Write the gold span table, the gold aspect values and the gold buckets to one ``.npz`` file
+
+    The values of an aspect must be numbers or strings; nothing is written otherwise.
+    :param dict_span2aspect_val: aspect -> array of the gold aspect values, by row in the span table
+    :param dict_bucket2span: aspect -> bucket interval -> index array of the rows in the bucket
+    :return: whether the file was written
+    """
+    arrays = {"start": span_table.start, "end": span_table.end, "type_code": span_table.type_code,
+              "sent_id": span_table.sent_id, "type_names": np.array(span_table.type_names, dtype=str)}
+    meta = {"n_sents": span_table.n_sents, "aspects": []}
+    for i, (aspect, vals) in enumerate(dict_span2aspect_val.items()):
+        if len(vals) and vals.dtype.kind not in "iufU":
+            return False
+        intervals = list(dict_bucket2span.get(aspect, {}).keys())
+        bucket_spans = [dict_bucket2span[aspect][interval] for interval in intervals]
+        arrays["vals_%d" % i] = vals
+        arrays["bucket_spans_%d" % i] = np.concatenate([np.zeros(0, dtype=np.int64)] + bucket_spans)
+        arrays["bucket_bounds_%d" % i] = np.cumsum([0] + [len(spans) for spans in bucket_spans], dtype=np.int64)
+        meta["aspects"].append({"name": aspect, "is_bucketed": aspect in dict_bucket2span,
+                                "intervals": [list(interval) for interval in intervals]})
+    # numpy scalars in bucket intervals are stored as the python numbers they stand for
+    arrays["meta"] = np.array(json.dumps(meta, default=lambda obj: obj.item()))
+
+    # write to a temporary file first so that concurrent runs never see a partial cache file
+    path_tmp = "%s.%d.%d.tmp" % (path_cache, os.getpid(), threading.get_ident())
+    with open(path_tmp, "wb") as fout:
+        np.savez(fout, **arrays)
+    os.replace(path_tmp, path_cache)
+    return True
+
+
+def load_gold_side(path_cache, dict_type2code):
+    """
+    Read a file written by ``save_gold_side``
+    :param dict_type2code: empty type vocabulary, filled with the gold types in their original order
+    :return: (dict_span2aspect_val, span_table, dict_bucket2span)
+    """
+    with np.load(path_cache, allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays["meta"]))
+        for type_name in arrays["type_names"].tolist():
+            dict_type2code.setdefault(type_name, len(dict_type2code))
+        span_table = st.SpanTable(arrays["start"], arrays["end"], arrays["type_code"], arrays["sent_id"],
+                                  dict_type2code, meta["n_sents"])
+
+        dict_span2aspect_val, dict_bucket2span = {}, {}
+        for i, dict_aspect in enumerate(meta["aspects"]):
+            aspect = dict_aspect["name"]
+            dict_span2aspect_val[aspect] = arrays["vals_%d" % i]
+            if not dict_aspect["is_bucketed"]:
+                continue
+            bucket_spans = arrays["bucket_spans_%d" % i]
+            bounds = arrays["bucket_bounds_%d" % i].tolist()
+            dict_bucket2span[aspect] = {tuple(interval): bucket_spans[bounds[j]:bounds[j + 1]]
+                                        for j, interval in enumerate(dict_aspect["intervals"])}
+    return dict_span2aspect_val, span_table, dict_bucket2span
+
+
+def get_gold_side(cache_dir, task_dir, get_aspect_value, list_text_token, list_true_tags_token, list_text_sent,
+                  list_true_tags_sent, dict_precomputed_path, dict_aspect_func, dict_type2code,
+                  dict_aspect2intervals=None):
+    """
+    Gold aspect values, gold span table and gold buckets of a span task (ner, chunk, pos, cws)
+
+    They only depend on the test set and the task configuration, not on the system. With a ``cache_dir``, they are
+    looked up there by ``get_gold_key`` and computed and stored on a miss, so that the following systems on the
+    same test set only do the prediction-side work.
+    :param cache_dir: directory of the cache files, None to always compute
+    :param get_aspect_value: the task's ``get_aspect_value``
+    :param dict_type2code: empty type vocabulary, filled with the gold types
+    :param dict_aspect2intervals: aspect -> fixed bucket intervals used instead of the aspect's bucketing function,
+        e.g. from ``bucket_stats.get_bucket_intervals``. The cache holds the buckets of the bucketing functions, the
+        fixed intervals are applied to the cached aspect values
+    :return: (dict_span2aspect_val, span_table, dict_bucket2span)
+    """
+    path_cache = None
+    if cache_dir is not None:
+        key = get_gold_key(task_dir, list_text_sent, list_true_tags_sent, dict_aspect_func, dict_precomputed_path)
+        path_cache = os.path.join(cache_dir, "gold-%s.npz" % key)
+    if path_cache is not None and os.path.exists(path_cache):
+        print("load the gold side from " + path_cache)
+        dict_span2aspect_val, span_table, dict_bucket2span = load_gold_side(path_cache, dict_type2code)
+    else:
+        dict_span2aspect_val, span_table = get_aspect_value(list_text_token, list_true_tags_token, list_text_sent,
+                                                            list_true_tags_sent, dict_precomputed_path,
+                                                            dict_aspect_func, dict_type2code)
+        dict_bucket2span = {}
+        for aspect, func in dict_aspect_func.items():
+            dict_bucket2span[aspect] = ea.select_bucketing_func(func[0], func[1], dict_span2aspect_val[aspect])
+
+        if path_cache is not None:
+            ea.ensure_dir(cache_dir)
+            save_gold_side(path_cache, dict_span2aspect_val, span_table, dict_bucket2span)
+
+    for aspect, intervals in (dict_aspect2intervals or {}).items():
+        dict_bucket2span[aspect] = ea.bucket_attribute_specified_bucket_interval(dict_span2aspect_val[aspect],
+                                                                                  intervals)
+    return dict_span2aspect_val, span_table, dict_bucket2span
+
+
+def get_gold_aspect_values(cache_dir, task_dir, get_aspect_value, path_text):
+    """
+    The gold aspect values of a span task system output, e.g. of one shard of a test set (see ``sharding``), read
+    from or stored in the cache like the rest of the gold side
+    :return: aspect -> array of the gold aspect values, by row in the gold span table
+    """
+    dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=task_dir)
+    (list_text_sent, list_text_token), (list_true_tags_sent, list_true_tags_token) = du.conll_to_lists(
+        path_text, col_ids=(0, 1))
+    dict_span2aspect_val, span_table, dict_bucket2span = get_gold_side(
+        cache_dir, task_dir, get_aspect_value, list_text_token, list_true_tags_token, list_text_sent,
+        list_true_tags_sent, dict_precomputed_path, dict_aspect_func, {})
+    return dict_span2aspect_val
@@ -0,0 +1,346 @@
+import copy
+import functools
+
+import numpy as np
+
+import explainaboard.bootstrap as bs
+import explainaboard.case_sampling as cs
+import explainaboard.data_utils as du
+import explainaboard.error_analysis as ea
+import explainaboard.gold_cache as gc
+import explainaboard.span_table as st
+
+# the number of set bits of every byte
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def get_system_names(systems, model_name):
+    """
+    One name per system: the comma-separated ``model_name`` if it names every system, else the output file names
+    """
+    model_names = model_name.split(",")
+    if len(model_names) == len(systems):
+        return model_names
+    return [du.get_file_name(path_text) for path_text in systems]
+
+
+def iter_span_systems(systems):
+    """
+    Read the CoNLL-style outputs of several systems on the same test set, one system at a time
+    :return: generator of (text columns, gold tag columns, predicted tag columns), each column a
+        (sentence-grouped, flat) pair as returned by ``data_utils.conll_to_lists``
+    """
+    text, tags_true = None, None
+    for path_text in systems:
+        text_system, tags_true_system, tags_pred = du.conll_to_lists(path_text, col_ids=(0, 1, 2))
+        if text is None:
+            text, tags_true = text_system, tags_true_system
+        elif text_system[0] != text[0] or tags_true_system[0] != tags_true[0]:
+            raise ValueError(f'{path_text} does not have the same text and gold tags as {systems[0]}')
+        yield text, tags_true, tags_pred
+
+
+def get_aspect_bias(dict_span2aspect_val):
+    """
+    The average value of every numeric aspect over the gold spans
+    """
+    dict_aspect2bias = {}
+    for aspect, aspect_vals in dict_span2aspect_val.items():
+        if len(aspect_vals) and not isinstance(aspect_vals[0], str):
+            dict_aspect2bias[aspect] = np.average(aspect_vals)
+    return dict_aspect2bias
+
+
+def get_fine_grained_f1(dict_aspect2bucket2f1):
+    """
+    Bucket records of ``get_bucket_f1`` in the json format of the span tasks, F1 and intervals in percent
+    """
+    dict_fine_grained = {}
+    for aspect, metadata in dict_aspect2bucket2f1.items():
+        dict_fine_grained[aspect] = []
+        for bucket_name, v in metadata.items():
+            dict_fine_grained[aspect].append({"bucket_name": ea.beautify_interval(bucket_name),
+                                              "bucket_value": format(float(v[0]) * 100, '.4g'), "num": v[1],
+                                              "confidence_low": format(float(v[2]) * 100, '.4g'),
+                                              "confidence_up": format(float(v[3]) * 100, '.4g'),
+                                              "bucket_error_case": v[4]})
+    return dict_fine_grained
+
+
+def compute_paired_confidence_interval_f1(dict_aspect2bucket2span, list_dict_aspect2bucket2span_pred,
+                                          list_table_true, list_table_pred, n_times=1000, seed=None):
+    """
+    Paired bootstrap of the overall and bucket-wise span F1 of several systems: every replicate draws one set of
+    sentences and scores all systems on it, so the differences between systems are resampled jointly
+    :param dict_aspect2bucket2span: aspect -> bucket interval -> rows of the gold span table, shared by all systems
+    :param list_dict_aspect2bucket2span_pred: per system, aspect -> bucket interval -> rows of its span table
+    :param list_table_true: per system, the gold span table aligned with that system's predictions
+    :param list_table_pred: per system, the predicted span table
+    :return: (groups, performance) where groups lists (aspect, bucket interval), (None, None) first for the overall
+        F1, and performance has shape (n_times, n_systems, n_groups)
+    """
+    groups = [(None, None)] + [(aspect, bucket_interval)
+                               for aspect, dict_bucket2span in dict_aspect2bucket2span.items()
+                               for bucket_interval in dict_bucket2span.keys()]
+    stats = []
+    for dict_aspect2bucket2span_pred, table_true, table_pred in zip(list_dict_aspect2bucket2span_pred,
+                                                                    list_table_true, list_table_pred):
+        for aspect, bucket_interval in groups:
+            if aspect is None:
+                spans_true, spans_pred = np.arange(len(table_true)), np.arange(len(table_pred))
+            else:
+                spans_true = dict_aspect2bucket2span[aspect][bucket_interval]
+                spans_pred = dict_aspect2bucket2span_pred[aspect][bucket_interval]
+            stats.append(ea.get_sentence_f1_stats(spans_true, spans_pred, table_true, table_pred))
+
+    n_sents = list_table_true[0].n_sents
+    sums = bs.resample_sums(np.concatenate(stats, axis=1), bs.get_n_sampling(n_sents), n_times, seed)
+    performance = bs.f1_from_counts(sums[:, 0::3], sums[:, 1::3], sums[:, 2::3])
+    return groups, performance.reshape(n_times, len(list_table_true), len(groups))
+
+
+def evaluate_pair_f1(task_type, systems, dataset_name, model_name, output_filename, is_print_ci, is_print_case,
+                     n_workers, task_dir, get_aspect_value, get_span_case, get_holistic_performance,
+                     get_missing_label=ea.outside_label, make_missing_label=None, n_times=1000, seed=None,
+                     cache_dir=None, case_file=None, new_sampler=cs.CaseSampler):
+    """
+    Compare two systems of a span task (ner, chunk, pos, cws) on the same test set
+
+    The gold columns are read, and the gold aspect values and buckets computed, once; each system's predictions
+    are then evaluated against these shared buckets. The report holds the usual results of both systems under
+    "models" and the per-bucket differences (second minus first system) under "pair". With ``is_print_ci``, all
+    confidence intervals come from one paired bootstrap over sentences.
+    :param get_aspect_value: the task's ``get_aspect_value``
+    :param get_span_case: the task's ``get_span_case``
+    :param get_holistic_performance: (gold tag sentences, predicted tag sentences, gold span table, predicted span
+        table) -> overall performance in percent
+    :param make_missing_label: (gold span table, gold tags, predicted tags) -> ``get_missing_label`` of one system,
+        for tasks where the label depends on the predictions; overrides ``get_missing_label``
+    :param cache_dir: directory of the gold-side cache, see ``gold_cache.get_gold_side``
+    :param case_file: JSON lines file the error cases are written to instead of the report, or the ``CaseWriter``
+        of ``new_sampler``, see ``ea.save_json``
+    :param new_sampler: () -> the ``CaseSampler`` of one list of error cases
+    """
+    if len(systems) != 2:
+        raise ValueError(f'pair analysis needs two systems, got {len(systems)}')
+    dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=task_dir)
+
+    system_columns = list(iter_span_systems(systems))
+    (list_text_sent, list_text_token), (list_true_tags_sent, list_true_tags_token), _ = system_columns[0]
+    list_tags_pred = [tags_pred for _, _, tags_pred in system_columns]
+    span2case = functools.partial(get_span_case, test_word_sequences=list_text_token,
+                                  test_word_sequences_sent=list_text_sent)
+
+    # gold side, shared by both systems
+    dict_type2code = {}
+    dict_span2aspect_val, span_table, dict_bucket2span = gc.get_gold_side(
+        cache_dir, task_dir, get_aspect_value, list_text_token, list_true_tags_token, list_text_sent,
+        list_true_tags_sent, dict_precomputed_path, dict_aspect_func, dict_type2code)
+
+    list_table_true, list_table_pred, list_bucket2span_pred, list_bucket2f1, list_overall = [], [], [], [], []
+    for list_pred_tags_sent, list_pred_tags_token in list_tags_pred:
+        dict_span2aspect_val_pred, span_table_pred = get_aspect_value(list_text_token, list_pred_tags_token,
+                                                                      list_text_sent, list_pred_tags_sent,
+                                                                      dict_precomputed_path, dict_aspect_func,
+                                                                      dict_type2code)
+        # the gold columns are shared, only the alignment with this system is not
+        span_table_true = copy.copy(span_table)
+        st.align_span_tables(span_table_true, span_table_pred)
+        system_missing_label = get_missing_label
+        if make_missing_label is not None:
+            system_missing_label = make_missing_label(span_table_true, list_true_tags_token, list_pred_tags_token)
+
+        dict_bucket2span_pred = {}
+        for aspect in dict_aspect_func.keys():
+            dict_bucket2span_pred[aspect] = ea.bucket_attribute_specified_bucket_interval(
+                dict_span2aspect_val_pred[aspect], dict_bucket2span[aspect].keys())
+        dict_bucket2f1 = ea.get_aspect_bucket_perf(
+            functools.partial(ea.get_bucket_f1, table_true=span_table_true, table_pred=span_table_pred,
+                              get_span_case=span2case, is_print_ci=False, is_print_case=is_print_case,
+                              get_missing_label=system_missing_label, new_sampler=new_sampler),
+            dict_bucket2span, dict_bucket2span_pred, n_workers)
+
+        error_case_list = []
+        if is_print_case:
+            error_case_list = ea.get_error_case(span_table_true, span_table_pred, span2case, system_missing_label,
+                                                sampler=new_sampler())
+        list_overall.append({"performance": get_holistic_performance(list_true_tags_sent, list_pred_tags_sent,
+                                                                        span_table_true, span_table_pred),
+                             "confidence_low": 0, "confidence_up": 0, "error_case": error_case_list})
+        list_table_true.append(span_table_true)
+        list_table_pred.append(span_table_pred)
+        list_bucket2span_pred.append(dict_bucket2span_pred)
+        list_bucket2f1.append(dict_bucket2f1)
+
+    overall_delta_ci, dict_aspect2delta_ci = (0, 0), {}
+    if is_print_ci:
+        groups, performance = compute_paired_confidence_interval_f1(dict_bucket2span, list_bucket2span_pred,
+                                                                    list_table_true, list_table_pred, n_times, seed)
+        for i_system, dict_bucket2f1 in enumerate(list_bucket2f1):
+            (confidence_low, confidence_up), dict_aspect2ci = ea.split_shared_intervals(
+                groups, *bs.summarize_replicates(performance[:, i_system], n_times))
+            list_overall[i_system]["confidence_low"] = confidence_low
+            list_overall[i_system]["confidence_up"] = confidence_up
+            ea.update_bucket_confidence_interval(dict_bucket2f1, dict_aspect2ci)
+        overall_delta_ci, dict_aspect2delta_ci = ea.split_shared_intervals(
+            groups, *bs.summarize_replicates(performance[:, 1] - performance[:, 0], n_times))
+
+    # differences of the second system from the first, in percent
+    dict_pair = {"overall": {"performance_delta": list_overall[1]["performance"] - list_overall[0]["performance"],
+                             "confidence_low": overall_delta_ci[0] * 100,
+                             "confidence_up": overall_delta_ci[1] * 100},
+                 "fine_grained": {}}
+    for aspect, dict_bucket2f1 in list_bucket2f1[0].items():
+        dict_pair["fine_grained"][aspect] = []
+        for bucket_interval, v in dict_bucket2f1.items():
+            delta = float(list_bucket2f1[1][aspect][bucket_interval][0]) - float(v[0])
+            confidence_low, confidence_up = dict_aspect2delta_ci.get(aspect, {}).get(bucket_interval, (0, 0))
+            dict_pair["fine_grained"][aspect].append({"bucket_name": ea.beautify_interval(bucket_interval),
+                                                      "num": v[1], "bucket_value_delta": format(delta * 100, '.4g'),
+                                                      "confidence_low": format(confidence_low * 100, '.4g'),
+                                                      "confidence_up": format(confidence_up * 100, '.4g')})
+
+    print("------------------ Pair Result")
+    print(dict_pair["overall"])
+
+    obj_json["task"] = task_type
+    obj_json["data"]["name"] = dataset_name
+    obj_json["data"]["output"] = [du.get_file_name(path_text) for path_text in systems]
+    obj_json["data"]["language"] = "English"
+    obj_json["data"]["bias"] = get_aspect_bias(dict_span2aspect_val)
+
+    template_model = obj_json.pop("model")
+    obj_json["models"] = []
+    for name, overall, dict_bucket2f1 in zip(get_system_names(systems, model_name), list_overall, list_bucket2f1):
+        obj_model = copy.deepcopy(template_model)
+        obj_model["name"] = name
+        obj_model["results"]["overall"].update(overall)
+        obj_model["results"]["fine_grained"] = get_fine_grained_f1(dict_bucket2f1)
+        obj_json["models"].append(obj_model)
+    obj_json["pair"] = dict_pair
+
+    ea.save_json(obj_json, output_filename, case_file)
+    return obj_json
+
+
+def set_correctness_bits(bits, i_system, is_correct):
+    """
+    Store the correctness of system ``i_system`` in column ``i_system`` of a bit-matrix packed like
+    ``numpy.packbits(..., axis=1)``
+    """
+    bits[:, i_system // 8] |= is_correct.astype(np.uint8) << (7 - i_system % 8)
+
+
+def get_combine_stats(bits, n_systems, dict_aspect2bucket2span):
+    """
+    Oracle-ensemble, all-fail and unique-win statistics of every bucket of every aspect in one pass
+    :param bits: packed (n_spans, ceil(n_systems / 8)) bit-matrix, bit j of span i set if system j gets it right
+    :param dict_aspect2bucket2span: aspect -> bucket interval -> rows of the gold span table
+    :return: (groups, stats) where groups lists (aspect, bucket interval), (None, None) first for the whole test
+        set, and stats maps "num", "n_oracle", "n_all_fail" and "n_correct" (summed over systems) to arrays with one
+        entry per group, and "unique_win" to an (n_groups, n_systems) array counting the spans only that system
+        gets right
+    """
+    n_spans = len(bits)
+    groups = [(None, None)]
+    rows, group_ids = [np.arange(n_spans)], [np.zeros(n_spans, dtype=np.int64)]
+    for aspect, dict_bucket2span in dict_aspect2bucket2span.items():
+        for bucket_interval, spans in dict_bucket2span.items():
+            rows.append(np.asarray(spans, dtype=np.int64))
+            group_ids.append(np.full(len(spans), len(groups), dtype=np.int64))
+            groups.append((aspect, bucket_interval))
+    rows, group_ids = np.concatenate(rows), np.concatenate(group_ids)
+    n_groups = len(groups)
+
+    n_correct = POPCOUNT[bits].sum(axis=1)
+    # the only system that gets a span right, or -1
+    winner = np.full(n_spans, -1, dtype=np.int64)
+    is_unique = n_correct == 1
+    winner[is_unique] = np.unpackbits(bits[is_unique], axis=1, count=n_systems).argmax(axis=1)
+
+    is_unique_row = winner[rows] >= 0
+    stats = {"num": np.bincount(group_ids, minlength=n_groups),
+             "n_oracle": np.bincount(group_ids, weights=n_correct[rows] > 0, minlength=n_groups),
+             "n_all_fail": np.bincount(group_ids, weights=n_correct[rows] == 0, minlength=n_groups),
+             "n_correct": np.bincount(group_ids, weights=n_correct[rows], minlength=n_groups),
+             "unique_win": np.bincount(group_ids[is_unique_row] * n_systems + winner[rows][is_unique_row],
+                                       minlength=n_groups * n_systems).reshape(n_groups, n_systems)}
+    return groups, stats
+
+
+def format_combine_stats(stats, i_group, system_names):
+    num = int(stats["num"][i_group])
+
+    def ratio(count):
+        return format(float(count) / num * 100 if num else 0, '.4g')
+
+    return {"num": num, "oracle": ratio(stats["n_oracle"][i_group]), "all_fail": ratio(stats["n_all_fail"][i_group]),
+            "avg_correct": ratio(stats["n_correct"][i_group] / len(system_names)),
+            "unique_win": dict(zip(system_names, stats["unique_win"][i_group].tolist()))}
+
+
+def evaluate_combine_f1(task_type, systems, dataset_name, model_name, output_filename, task_dir, get_aspect_value,
+                        get_span_chunks, get_holistic_performance, cache_dir=None):
+    """
+    Analyze N systems of a span task (ner, chunk, pos, cws) on the same test set together
+
+    The gold aspect values and buckets are computed once. Each system is then only chunked and aligned with the
+    gold spans, one at a time, to fill a packed gold span x system correctness bit-matrix, from which the
+    per-bucket statistics of all systems are derived at once: "oracle" (the share of gold spans at least one
+    system gets right), "all_fail" (the share no system gets right), "avg_correct" (the average share per system)
+    and "unique_win" (per system, the number of spans only it gets right).
+    :param get_aspect_value: the task's ``get_aspect_value``
+    :param get_span_chunks: the task's ``get_span_chunks``, (type, start, end) of the spans of a tag sequence
+    :param get_holistic_performance: (gold tag sentences, predicted tag sentences, gold span table, predicted span
+        table) -> overall performance in percent
+    :param cache_dir: directory of the gold-side cache, see ``gold_cache.get_gold_side``
+    """
+    dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=task_dir)
+    system_names = get_system_names(systems, model_name)
+    n_systems = len(systems)
+
+    bits, list_overall = None, []
+    for i_system, columns in enumerate(iter_span_systems(systems)):
+        (list_text_sent, list_text_token), (list_true_tags_sent, list_true_tags_token), \
+            (list_pred_tags_sent, list_pred_tags_token) = columns
+        if bits is None:
+            # gold side, shared by all systems
+            dict_type2code = {}
+            dict_span2aspect_val, span_table, dict_bucket2span = gc.get_gold_side(
+                cache_dir, task_dir, get_aspect_value, list_text_token, list_true_tags_token, list_text_sent,
+                list_true_tags_sent, dict_precomputed_path, dict_aspect_func, dict_type2code)
+            token_sent_id = st.get_token_sent_id([len(sent) for sent in list_text_sent])
+            bits = np.zeros((len(span_table), (n_systems + 7) // 8), dtype=np.uint8)
+
+        span_table_pred = st.SpanTable.from_chunks(get_span_chunks(list_pred_tags_token), token_sent_id,
+                                                   dict_type2code, span_table.n_sents)
+        set_correctness_bits(bits, i_system, st.match_spans(span_table, span_table_pred) >= 0)
+        list_overall.append({"performance": get_holistic_performance(list_true_tags_sent, list_pred_tags_sent,
+                                                                     span_table, span_table_pred)})
+
+    groups, stats = get_combine_stats(bits, n_systems, dict_bucket2span)
+    dict_aspect2bucket2stats = {}
+    for i_group, (aspect, bucket_interval) in enumerate(groups[1:], 1):
+        dict_bucket = {"bucket_name": ea.beautify_interval(bucket_interval)}
+        dict_bucket.update(format_combine_stats(stats, i_group, system_names))
+        dict_aspect2bucket2stats.setdefault(aspect, {})[bucket_interval] = dict_bucket
+    dict_combine = {"overall": format_combine_stats(stats, 0, system_names),
+                    "fine_grained": {aspect: list(ea.sort_dict(dict_bucket2stats).values())
+                                     for aspect, dict_bucket2stats in dict_aspect2bucket2stats.items()}}
+
+    print("------------------ Combine Result")
+    print(dict_combine["overall"])
+
+    obj_json["task"] = task_type
+    obj_json["data"]["name"] = dataset_name
+    obj_json["data"]["output"] = [du.get_file_name(path_text) for path_text in systems]
+    obj_json["data"]["language"] = "English"
+    obj_json["data"]["bias"] = get_aspect_bias(dict_span2aspect_val)
+
+    obj_json.pop("model")
+    obj_json["models"] = [{"name": name, "results": {"overall": overall}}
+                          for name, overall in zip(system_names, list_overall)]
+    obj_json["combine"] = dict_combine
+
+    ea.save_json(obj_json, output_filename)
+    return obj_json
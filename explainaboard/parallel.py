@@ -0,0 +1,38 @@
+import multiprocessing
+
+# the function run by the workers of the current pool, inherited through fork instead of being pickled
+_task_func = None
+
+
+def can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _run_task(task):
+    return _task_func(task)
+
+
+def map_tasks(func, tasks, n_workers=1):
+    """
+    Apply ``func`` to every task, in a pool of forked worker processes if ``n_workers`` > 1
+
+    The workers are forked after ``func`` is set, so ``func`` and everything it references (span tables, label
+    arrays, lazily decoded columns) are shared with the parent copy-on-write rather than pickled per task. Only the
+    tasks and the results cross process boundaries, so both should be small. Falls back to a serial loop where
+    fork is not available.
+    :param func: a function of one task, may be a closure or partial
+    :param tasks: list of picklable tasks
+    :param n_workers: the number of worker processes
+    :return: list of results, in the order of ``tasks``
+    """
+    global _task_func
+    n_workers = min(n_workers, len(tasks))
+    if n_workers <= 1 or not can_fork():
+        return [func(task) for task in tasks]
+
+    _task_func = func
+    try:
+        with multiprocessing.get_context("fork").Pool(n_workers) as pool:
+            return pool.map(_run_task, tasks, chunksize=1)
+    finally:
+        _task_func = None
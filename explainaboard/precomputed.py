@@ -0,0 +1,376 @@
+import hashlib
+import heapq
+import itertools
+import operator
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+import explainaboard.data_utils as du
+
+# the files of a store directory
+STORE_FILES = ("hashes.npy", "offsets.npy", "keys.bin", "values.npy")
+
+# the number of distinct keys an ``ExternalSorter`` holds in memory before it spills them to a sorted run
+MAX_ITEMS = 2 ** 20
+
+# stores already loaded by this process, by path and modification time
+_loaded_stores = {}
+
+
+def hash_key(key):
+    """
+    Stable 64-bit hash of a string
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hash_keys(keys):
+    """
+    :return: numpy uint64 array of the ``hash_key`` of every key
+    """
+    return np.fromiter((hash_key(key) for key in keys), dtype=np.uint64, count=len(keys))
+
+
+def get_store_order(key):
+    """
+    Sort key that puts keys in the order of a store: by hash, colliding keys next to each other
+    """
+    return hash_key(key), key
+
+
+def flatten_precomputed(dict_precomputed):
+    """
+    (key, value) pairs of a precomputed dictionary as the evaluator used to unpickle it: a set or list of keys
+    (e.g. the training vocabulary of ``oDen``) gets value 1, and a nested dictionary (e.g. span -> label -> label
+    consistency of ``eCon``) is flattened into keys ``span + "\\t" + label``
+    """
+    if not isinstance(dict_precomputed, dict):
+        return [(key, 1.0) for key in dict_precomputed]
+    pairs = []
+    for key, value in dict_precomputed.items():
+        if isinstance(value, dict):
+            pairs.extend((key + "\t" + sub_key, float(sub_value)) for sub_key, sub_value in value.items())
+        else:
+            pairs.append((key, float(value)))
+    return pairs
+
+
+class PrecomputedStore:
+    """
+    Read-only string -> float table of precomputed statistics, queried in batch
+
+    Keys are sorted by their 64-bit hash, so a batch of keys is looked up with one ``searchsorted``; the key bytes
+    are kept to rule out hash collisions. Stores saved with ``save`` are memory-mapped when loaded, so the pages
+    are shared by all processes that use the same store and only the parts that are queried are read.
+    """
+
+    def __init__(self, hashes, offsets, keys, values):
+        self.hashes = hashes
+        self.offsets = offsets
+        self.keys = keys
+        self.values = values
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        :param pairs: (key, value) pairs with distinct keys
+        """
+        pairs = list(pairs)
+        keys = [key.encode("utf-8") for key, value in pairs]
+        hashes = hash_keys([key for key, value in pairs])
+        values = np.fromiter((value for key, value in pairs), dtype=np.float64, count=len(pairs))
+        order = np.argsort(hashes, kind="stable")
+        keys = [keys[i] for i in order]
+        offsets = np.cumsum([0] + [len(key) for key in keys], dtype=np.int64)
+        return cls(hashes[order], offsets, np.frombuffer(b"".join(keys), dtype=np.uint8), values[order])
+
+    @classmethod
+    def load(cls, path_store):
+        arrays = []
+        for name in STORE_FILES:
+            path = os.path.join(path_store, name)
+            if name.endswith(".bin"):
+                # np.memmap can not map an empty file
+                arrays.append(np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path)
+                              else np.zeros(0, dtype=np.uint8))
+            else:
+                arrays.append(np.load(path, mmap_mode="r"))
+        return cls(*arrays)
+
+    def save(self, path_store):
+        os.makedirs(path_store, exist_ok=True)
+        np.save(os.path.join(path_store, "hashes.npy"), np.asarray(self.hashes))
+        np.save(os.path.join(path_store, "offsets.npy"), np.asarray(self.offsets))
+        np.asarray(self.keys).tofile(os.path.join(path_store, "keys.bin"))
+        np.save(os.path.join(path_store, "values.npy"), np.asarray(self.values))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def get_key(self, row):
+        return bytes(self.keys[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def find(self, keys):
+        """
+        :return: numpy int64 array with the row of each key, -1 for keys that are not in the store
+        """
+        keys = list(keys)
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(keys) == 0 or len(self) == 0:
+            return rows
+        hashes = hash_keys(keys)
+        pos = np.searchsorted(self.hashes, hashes)
+        is_candidate = pos < len(self)
+        is_candidate[is_candidate] = self.hashes[pos[is_candidate]] == hashes[is_candidate]
+        candidates = np.flatnonzero(is_candidate)
+
+        # compare the bytes of each candidate key with the first stored key of the same hash, all at once
+        key_bytes = [keys[i].encode("utf-8") for i in candidates.tolist()]
+        lengths = np.fromiter((len(key) for key in key_bytes), dtype=np.int64, count=len(key_bytes))
+        starts = self.offsets[pos[candidates]]
+        is_same = self.offsets[pos[candidates] + 1] - starts == lengths
+        lengths_same = lengths[is_same]
+        within = np.arange(int(lengths_same.sum())) - np.repeat(np.cumsum(lengths_same) - lengths_same, lengths_same)
+        stored = self.keys[np.repeat(starts[is_same], lengths_same) + within]
+        queried = np.frombuffer(b"".join(key for key, same in zip(key_bytes, is_same.tolist()) if same),
+                                dtype=np.uint8)
+        n_diff = np.bincount(np.repeat(np.arange(len(lengths_same)), lengths_same), weights=stored != queried,
+                             minlength=len(lengths_same))
+        is_same[is_same] = n_diff == 0
+        rows[candidates[is_same]] = pos[candidates[is_same]]
+
+        for i in candidates[~is_same].tolist():
+            # hash collision: the other keys with this hash are stored right after the first one
+            row = int(pos[i]) + 1
+            while row < len(self) and self.hashes[row] == hashes[i]:
+                if self.get_key(row) == keys[i]:
+                    rows[i] = row
+                    break
+                row += 1
+        return rows
+
+    def contains(self, keys):
+        return self.find(keys) >= 0
+
+    def lookup(self, keys, default=0.0):
+        """
+        :return: numpy float64 array with the value of each key, ``default`` for keys that are not in the store
+        """
+        rows = self.find(keys)
+        values = np.full(len(rows), default, dtype=np.float64)
+        is_found = rows >= 0
+        values[is_found] = self.values[rows[is_found]]
+        return values
+
+
+def get_store_path(path):
+    """
+    The store directory that replaces a precomputed pickle, e.g. ``_eFre.stats`` for ``_eFre.pkl``
+    """
+    return os.path.splitext(path)[0] + ".stats"
+
+
+def get_mtime(path):
+    """
+    Modification time of the precomputed statistics of ``path``: of its store if there is one, else of the pickle
+    """
+    path_store = get_store_path(path)
+    if os.path.isdir(path_store):
+        return max(os.stat(os.path.join(path_store, name)).st_mtime_ns for name in STORE_FILES)
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+def load_store(path):
+    """
+    The precomputed statistics of one aspect, from the store next to ``path`` or else from the pickle at ``path``
+
+    Each store is loaded once per process and then shared, e.g. by the gold and the predicted side of a run and by
+    the worker processes forked from it.
+    """
+    path_store = get_store_path(path)
+    path_source = path_store if os.path.isdir(path_store) else path
+    if not os.path.exists(path_source):
+        raise ValueError("can not load hard dictionary\t" + path)
+    key = (os.path.abspath(path_source), get_mtime(path))
+    if key not in _loaded_stores:
+        print("load the precomputed statistics from " + path_source)
+        if path_source == path_store:
+            _loaded_stores[key] = PrecomputedStore.load(path_store)
+        else:
+            with open(path, "rb") as fread:
+                _loaded_stores[key] = PrecomputedStore.from_pairs(flatten_precomputed(pickle.load(fread)))
+    return _loaded_stores[key]
+
+
+def load_precomputed(dict_precomputed_path):
+    """
+    :param dict_precomputed_path: aspect -> pickle path, as returned by ``load_task_conf``
+    :return: aspect -> ``PrecomputedStore``
+    """
+    return {aspect: load_store(path) for aspect, path in dict_precomputed_path.items()}
+
+
+def convert_pickle(path):
+    """
+    Write the store of a precomputed pickle next to it, so that later runs memory-map it instead
+    :return: the path of the store
+    """
+    with open(path, "rb") as fread:
+        store = PrecomputedStore.from_pairs(flatten_precomputed(pickle.load(fread)))
+    store.save(get_store_path(path))
+    return get_store_path(path)
+
+
+class ExternalSorter:
+    """
+    Sort and aggregate (key, value) pairs in bounded memory
+
+    Values of equal keys are combined in a dictionary; whenever it holds ``max_items`` keys, it is written out as
+    a sorted run, and iterating merges all runs. Keys must not contain newlines.
+    """
+
+    def __init__(self, tmp_dir, order=None, combine=operator.add, max_items=MAX_ITEMS):
+        """
+        :param tmp_dir: directory of the runs
+        :param order: sort key of the keys, None to sort the keys themselves
+        :param combine: (value, value) -> value of equal keys
+        """
+        self.tmp_dir = tmp_dir
+        self.order = order
+        self.combine = combine
+        self.max_items = max_items
+        self.items = {}
+        self.path_runs = []
+
+    def add(self, key, value=1):
+        if key in self.items:
+            self.items[key] = self.combine(self.items[key], value)
+            return
+        self.items[key] = value
+        if len(self.items) >= self.max_items:
+            self.spill()
+
+    def get_sorted_items(self):
+        if self.order is None:
+            return sorted(self.items.items())
+        return sorted(self.items.items(), key=lambda item: self.order(item[0]))
+
+    def spill(self):
+        fd, path_run = tempfile.mkstemp(suffix=".run", dir=self.tmp_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as fout:
+            for key, value in self.get_sorted_items():
+                fout.write(key + "\t" + repr(value) + "\n")
+        self.path_runs.append(path_run)
+        self.items = {}
+
+    @staticmethod
+    def read_run(path_run):
+        with open(path_run, "r", encoding="utf-8") as fin:
+            for line in fin:
+                key, value = line.rstrip("\n").rsplit("\t", 1)
+                yield key, float(value)
+
+    def __iter__(self):
+        """
+        (key, value) pairs in order, each key once
+        """
+        runs = [self.read_run(path_run) for path_run in self.path_runs] + [iter(self.get_sorted_items())]
+        order = (lambda item: item[0]) if self.order is None else (lambda item: self.order(item[0]))
+        for key, items in itertools.groupby(heapq.merge(*runs, key=order), key=operator.itemgetter(0)):
+            values = [value for _, value in items]
+            value = values[0]
+            for other in values[1:]:
+                value = self.combine(value, other)
+            yield key, value
+
+
+def write_store(path_store, pairs, block_size=MAX_ITEMS):
+    """
+    Write a store from (key, value) pairs that come in the order of ``get_store_order``, holding one block of
+    pairs in memory at a time
+    """
+    os.makedirs(path_store, exist_ok=True)
+    columns = (("hashes", np.uint64), ("offsets", np.int64), ("values", np.float64))
+    path_raws = {name: os.path.join(path_store, name + ".raw") for name, dtype in columns}
+    pairs = iter(pairs)
+    n_pairs, n_bytes = 0, 0
+    with open(os.path.join(path_store, "keys.bin"), "wb") as f_keys, open(path_raws["hashes"], "wb") as f_hashes, \
+            open(path_raws["offsets"], "wb") as f_offsets, open(path_raws["values"], "wb") as f_values:
+        f_offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+        for block in iter(lambda: list(itertools.islice(pairs, block_size)), []):
+            keys = [key.encode("utf-8") for key, value in block]
+            f_hashes.write(hash_keys([key for key, value in block]).tobytes())
+            f_offsets.write((n_bytes + np.cumsum([len(key) for key in keys], dtype=np.int64)).tobytes())
+            f_values.write(np.array([value for key, value in block], dtype=np.float64).tobytes())
+            f_keys.write(b"".join(keys))
+            n_pairs += len(block)
+            n_bytes += sum(len(key) for key in keys)
+
+    # turn the raw columns into .npy files block by block
+    for name, dtype in columns:
+        n_rows = n_pairs + 1 if name == "offsets" else n_pairs
+        path_npy = os.path.join(path_store, name + ".npy")
+        if n_rows == 0:
+            np.save(path_npy, np.zeros(0, dtype=dtype))
+        else:
+            raw = np.memmap(path_raws[name], dtype=dtype, mode="r")
+            out = np.lib.format.open_memmap(path_npy, mode="w+", dtype=dtype, shape=(n_rows,))
+            for start in range(0, n_rows, block_size):
+                out[start:start + block_size] = raw[start:start + block_size]
+            out.flush()
+            del raw, out
+        os.remove(path_raws[name])
+    return path_store
+
+
+def build_precomputed(path_train, get_span_chunks, output_dir=".", aspects=("eFre", "eCon", "oDen"),
+                      col_ids=(0, -1), delimiter=None, max_items=MAX_ITEMS):
+    """
+    Compute the precomputed statistics of a span task from its training set and write their stores
+
+    The training set is streamed once; counts are aggregated by ``ExternalSorter``s, so memory stays bounded by
+    ``max_items`` keys per statistic however large the corpus is:
+    eFre: lowercased span text -> the number of times it is a span in the training set
+    eCon: lowercased span text + "\t" + span type -> the share of those times it has this type
+    oDen: the training vocabulary, word -> 1
+    :param get_span_chunks: the task's ``get_span_chunks``, (type, start, end) of the spans of a tag sequence
+    :param output_dir: where the evaluator is run from; the stores are named after the pickles ``load_task_conf``
+        expects there, e.g. ``_eFre.stats``
+    :param col_ids: the word and the tag column of the training set
+    :param delimiter: the column separator, None for any whitespace
+    :return: aspect -> path of its store
+    """
+    unknown = set(aspects) - {"eFre", "eCon", "oDen"}
+    if unknown:
+        raise ValueError(f'can not precompute {", ".join(sorted(unknown))}')
+    dict_path_store = {aspect: get_store_path(os.path.join(output_dir, "_" + aspect + ".pkl")) for aspect in aspects}
+    os.makedirs(output_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        # span + "\t" + type in plain order, so that the types of a span are adjacent
+        type_counts = ExternalSorter(tmp_dir, max_items=max_items)
+        vocab = ExternalSorter(tmp_dir, order=get_store_order, combine=max, max_items=max_items)
+        for words, tags in du.iter_conll_sentences(path_train, col_ids, delimiter):
+            if "oDen" in aspects:
+                for word in words:
+                    vocab.add(word, 1.0)
+            for span_type, start, end in get_span_chunks(tags):
+                type_counts.add(" ".join(words[start:end]).lower() + "\t" + span_type)
+
+        fre = ExternalSorter(tmp_dir, order=get_store_order, max_items=max_items)
+        con = ExternalSorter(tmp_dir, order=get_store_order, max_items=max_items)
+        for span, items in itertools.groupby(type_counts, key=lambda item: item[0].rsplit("\t", 1)[0]):
+            items = list(items)
+            n_span = sum(count for key, count in items)
+            fre.add(span, float(n_span))
+            for key, count in items:
+                con.add(key, count / n_span)
+
+        for aspect, sorter in (("eFre", fre), ("eCon", con), ("oDen", vocab)):
+            if aspect in aspects:
+                print("write the precomputed statistics to " + dict_path_store[aspect])
+                write_store(dict_path_store[aspect], sorter)
+    return dict_path_store
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import explainaboard
+import explainaboard.error_analysis as ea
+import explainaboard.gold_cache as gc
+
+# bump when the key or the layout of the cached reports changes
+CACHE_FORMAT = 1
+
+
+def get_report_key(task, systems, task_dir, options):
+    """
+    Content hash of everything a report depends on: the system output files, the task configuration
+    (``conf.aspects``, ``template.json`` and the precomputed statistics), the analysis options and the library
+    version
+    :param options: the json-serializable options of the run, e.g. the analysis type and the ci/case/ece flags
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([CACHE_FORMAT, explainaboard.__version__, task, options]).encode("utf-8"))
+    for name in ("conf.aspects", "template.json"):
+        with open(os.path.join(task_dir, name), "rb") as fin:
+            digest.update(fin.read())
+    dict_aspect_func = ea.load_conf(os.path.join(task_dir, "conf.aspects"))
+    gc.update_precomputed_digest(digest, {aspect: "_" + aspect + ".pkl" for aspect, func in dict_aspect_func.items()
+                                          if func[2].lower() == "yes"})
+    for path_text in systems:
+        # the length prefix keeps the boundaries between files unambiguous
+        digest.update(str(os.path.getsize(path_text)).encode("utf-8") + b"\0")
+        with open(path_text, "rb") as fin:
+            for block in iter(lambda: fin.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def get_report_path(cache_dir, task, systems, task_dir, options):
+    return os.path.join(cache_dir, "report-%s.json" % get_report_key(task, systems, task_dir, options))
+
+
+def get_cases_path(path_report):
+    return path_report[:-len(".json")] + ".cases.jsonl"
+
+
+def get_stats_path(path_report):
+    return path_report[:-len(".json")] + ".stats.json"
+
+
+def load_report(path_report, output_filename, case_file=None, stats_file=None):
+    """
+    Copy a cached report to ``output_filename``, its error cases to ``case_file`` and its bucket statistics to
+    ``stats_file`` if given
+    :return: whether the report was in the cache
+    """
+    if not os.path.exists(path_report):
+        return False
+    print("load the report from " + path_report)
+    if case_file is not None:
+        shutil.copyfile(get_cases_path(path_report), case_file)
+    if stats_file is not None:
+        shutil.copyfile(get_stats_path(path_report), stats_file)
+    shutil.copyfile(path_report, output_filename)
+    return True
+
+
+def copy_atomic(path_src, path_dst):
+    # copy to a temporary file first so that concurrent runs never see a partial file
+    path_tmp = "%s.%d.%d.tmp" % (path_dst, os.getpid(), threading.get_ident())
+    shutil.copyfile(path_src, path_tmp)
+    os.replace(path_tmp, path_dst)
+
+
+def save_report(path_report, output_filename, case_file=None, stats_file=None):
+    """
+    Store the report just written to ``output_filename``, and its error cases written to ``case_file`` and bucket
+    statistics written to ``stats_file`` if given; reports written to a device such as ``os.devnull`` are not stored
+    """
+    if not os.path.isfile(output_filename):
+        return
+    ea.ensure_dir(os.path.dirname(path_report))
+    # the cases and statistics go first, a report in the cache always has them
+    if case_file is not None:
+        copy_atomic(case_file, get_cases_path(path_report))
+    if stats_file is not None:
+        copy_atomic(stats_file, get_stats_path(path_report))
+    copy_atomic(output_filename, path_report)
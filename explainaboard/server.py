@@ -0,0 +1,147 @@
+import argparse
+import http.server
+import json
+import os
+import tempfile
+
+import explainaboard
+import explainaboard.api as api
+import explainaboard.error_analysis as ea
+import explainaboard.explainaboard_main as em
+import explainaboard.precomputed as pc
+
+# the tasks the server analyzes
+SERVED_TASKS = ("absa", "ner", "pos", "chunk", "cws", "tc", "nli")
+# the options of a submission that are passed on to the analysis, see run_explainaboard
+ANALYSIS_OPTIONS = ("dataset_name", "model_name", "is_print_ci", "is_print_case", "is_print_ece", "ci_mode",
+                    "max_cases", "stratify_cases")
+
+
+def warm_up(tasks):
+    """
+    Import the evaluation modules of the tasks and load their configurations and the precomputed statistics there
+    are, which the process then keeps for all submissions, see ``error_analysis.load_task_conf`` and
+    ``precomputed.load_store``
+    """
+    for task in tasks:
+        eval_module = em.get_eval_module(task)
+        dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(os.path.dirname(eval_module.__file__))
+        for path in dict_precomputed_path.values():
+            if os.path.exists(path) or os.path.isdir(pc.get_store_path(path)):
+                pc.load_store(path)
+
+
+def analyze_submission(submission, cache_dir=None):
+    """
+    The report of one submission, a json object with
+      task: the ID of the task
+      tsv: the text of the system output file, or else
+      columns, sent_lens: the system output as columns, see ``api.analyze``
+      name: the file name of the system output as the report shows it
+    and any of the options in ``ANALYSIS_OPTIONS``
+    """
+    unknown = set(submission) - {"task", "tsv", "columns", "sent_lens", "name"} - set(ANALYSIS_OPTIONS)
+    if unknown:
+        raise ValueError(f'unknown fields of the submission: {sorted(unknown)}')
+    task = submission["task"]
+    if task not in SERVED_TASKS:
+        raise ValueError(f'{task} is not a task the server analyzes')
+    options = {key: submission[key] for key in ANALYSIS_OPTIONS if key in submission}
+    name = os.path.basename(submission.get("name") or "system.tsv")
+    if name in ("", ".", ".."):
+        raise ValueError(f'{submission["name"]} is not a file name')
+
+    if "columns" in submission:
+        return api.analyze(task, submission["columns"], submission.get("sent_lens"), name, cache_dir=cache_dir,
+                           **options).obj_json
+    # the text is written to a file so that it is read exactly as the command line reads it
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path_text = os.path.join(tmp_dir, name)
+        with open(path_text, "w") as fout:
+            fout.write(submission["tsv"])
+        return em.run_explainaboard(task, [path_text], None, cache_dir=cache_dir, **options)
+
+
+class AnalysisHandler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /health: the status and the version of the server
+    POST /analyze: the report of the submission in the body, see ``analyze_submission``; a status of 400 and an
+        "error" for submissions that can not be analyzed
+    """
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.send_json(404, {"error": f'{self.path} not found'})
+        self.send_json(200, {"status": "ok", "version": explainaboard.__version__})
+
+    def do_POST(self):
+        if self.path != "/analyze":
+            return self.send_json(404, {"error": f'{self.path} not found'})
+        try:
+            submission = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            obj_json = analyze_submission(submission, self.server.cache_dir)
+        except (ValueError, KeyError, TypeError) as e:
+            return self.send_json(400, {"error": f'{type(e).__name__}: {e}'})
+        except Exception as e:
+            return self.send_json(500, {"error": f'{type(e).__name__}: {e}'})
+        self.send_json(200, obj_json)
+
+    def send_json(self, status, obj_json):
+        body = json.dumps(obj_json, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AnalysisServer(http.server.ThreadingHTTPServer):
+    """
+    A long-running local HTTP server that analyzes submissions concurrently, a thread each
+
+    Unlike a run of the command line, which pays for the interpreter start, the imports, the parsing of the task
+    configuration and the loading of the precomputed statistics before any work, the server does all of that once.
+    The gold sides of the span tasks are cached in ``cache_dir``, by default a temporary directory of the server,
+    so that submissions on a test set analyzed before only do the prediction-side work. Submissions are analyzed
+    without worker processes, as forking a process with several threads is not safe.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, cache_dir=None, tasks=SERVED_TASKS):
+        self._tmp_dir = tempfile.TemporaryDirectory() if cache_dir is None else None
+        self.cache_dir = cache_dir if cache_dir is not None else self._tmp_dir.name
+        warm_up(tasks)
+        super().__init__(address, AnalysisHandler)
+
+    def server_close(self):
+        super().server_close()
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+
+
+def serve_main(argv):
+    # explainaboard serve --port 8000
+    parser = argparse.ArgumentParser(prog='explainaboard serve',
+                                     description='Analyze system outputs posted to a local HTTP server')
+
+    parser.add_argument('--host', type=str, required=False, default="127.0.0.1",
+                        help="the address the server listens on")
+
+    parser.add_argument('--port', type=int, required=False, default=8000,
+                        help="the port the server listens on, 0 for any free port")
+
+    parser.add_argument('--cache_dir', type=str, required=False, default=None,
+                        help="directory of the gold-side cache, by default a temporary one of the server")
+
+    parser.add_argument('--tasks', type=str, required=False, default=",".join(SERVED_TASKS),
+                        help="the tasks whose configurations and statistics are loaded at start, separated by comma")
+
+    args = parser.parse_args(argv)
+    server = AnalysisServer((args.host, args.port), args.cache_dir, args.tasks.split(","))
+    print("serving on http://%s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
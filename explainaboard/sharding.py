@@ -0,0 +1,170 @@
+import os
+import tempfile
+
+import numpy as np
+
+import explainaboard.bucket_stats as bst
+import explainaboard.error_analysis as ea
+import explainaboard.parallel as par
+
+# tasks whose system outputs are CoNLL-style, with sentences separated by blank lines
+CONLL_TASKS = ("ner", "pos", "chunk", "cws")
+
+
+def is_chunk_boundary(get_span_chunks, lines_before, lines_after):
+    """
+    Whether no gold (column 1) or predicted (column 2) chunk runs across a blank line. The chunks of the span tasks
+    are found in the tag sequence of the whole file, so a chunk may span sentences, e.g. in cws an unfinished word
+    at the end of one sentence is continued by the next one
+    :param lines_before: the lines of the sentence before the blank line, or of its end
+    :param lines_after: the lines of the sentence after the blank line
+    """
+    rows = [line.decode("utf-8").strip().split("\t") for line in lines_before + lines_after]
+    for col_id in (1, 2):
+        chunks = get_span_chunks([cols[col_id] for cols in rows])
+        if any(start < len(lines_before) < end for chunk_type, start, end in chunks):
+            return False
+    return True
+
+
+def get_shard_bounds(path_text, n_shards, is_conll, get_span_chunks=None):
+    """
+    Byte offsets splitting a system output into about ``n_shards`` parts of equal size, at line boundaries or, for
+    CoNLL-style files, after blank lines so that no sentence is split
+    :param get_span_chunks: the task's ``get_span_chunks``, to only split CoNLL-style files where no chunk crosses
+        the blank line, see ``is_chunk_boundary``
+    :return: increasing offsets from 0 to the file size; fewer shards than asked for if the file is too small
+    """
+    size = os.path.getsize(path_text)
+    bounds = [0]
+    with open(path_text, "rb") as fin:
+        for k in range(1, n_shards):
+            pos = max(size * k // n_shards, bounds[-1])
+            if pos > 0:
+                # finish the line byte pos - 1 is on, so that the next one starts at or after pos
+                fin.seek(pos - 1)
+                fin.readline()
+            bound = fin.tell()
+            if is_conll:
+                # the boundary is after the next blank line, which ends a sentence
+                bound, lines_before = size, []
+                for line in iter(fin.readline, b""):
+                    if line.strip():
+                        lines_before.append(line)
+                        continue
+                    pos_blank = fin.tell()
+                    if get_span_chunks is None:
+                        bound = pos_blank
+                        break
+                    lines_after = []
+                    for line_after in iter(fin.readline, b""):
+                        if not line_after.strip():
+                            break
+                        lines_after.append(line_after)
+                    fin.seek(pos_blank)
+                    if is_chunk_boundary(get_span_chunks, lines_before, lines_after):
+                        bound = pos_blank
+                        break
+                    lines_before = []
+            if bound >= size:
+                break
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    bounds.append(size)
+    return bounds
+
+
+def split_file(path_text, n_shards, dir_shards, is_conll, get_span_chunks=None):
+    """
+    Write the shards of a system output to ``dir_shards/<i>/``, each under the file name of the system output
+    :return: the paths of the shards, in the order of the file
+    """
+    bounds = get_shard_bounds(path_text, n_shards, is_conll, get_span_chunks)
+    paths_shard = []
+    with open(path_text, "rb") as fin:
+        for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            path_shard = os.path.join(dir_shards, str(i), os.path.basename(path_text))
+            ea.ensure_dir(os.path.dirname(path_shard))
+            fin.seek(start)
+            with open(path_shard, "wb") as fout:
+                n_left = end - start
+                while n_left > 0:
+                    block = fin.read(min(n_left, 1 << 20))
+                    fout.write(block)
+                    n_left -= len(block)
+            paths_shard.append(path_shard)
+    return paths_shard
+
+
+def get_global_intervals(dict_aspect_func, list_dict_aspect2vals):
+    """
+    The bucket intervals of the whole test set, from the gold aspect values of its shards
+    :param list_dict_aspect2vals: aspect -> array of the gold aspect values of every shard, in the order of the
+        shards
+    :return: (aspect -> bucket intervals in the order the bucketing function made them, aspect -> all values)
+    """
+    dict_aspect2vals = {aspect: np.concatenate([dict_aspect2vals[aspect] for dict_aspect2vals in list_dict_aspect2vals])
+                        for aspect in list_dict_aspect2vals[0].keys()}
+    dict_aspect2intervals = {}
+    for aspect, func in dict_aspect_func.items():
+        # the bucketing functions only look at the values and, for ties, their order, not at the span ids
+        dict_bucket2span = ea.select_bucketing_func(func[0], func[1], dict_aspect2vals[aspect])
+        dict_aspect2intervals[aspect] = list(dict_bucket2span.keys())
+    return dict_aspect2intervals, dict_aspect2vals
+
+
+def evaluate_sharded(task, eval_module, path_text, output, n_shards, dataset_name='dataset_name',
+                     model_name='model_name', is_print_ece=False, cache_dir=None, stats_file=None,
+                     bucket_intervals=None):
+    """
+    Single-system analysis of a large system output split into shards that are evaluated in parallel
+
+    A first pass computes the gold aspect values of every shard, from which the buckets of the whole test set are
+    found, so that equal-frequency buckets (``bucket_attribute_SpecifiedBucketValue``) and the tags that get a
+    bucket are those of a single-process run. Every shard is then evaluated with these buckets into bucket
+    statistics (see ``bucket_stats``), which are added up into the report. The counts and the performances
+    computed from them equal those of a single-process run; the ECE only up to the order its bin sums are added
+    in. The report has no confidence intervals or error cases.
+    :return: the report
+    :param eval_module: the task's ``eval_spec`` module
+    :param n_shards: the number of shards, each evaluated in a worker process of its own
+    :param cache_dir: the gold-side cache of the span tasks, by default a temporary one shared by both passes
+    :param bucket_intervals: aspect -> fixed bucket intervals used instead of those of the whole test set
+    """
+    dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(
+        task_dir=os.path.dirname(eval_module.__file__))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        is_conll = task in CONLL_TASKS
+        paths_shard = split_file(path_text, n_shards, os.path.join(tmp_dir, "shards"), is_conll,
+                                 eval_module.get_span_chunks if is_conll else None)
+        cache_dir = cache_dir if cache_dir is not None else os.path.join(tmp_dir, "cache")
+        # made before the workers are started, which would race to make it
+        ea.ensure_dir(cache_dir)
+
+        def get_aspect_vals(path_shard):
+            dict_span2aspect_val = eval_module.get_gold_aspect_values(path_shard, cache_dir=cache_dir)
+            # the classification tasks name their spans, the span tasks number them by row of the span table
+            return {aspect: ea.get_att_vals(vals) if isinstance(vals, dict) else vals
+                    for aspect, vals in dict_span2aspect_val.items()}
+
+        dict_aspect2intervals, dict_aspect2vals = get_global_intervals(
+            dict_aspect_func, par.map_tasks(get_aspect_vals, paths_shard, len(paths_shard)))
+        dict_aspect2intervals.update(bucket_intervals or {})
+
+        def evaluate_shard(i):
+            path_stats = os.path.join(tmp_dir, "shard-%d.stats.json" % i)
+            eval_module.evaluate(task_type=task, systems=[paths_shard[i]], output_filename=os.devnull,
+                                 dataset_name=dataset_name, model_name=model_name, is_print_ece=is_print_ece,
+                                 cache_dir=cache_dir, stats_file=path_stats, bucket_intervals=dict_aspect2intervals)
+            return bst.load_stats(path_stats)
+
+        stats = bst.merge_stats(par.map_tasks(evaluate_shard, list(range(len(paths_shard))), len(paths_shard)))
+
+    # added up in one pass over all values, the bias is that of a single-process run to the last digit
+    stats["bias"] = bst.get_bias_stats(dict_aspect2vals)
+
+    if stats_file is not None:
+        bst.save_stats(stats, stats_file)
+    obj_json = bst.get_report(stats)
+    ea.save_json(obj_json, output)
+    return obj_json
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+def get_token_sent_id(sent_lengths):
+    """
+    Map every token of a flattened test set to the id of its sentence
+    :param sent_lengths: the number of tokens of each sentence
+    :return: numpy int64 array with one entry per token
+    """
+    sent_lengths = np.asarray(sent_lengths, dtype=np.int64)
+    return np.repeat(np.arange(len(sent_lengths), dtype=np.int64), sent_lengths)
+
+
+def get_token_position(sent_lengths):
+    """
+    Position of every token of a flattened test set inside its sentence
+    """
+    sent_lengths = np.asarray(sent_lengths, dtype=np.int64)
+    sent_offsets = np.cumsum(sent_lengths) - sent_lengths
+    return np.arange(int(sent_lengths.sum()), dtype=np.int64) - np.repeat(sent_offsets, sent_lengths)
+
+
+class SpanTable:
+    """
+    Columnar table of the spans (entities, chunks, words or tokens) of one tag sequence
+
+    A span is identified by its row index. ``start`` and ``end`` (exclusive) are token offsets into the flattened
+    test set, ``type_code`` indexes the type vocabulary and ``sent_id`` is the sentence the span starts in.
+    The gold and predicted tables of a run share one type vocabulary, so type codes are directly comparable.
+    After ``align_span_tables``, ``match`` holds the row of the identical span (same start, end and type) in the
+    other table and ``pos_match`` the row of the span at the same position whatever its type, both -1 if absent.
+    """
+
+    def __init__(self, start, end, type_code, sent_id, dict_type2code, n_sents):
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.type_code = np.asarray(type_code, dtype=np.int32)
+        self.sent_id = np.asarray(sent_id, dtype=np.int64)
+        self.dict_type2code = dict_type2code
+        self.n_sents = n_sents
+        self.match = None
+        self.pos_match = None
+        self._type_names = []
+
+    @classmethod
+    def from_chunks(cls, chunks, token_sent_id, dict_type2code, n_sents=None):
+        """
+        :param chunks: (chunk_type, chunk_start, chunk_end) triples, as returned by ``get_chunks``
+        :param token_sent_id: sentence id of every token, see ``get_token_sent_id``
+        :param dict_type2code: type vocabulary shared with the table this one is compared against, extended in place
+        :param n_sents: the number of sentences of the test set
+        """
+        n_chunks = len(chunks)
+        type_code = np.fromiter((dict_type2code.setdefault(chunk[0], len(dict_type2code)) for chunk in chunks),
+                                dtype=np.int32, count=n_chunks)
+        start = np.fromiter((chunk[1] for chunk in chunks), dtype=np.int64, count=n_chunks)
+        end = np.fromiter((chunk[2] for chunk in chunks), dtype=np.int64, count=n_chunks)
+        token_sent_id = np.asarray(token_sent_id, dtype=np.int64)
+        if n_sents is None:
+            n_sents = int(token_sent_id[-1]) + 1 if len(token_sent_id) else 0
+        return cls(start, end, type_code, token_sent_id[start], dict_type2code, n_sents)
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+    @property
+    def type_names(self):
+        if len(self._type_names) != len(self.dict_type2code):
+            self._type_names = list(self.dict_type2code)
+        return self._type_names
+
+    def get_type(self, span):
+        return self.type_names[self.type_code[span]]
+
+    def get_keys(self, max_length, n_types, with_type=True):
+        """
+        Encode every span into one int64 so that equal spans get equal keys
+        """
+        keys = self.start * (max_length + 1) + self.length
+        if with_type:
+            keys = keys * n_types + self.type_code
+        return keys
+
+
+def match_spans(table_a, table_b, with_type=True):
+    """
+    For every span of ``table_a``, the row of the span of ``table_b`` at the same position
+    (and with the same type if ``with_type``), or -1
+    """
+    if len(table_a) == 0 or len(table_b) == 0:
+        return np.full(len(table_a), -1, dtype=np.int64)
+    max_length = int(max(table_a.length.max(), table_b.length.max()))
+    n_types = max(len(table_a.dict_type2code), len(table_b.dict_type2code), 1)
+    keys_a = table_a.get_keys(max_length, n_types, with_type)
+    keys_b = table_b.get_keys(max_length, n_types, with_type)
+    order = np.argsort(keys_b, kind="stable")
+    sorted_keys_b = keys_b[order]
+    idx = np.minimum(np.searchsorted(sorted_keys_b, keys_a), len(keys_b) - 1)
+    return np.where(sorted_keys_b[idx] == keys_a, order[idx], -1)
+
+
+def align_span_tables(table_true, table_pred):
+    """
+    Fill in ``match`` and ``pos_match`` of a gold and a predicted span table
+    """
+    table_true.match = match_spans(table_true, table_pred)
+    table_pred.match = match_spans(table_pred, table_true)
+    table_true.pos_match = match_spans(table_true, table_pred, with_type=False)
+    table_pred.pos_match = match_spans(table_pred, table_true, with_type=False)
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
+import explainaboard.bucket_stats as bst
+import explainaboard.case_sampling as cs
 import explainaboard.error_analysis as ea
+import functools
 import explainaboard.data_utils as du
 import os
 import numpy
 
 
-def get_aspect_value(sent_list, aspect_list, sample_list_tag, sample_list_tag_pred, dict_aspect_func):
+def get_sample_text(sent_list, aspect_list, sid):
+    # the text of a sample as its error cases show it, built only for the error cases
+    return ea.format4json2(ea.format4json2(aspect_list[sid]) + "|||" + ea.format4json2(sent_list[sid]))
+
+
+def get_aspect_value(sent_list, aspect_list, true_label_codes, pred_label_codes, dict_aspect_func, label_names):
+    # the texts may be lazily decoded columns, and the labels are codes into label_names, see du.MappedTsv
     dict_span2aspect_val = {}
     dict_span2aspect_val_pred = {}
 
@@ -13,17 +22,12 @@ def get_aspect_value(sent_list, aspect_list, sample_list_tag, sample_list_tag_pr
         dict_span2aspect_val[aspect] = {}
         dict_span2aspect_val_pred[aspect] = {}
 
-    dict_sid2sample = {}
-
     sample_id = 0
-    for sent, asp, tag, tag_pred in zip(sent_list, aspect_list, sample_list_tag, sample_list_tag_pred):
+    for sent, asp, tag, tag_pred in zip(sent_list, aspect_list, true_label_codes.tolist(), pred_label_codes.tolist()):
 
         word_list = sent.split(" ")
         aspect_list = asp.split(" ")
 
-        # for saving errorlist -- fine-grained version
-        dict_sid2sample[str(sample_id)] = ea.format4json2(ea.format4json2(asp) + "|||" + ea.format4json2(sent))
-
         sent_length = len(word_list)
         aspect_length = len(aspect_list)
 
@@ -56,40 +60,61 @@ def get_aspect_value(sent_list, aspect_list, sample_list_tag, sample_list_tag_pr
         # Tag: tag
         aspect = "tag"
         if aspect in dict_aspect_func.keys():
-            dict_span2aspect_val["tag"][sent_pos] = tag
-            dict_span2aspect_val_pred[aspect][sent_pos_pred] = tag
+            dict_span2aspect_val["tag"][sent_pos] = label_names[tag]
+            dict_span2aspect_val_pred[aspect][sent_pos_pred] = label_names[tag]
 
         sample_id += 1
     # print(dict_span2aspect_val["bleu"])
-    return dict_span2aspect_val, dict_span2aspect_val_pred, dict_sid2sample
+    return dict_span2aspect_val, dict_span2aspect_val_pred
+
+
+def get_gold_aspect_values(path_text, cache_dir=None):
+    # the gold aspect values of a system output, e.g. of one shard of a test set, see ``sharding``
+    dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=os.path.dirname(__file__))
+    with du.open_tsv(path_text) as tsv:
+        tsv.check_columns(4)
+        (true_label_codes, pred_label_codes), label_names = tsv.get_codes((2, 3))
+        return get_aspect_value(tsv.get_column(1), tsv.get_column(0), true_label_codes, pred_label_codes,
+                                dict_aspect_func, label_names)[0]
 
 
 def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='dataset_name', model_name='model_name',
              output_filename="./output.json", is_print_ci=False,
-             is_print_case=False, is_print_ece=False):
+             is_print_case=False, is_print_ece=False, ci_mode="independent", n_workers=1,
+             cache_dir=None, case_file=None, max_cases=None, stratify_cases=False, stats_file=None,
+             bucket_intervals=None):
+    # every list of error cases, overall and per bucket, is kept by a CaseSampler of its own, which writes it to
+    # the case file as soon as it is final
+    case_writer = cs.CaseWriter(case_file) if case_file is not None else None
+    new_sampler = functools.partial(cs.CaseSampler, max_cases, stratify_cases, writer=case_writer)
     path_text = systems[0] if analysis_type == "single" else ""
-    path_comb_output = "model_name" + "/" + path_text.split("/")[-1]
+    path_comb_output = "model_name" + "/" + du.get_file_name(path_text)
     dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=os.path.dirname(__file__))
 
-    aspect_list, sent_list, true_label_list, pred_label_list = du.tsv_to_lists(path_text, col_ids=(0,1,2,3))
+    tsv = du.open_tsv(path_text)
+    tsv.check_columns(4)
+    aspect_list, sent_list = tsv.get_column(0), tsv.get_column(1)
+    # the labels stay codes: they are only looked up in label_names for the error cases
+    (true_label_codes, pred_label_codes), label_names = tsv.get_codes((2, 3))
 
     error_case_list = []
     if is_print_case:
-        error_case_list = ea.get_error_case_classification(true_label_list, pred_label_list, aspect_list, sent_list)
-        print(" -*-*-*- the number of error casse:\t", len(error_case_list))
+        error_case_list = ea.get_error_case_classification(true_label_codes, pred_label_codes, aspect_list, sent_list,
+                                                           sampler=new_sampler(), label_names=label_names)
+        print(" -*-*-*- the number of error casse:\t", cs.count_cases(error_case_list))
 
     # Confidence Interval of Holistic Performance
+    is_shared_ci = is_print_ci and ci_mode == "shared"
+    is_independent_ci = is_print_ci and not is_shared_ci
     confidence_low, confidence_up = 0, 0
-    if is_print_ci:
-        confidence_low, confidence_up = ea.compute_confidence_interval_acc(true_label_list, pred_label_list,
+    if is_independent_ci:
+        confidence_low, confidence_up = ea.compute_confidence_interval_acc(true_label_codes, pred_label_codes,
                                                                            n_times=100)
 
-    dict_span2aspect_val, dict_span2aspect_val_pred, dict_sid2sample = get_aspect_value(sent_list, aspect_list,
-                                                                                        true_label_list,
-                                                                                        pred_label_list,
-                                                                                        dict_aspect_func)
+    dict_span2aspect_val, dict_span2aspect_val_pred = get_aspect_value(sent_list, aspect_list, true_label_codes,
+                                                                       pred_label_codes, dict_aspect_func, label_names)
 
-    holistic_performance = ea.accuracy(true_label_list, pred_label_list)
+    holistic_performance = ea.accuracy(true_label_codes, pred_label_codes)
     holistic_performance = format(holistic_performance, '.3g')
 
     print("------------------ Holistic Result----------------------")
@@ -97,23 +122,32 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
 
     dict_bucket2span = {}
     dict_bucket2span_pred = {}
-    dict_bucket2f1 = {}
     aspect_names = []
 
     for aspect, func in dict_aspect_func.items():
         # print(aspect, dict_span2aspect_val[aspect])
-        dict_bucket2span[aspect] = ea.select_bucketing_func(func[0], func[1], dict_span2aspect_val[aspect])
+        dict_bucket2span[aspect] = ea.select_bucketing_func(func[0], func[1], dict_span2aspect_val[aspect],
+                                                            (bucket_intervals or {}).get(aspect))
         # print(aspect, dict_bucket2span[aspect])
         # exit()
         dict_bucket2span_pred[aspect] = ea.bucket_attribute_specified_bucket_interval(dict_span2aspect_val_pred[aspect],
                                                                                       dict_bucket2span[aspect].keys())
         # dict_bucket2span_pred[aspect] = __select_bucketing_func(func[0], func[1], dict_span2aspect_val_pred[aspect])
-        dict_bucket2f1[aspect] = get_bucket_acc_with_error_case(dict_bucket2span[aspect],
-                                                                dict_bucket2span_pred[aspect], dict_sid2sample,
-                                                                is_print_ci, is_print_case)
         aspect_names.append(aspect)
     print("aspect_names: ", aspect_names)
 
+    dict_bucket2f1 = ea.get_aspect_bucket_perf(
+        functools.partial(get_bucket_acc_with_error_case,
+                          get_sample=functools.partial(get_sample_text, sent_list, aspect_list),
+                          is_print_ci=is_independent_ci, is_print_case=is_print_case, new_sampler=new_sampler,
+                          label_names=label_names),
+        dict_bucket2span, dict_bucket2span_pred, n_workers)
+
+    if is_shared_ci:
+        (confidence_low, confidence_up), dict_aspect2ci = ea.compute_shared_confidence_interval_acc(
+            dict_bucket2span, dict_bucket2span_pred, true_label_codes, pred_label_codes)
+        ea.update_bucket_confidence_interval(dict_bucket2f1, dict_aspect2ci)
+
     print("------------------ Breakdown Performance")
     for aspect in dict_aspect_func.keys():
         ea.print_dict(dict_bucket2f1[aspect], aspect)
@@ -145,15 +179,16 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
             # bucket_value = format(v[0]*100,'.4g')
             bucket_value = format(v[0], '.4g')
             n_sample = v[1]
-            confidence_low = format(v[2], '.4g')
-            confidence_up = format(v[3], '.4g')
+            confidence_low_bucket = format(v[2], '.4g')
+            confidence_up_bucket = format(v[3], '.4g')
 
             # for saving errorlist -- fine_grained version
             bucket_error_case = v[4]
 
             # instantiation
             dict_fine_grained[aspect].append({"bucket_name": bucket_name, "bucket_value": bucket_value, "num": n_sample,
-                                              "confidence_low": confidence_low, "confidence_up": confidence_up,
+                                              "confidence_low": confidence_low_bucket,
+                                              "confidence_up": confidence_up_bucket,
                                               "bucket_error_case": bucket_error_case})
 
     # dict_fine_grained[aspect].append({"bucket_name":bucket_name, "bucket_value":bucket_value, "num":n_sample, "confidence_low":confidence_low, "confidence_up":confidence_up, "bucket_error_case":[]})
@@ -176,20 +211,30 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
     # Calibration
     ece = 0
     dic_calibration = []
+    ece_bins = None
     if is_print_ece:
-        ece, dic_calibration = ea.calculate_ece_by_file(path_text, prob_col=4, right_or_not_col=5,
-                                                        size_of_bin=10, dataset="dataset_name", model="model_name")
+        ece_bins = ea.get_ece_bins_by_file(path_text, prob_col=4, right_or_not_col=5, size_of_bin=10)
+        ece, dic_calibration = ea.get_calibration(ece_bins, dataset="dataset_name", model="model_name")
 
     obj_json["model"]["results"]["calibration"] = dic_calibration
 
     #
     obj_json["data"]["output"] = path_comb_output
 
-    ea.save_json(obj_json, output_filename)
+    if stats_file is not None:
+        overall_stats = bst.get_accuracy_stats(true_label_codes, pred_label_codes)
+        bst.save_stats(bst.get_stats(obj_json, overall_stats, dict_bucket2f1, dict_span2aspect_val, ece_bins, '.3g'),
+                       stats_file)
+
+    ea.save_json(obj_json, output_filename, case_writer)
+    tsv.close()
+    return obj_json
 
 
-def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict_sid2sentpair, is_print_ci,
-                                   is_print_case):
+def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, get_sample, is_print_ci,
+                                   is_print_case, new_sampler=cs.CaseSampler, label_names=None):
+    # get_sample: sentence id -> the text of the sample, see get_sample_text
+    # label_names: the vocabulary of the labels if the spans hold label codes, which are looked up for error cases
     # The structure of span_true or span_pred
     # 2345|||Positive
     # 2345 represents sentence id
@@ -211,24 +256,29 @@ def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict
         error_case_bucket_list = []
 
         if is_print_case:
+            sampler = new_sampler()
             for info_true, info_pred in zip(spans_true, spans_pred):
                 sid_true, label_true = info_true.split("|||")
                 sid_pred, label_pred = info_pred.split("|||")
                 if sid_true != sid_pred:
                     continue
 
-                sent = dict_sid2sentpair[sid_true]
                 if label_true != label_pred:
-                    error_case_info = label_true + "|||" + label_pred + "|||" + sent
-                    error_case_bucket_list.append(error_case_info)
-
-        accuracy_each_bucket = ea.accuracy(spans_pred, spans_true)
+                    if label_names is not None:
+                        label_true, label_pred = label_names[int(label_true)], label_names[int(label_pred)]
+                    slot = sampler.offer((label_true, label_pred))
+                    if slot is not None:
+                        sampler.put(slot, label_true + "|||" + label_pred + "|||" + get_sample(int(sid_true)))
+            error_case_bucket_list = sampler.get_cases()
+
+        n_correct, n_total = ea.accuracy_counts(spans_pred, spans_true)
+        accuracy_each_bucket = ea.accuracy_from_counts(n_correct, n_total)
         confidence_low, confidence_up = 0, 0
         if is_print_ci:
             confidence_low, confidence_up = ea.compute_confidence_interval_acc(spans_pred, spans_true)
 
         dict_bucket2f1[bucket_interval] = [accuracy_each_bucket, len(spans_true), confidence_low, confidence_up,
-                                           error_case_bucket_list]
+                                           error_case_bucket_list, {"n_correct": n_correct, "n_total": n_total}]
 
         # print(error_case_bucket_list)
 
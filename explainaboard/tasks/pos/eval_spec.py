@@ -1,66 +1,46 @@
 # -*- coding: utf-8 -*-
-from random import choices
-
+import explainaboard.aspects as asp
+import explainaboard.bucket_stats as bst
+import explainaboard.case_sampling as cs
 import explainaboard.error_analysis as ea
-import pickle
+import explainaboard.data_utils as du
+import explainaboard.gold_cache as gc
+import explainaboard.multi_system as ms
+import explainaboard.span_table as st
+import functools
 import numpy
 import os
 
 
+def get_span_chunks(tag_sequences):
+    """
+    (type, start, end) of every token of a flattened tag sequence
+    """
+    # every token is a span of length one typed by its tag
+    return [(tag, i, i + 1) for i, tag in enumerate(tag_sequences)]
+
+
 def get_aspect_value(test_word_sequences, test_true_tag_sequences, test_word_sequences_sent,
-                     test_true_tag_sequences_sent, dict_precomputed_path, dict_aspect_func):
-    dict_precomputed_model = {}
-    for aspect, path in dict_precomputed_path.items():
-        print("path:\t" + path)
-        if ea.os.path.exists(path):
-            print('load the hard dictionary of entity span in test set...')
-            fread = open(path, 'rb')
-            dict_precomputed_model[aspect] = pickle.load(fread)
-        else:
-            raise ValueError("can not load hard dictionary" + aspect + "\t" + path)
-
-    dict_span2aspect_val = {}
-    for aspect, fun in dict_aspect_func.items():
-        dict_span2aspect_val[aspect] = {}
-
-    dict_pos2sid = ea.get_pos2sentid(test_word_sequences_sent)
-    dict_ap2rp = ea.get_token_position(test_word_sequences_sent)
-
-    dict_span2sid = {}
-    dict_chunkid2span = {}
-    for token_id, token in enumerate(test_word_sequences):
-
-        token_type = test_true_tag_sequences[token_id]
-        token_pos = str(token_id) + "_" + str(token) + "_" + token_type
-        token_sentid = dict_pos2sid[token_id]
-        sLen = float(len(test_word_sequences_sent[token_sentid]))
-
-        dict_span2sid[token_pos] = token_sentid
-        dict_chunkid2span[token_pos] = token + "|||" + ea.format4json(' '.join(test_word_sequences_sent[token_sentid]))
-
-        # Sentence Length: sentLen
-        aspect = "sLen"
-        if aspect in dict_aspect_func.keys():
-            dict_span2aspect_val[aspect][token_pos] = sLen
-
-        # Sentence Length: tokLen
-        aspect = "tLen"
-        if aspect in dict_aspect_func.keys():
-            dict_span2aspect_val[aspect][token_pos] = float(len(token))
-            # if float(len(token)) == 1:
-            #     print(token)
-
-        # Relative Position: relPos
-        aspect = "rPos"
-        if aspect in dict_aspect_func.keys():
-            dict_span2aspect_val[aspect][token_pos] = (dict_ap2rp[token_id]) * 1.0 / sLen
-
-        # Tag: tag
-        aspect = "tag"
-        if aspect in dict_aspect_func.keys():
-            dict_span2aspect_val[aspect][token_pos] = token_type
-
-    return dict_span2aspect_val, dict_span2sid, dict_chunkid2span
+                     test_true_tag_sequences_sent, dict_precomputed_path, dict_aspect_func, dict_type2code):
+    token_sent_id = st.get_token_sent_id([len(sent) for sent in test_word_sequences_sent])
+    span_table = st.SpanTable.from_chunks(get_span_chunks(test_true_tag_sequences), token_sent_id, dict_type2code,
+                                          len(test_word_sequences_sent))
+
+    # spans are identified by their row in the span table, every aspect is computed for all of them at once
+    columns = asp.SpanColumns(span_table, test_word_sequences, test_word_sequences_sent, dict_precomputed_path)
+    dict_span2aspect_val = asp.get_aspect_values("pos", dict_aspect_func, columns)
+
+    return dict_span2aspect_val, span_table
+
+
+def get_span_case(span_table, span, test_word_sequences, test_word_sequences_sent):
+    return ea.format4json2(test_word_sequences[span_table.start[span]] + "|||" + ea.format4json(
+        ' '.join(test_word_sequences_sent[span_table.sent_id[span]])))
+
+
+def get_missing_label(span_table, span):
+    # every token carries a tag, so a token missing from the other side is not an error case
+    return None
 
 
 # def tuple2str(triplet):
@@ -70,40 +50,68 @@ def get_aspect_value(test_word_sequences, test_true_tag_sequences, test_word_seq
 #     return res.rstrip("_")
 
 
+def get_holistic_performance(list_true_tags_sent, list_pred_tags_sent, span_table, span_table_pred):
+    # token accuracy
+    return ea.accuracy([tag for sent in list_true_tags_sent for tag in sent],
+                       [tag for sent in list_pred_tags_sent for tag in sent])
+
+
+def get_gold_aspect_values(path_text, cache_dir=None):
+    # the gold aspect values of a system output, e.g. of one shard of a test set, see ``sharding``
+    return gc.get_gold_aspect_values(cache_dir, os.path.dirname(__file__), get_aspect_value, path_text)
+
+
 def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='dataset_name', model_name='model_name',
              output_filename="./output.json", is_print_ci=False,
-             is_print_case=False, is_print_ece=False):
+             is_print_case=False, is_print_ece=False, ci_mode="independent", n_workers=1,
+             cache_dir=None, case_file=None, max_cases=None, stratify_cases=False, stats_file=None,
+             bucket_intervals=None):
+    if analysis_type == "combine":
+        return ms.evaluate_combine_f1(task_type, systems, dataset_name, model_name, output_filename,
+                                      os.path.dirname(__file__), get_aspect_value, get_span_chunks,
+                                      get_holistic_performance, cache_dir=cache_dir)
+    # every list of error cases, overall and per bucket, is kept by a CaseSampler of its own, which writes it to
+    # the case file as soon as it is final
+    case_writer = cs.CaseWriter(case_file) if case_file is not None else None
+    new_sampler = functools.partial(cs.CaseSampler, max_cases, stratify_cases, writer=case_writer)
+    if analysis_type == "pair":
+        return ms.evaluate_pair_f1(task_type, systems, dataset_name, model_name, output_filename, is_print_ci,
+                                   is_print_case, n_workers, os.path.dirname(__file__), get_aspect_value,
+                                   get_span_case, get_holistic_performance,
+                                   get_missing_label=get_missing_label, cache_dir=cache_dir,
+                                   case_file=case_writer, new_sampler=new_sampler)
+
     path_text = systems[0] if analysis_type == "single" else ""
-    path_comb_output = "model_name" + "/" + path_text.split("/")[-1]
+    path_comb_output = "model_name" + "/" + du.get_file_name(path_text)
     dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=os.path.dirname(__file__))
 
-    list_text_sent, list_text_token = ea.read_single_column(path_text, 0)
-    list_true_tags_sent, list_true_tags_token = ea.read_single_column(path_text, 1)
-    list_pred_tags_sent, list_pred_tags_token = ea.read_single_column(path_text, 2)
+    (list_text_sent, list_text_token), (list_true_tags_sent, list_true_tags_token), \
+        (list_pred_tags_sent, list_pred_tags_token) = du.conll_to_lists(path_text, col_ids=(0, 1, 2))
 
-    dict_span2aspect_val, dict_span2sid, dict_chunkid2span = get_aspect_value(list_text_token, list_true_tags_token,
-                                                                              list_text_sent,
-                                                                              list_true_tags_sent,
-                                                                              dict_precomputed_path,
-                                                                              dict_aspect_func)
-    dict_span2aspect_val_pred, dict_span2sid_pred, dict_chunkid2span_pred = get_aspect_value(list_text_token,
-                                                                                             list_pred_tags_token,
-                                                                                             list_text_sent,
-                                                                                             list_pred_tags_sent,
-                                                                                             dict_precomputed_path,
-                                                                                             dict_aspect_func)
+    dict_type2code = {}
+    dict_span2aspect_val, span_table, dict_bucket2span = gc.get_gold_side(
+        cache_dir, os.path.dirname(__file__), get_aspect_value, list_text_token, list_true_tags_token, list_text_sent,
+        list_true_tags_sent, dict_precomputed_path, dict_aspect_func, dict_type2code, bucket_intervals)
+    dict_span2aspect_val_pred, span_table_pred = get_aspect_value(list_text_token, list_pred_tags_token,
+                                                                  list_text_sent, list_pred_tags_sent,
+                                                                  dict_precomputed_path, dict_aspect_func,
+                                                                  dict_type2code)
+    st.align_span_tables(span_table, span_table_pred)
+    span2case = functools.partial(get_span_case, test_word_sequences=list_text_token,
+                                  test_word_sequences_sent=list_text_sent)
 
-    print(len(dict_chunkid2span), len(dict_chunkid2span_pred))
+    print(len(span_table), len(span_table_pred))
 
-    holistic_performance = ea.accuracy(list_true_tags_token, list_pred_tags_token)
+    holistic_performance = get_holistic_performance(list_true_tags_sent, list_pred_tags_sent, span_table,
+                                                    span_table_pred)
 
+    is_shared_ci = is_print_ci and ci_mode == "shared"
+    is_independent_ci = is_print_ci and not is_shared_ci
     confidence_low_overall, confidence_up_overall = 0, 0
-    if is_print_ci:
-        confidence_low_overall, confidence_up_overall = ea.compute_confidence_interval_f1(dict_span2sid.keys(),
-                                                                                          dict_span2sid_pred.keys(),
-                                                                                          dict_span2sid,
-                                                                                          dict_span2sid_pred,
-                                                                                          n_times=1000)
+    if is_independent_ci:
+        confidence_low_overall, confidence_up_overall = ea.compute_confidence_interval_f1(
+            numpy.arange(len(span_table)), numpy.arange(len(span_table_pred)), span_table, span_table_pred,
+            n_times=1000)
 
     print("------------------ Holistic Result")
     print()
@@ -112,26 +120,32 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
     print("confidence_low_overall:\t", confidence_low_overall)
     print("confidence_up_overall:\t", confidence_up_overall)
 
-    dict_bucket2span = {}
     dict_bucket2span_pred = {}
-    dict_bucket2f1 = {}
     aspect_names = []
     error_case_list = []
+    if is_print_case:
+        error_case_list = ea.get_error_case(span_table, span_table_pred, span2case, get_missing_label,
+                                            is_print_pred=False, sampler=new_sampler())
 
     for aspect, func in dict_aspect_func.items():
-        # print(aspect, dict_span2aspect_val[aspect])
-        dict_bucket2span[aspect] = ea.select_bucketing_func(func[0], func[1], dict_span2aspect_val[aspect])
         # print(aspect, dict_bucket2span[aspect])
         # exit()
         dict_bucket2span_pred[aspect] = ea.bucket_attribute_specified_bucket_interval(dict_span2aspect_val_pred[aspect],
                                                                                       dict_bucket2span[aspect].keys())
-        dict_bucket2f1[aspect], error_case_list = get_bucket_f1(dict_bucket2span[aspect],
-                                                                dict_bucket2span_pred[aspect], dict_span2sid,
-                                                                dict_span2sid_pred, dict_chunkid2span,
-                                                                dict_chunkid2span_pred, is_print_ci, is_print_case)
         aspect_names.append(aspect)
     print("aspect_names: ", aspect_names)
 
+    dict_bucket2f1 = ea.get_aspect_bucket_perf(
+        functools.partial(ea.get_bucket_f1, table_true=span_table, table_pred=span_table_pred, get_span_case=span2case,
+                          is_print_ci=is_independent_ci, is_print_case=is_print_case, new_sampler=new_sampler,
+                          get_missing_label=get_missing_label, n_times=100),
+        dict_bucket2span, dict_bucket2span_pred, n_workers)
+
+    if is_shared_ci:
+        (confidence_low_overall, confidence_up_overall), dict_aspect2ci = ea.compute_shared_confidence_interval_f1(
+            dict_bucket2span, dict_bucket2span_pred, span_table, span_table_pred)
+        ea.update_bucket_confidence_interval(dict_bucket2f1, dict_aspect2ci)
+
     print("------------------ Breakdown Performance")
     for aspect in dict_aspect_func.keys():
         ea.print_dict(dict_bucket2f1[aspect], aspect)
@@ -139,9 +153,9 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
 
     # Calculate databias w.r.t numeric attributes
     dict_aspect2bias = {}
-    for aspect, aspect2Val in dict_span2aspect_val.items():
-        if type(list(aspect2Val.values())[0]) != type("string"):
-            dict_aspect2bias[aspect] = numpy.average(list(aspect2Val.values()))
+    for aspect, aspect_vals in dict_span2aspect_val.items():
+        if not isinstance(aspect_vals[0], str):
+            dict_aspect2bias[aspect] = numpy.average(aspect_vals)
 
     print("------------------ Dataset Bias")
     for k, v in dict_aspect2bias.items():
@@ -184,184 +198,9 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
 
     obj_json["model"]["results"]["overall"]["error_case"] = error_case_list
 
-    ea.save_json(obj_json, output_filename)
-
+    if stats_file is not None:
+        overall_stats = bst.get_accuracy_stats(list_true_tags_token, list_pred_tags_token)
+        bst.save_stats(bst.get_stats(obj_json, overall_stats, dict_bucket2f1, dict_span2aspect_val), stats_file)
 
-def get_error_case_pos(dict_pos2tag, dict_pos2tag_pred, dict_chunkid2span_sent, dict_chunkid2span_sent_pred):
-    # print("debug-1:")
-    # print()
-
-    error_case_list = []
-    for pos, tag in dict_pos2tag.items():
-
-        true_label = tag
-        pred_label = ""
-        # print(dict_chunkid2span_sent.keys())
-        if pos + "_" + tag not in dict_chunkid2span_sent.keys():
-            continue
-        span_sentence = dict_chunkid2span_sent[pos + "_" + tag]
-
-        if pos in dict_pos2tag_pred.keys():
-            pred_label = dict_pos2tag_pred[pos]
-            if true_label == pred_label:
-                continue
-        else:
-            # pred_label = "O"
-            continue
-
-        error_case = ea.format4json2(span_sentence) + "|||" + true_label + "|||" + pred_label
-
-        # if pred_label == "O":
-        # 	print(error_case)
-        # 	print(len(dict_pos2tag), len(dict_pos2tag_pred))
-        # 	print(pos)
-
-        error_case_list.append(error_case)
-
-    # print(error_case_list)
-    return error_case_list
-
-
-def compute_confidence_interval_f1(spans_true, spans_pred, dict_span2sid, dict_span2sid_pred, n_times=100):
-    n_data = len(dict_span2sid)
-    sample_rate = ea.get_sample_rate(n_data)
-    n_sampling = int(n_data * sample_rate)
-    print("sample_rate:\t", sample_rate)
-    print("n_sampling:\t", n_sampling)
-
-    dict_sid2span_salient = {}
-    for span in spans_true:
-        # print(span)
-        if len(span.split("_")) != 3:
-            break
-        sid = dict_span2sid[span]
-        if sid in dict_sid2span_salient.keys():
-            dict_sid2span_salient[sid].append(span)
-        else:
-            dict_sid2span_salient[sid] = [span]
-
-    dict_sid2span_salient_pred = {}
-    for span in spans_pred:
-        sid = dict_span2sid_pred[span]
-        if sid in dict_sid2span_salient_pred.keys():
-            dict_sid2span_salient_pred[sid].append(span)
-        else:
-            dict_sid2span_salient_pred[sid] = [span]
-
-    performance_list = []
-    confidence_low, confidence_up = 0, 0
-    for i in range(n_times):
-        sample_index_list = choices(range(n_data), k=n_sampling)
-
-        true_label_bootstrap_list = []
-        pred_label_bootstrap_list = []
-        for ind, sid in enumerate(sample_index_list):
-
-            if sid in dict_sid2span_salient.keys():
-                true_label_list = dict_sid2span_salient[sid]
-                true_label_list_revised = [true_label + "_" + str(ind) for true_label in true_label_list]
-                true_label_bootstrap_list += true_label_list_revised
-
-            if sid in dict_sid2span_salient_pred.keys():
-                pred_label_list = dict_sid2span_salient_pred[sid]
-                pred_label_list_revised = [pred_label + "_" + str(ind) for pred_label in pred_label_list]
-                pred_label_bootstrap_list += pred_label_list_revised
-
-        f1, p, r = ea.evaluate_chunk_level(pred_label_bootstrap_list, true_label_bootstrap_list)
-        performance_list.append(f1)
-
-    if n_times != 1000:
-        confidence_low, confidence_up = ea.mean_confidence_interval(performance_list)
-    else:
-        performance_list.sort()
-        confidence_low = performance_list[24]
-        confidence_up = performance_list[974]
-
-    # print("\n")
-    # print("confidence_low:\t", confidence_low)
-    # print("confidence_up:\t", confidence_up)
-
-    return confidence_low, confidence_up
-
-
-def get_bucket_f1(dict_bucket2span, dict_bucket2span_pred, dict_span2sid, dict_span2sid_pred, dict_chunkid2span,
-                  dict_chunkid2span_pred, is_print_ci, is_print_case):
-    error_case_list = []
-
-    dict_bucket2f1 = {}
-
-    # predict:  2_3 -> NER
-    dict_pos2tag_pred = {}
-    if is_print_case:
-        for k_bucket_eval, spans_pred in dict_bucket2span_pred.items():
-            for span_pred in spans_pred:
-                pos_pred = "_".join(span_pred.split("_")[0:2])
-                tag_pred = span_pred.split("_")[-1]
-                dict_pos2tag_pred[pos_pred] = tag_pred
-    # print(dict_pos2tag_pred)
-
-    # true:  2_3 -> NER
-    dict_pos2tag = {}
-    if is_print_case:
-        for k_bucket_eval, spans in dict_bucket2span.items():
-            for span in spans:
-                pos = "_".join(span.split("_")[0:2])
-                tag = span.split("_")[-1]
-                dict_pos2tag[pos] = tag
-    # print(dict_pos2tag_pred)
-
-    if is_print_case:
-        error_case_list = get_error_case_pos(dict_pos2tag, dict_pos2tag_pred, dict_chunkid2span, dict_chunkid2span_pred)
-
-    for bucket_interval, spans_true in dict_bucket2span.items():
-        spans_pred = []
-
-        # print('bucket_interval: ',bucket_interval)
-        if bucket_interval not in dict_bucket2span_pred.keys():
-            # print(bucket_interval)
-            raise ValueError("Predict Label Bucketing Errors")
-        else:
-            spans_pred = dict_bucket2span_pred[bucket_interval]
-
-        confidence_low, confidence_up = 0, 0
-
-        if is_print_ci:
-            confidence_low, confidence_up = compute_confidence_interval_f1(spans_true, spans_pred, dict_span2sid,
-                                                                           dict_span2sid_pred)
-
-        confidence_low = format(confidence_low, '.3g')
-        confidence_up = format(confidence_up, '.3g')
-
-        f1, p, r = ea.evaluate_chunk_level(spans_pred, spans_true)
-
-        error_entity_list = []
-        if is_print_case:
-            for span_true in spans_true:
-                if span_true not in spans_pred:
-                    # print(span_true)
-                    pos_true = "_".join(span_true.split("_")[0:2])
-                    tag_true = span_true.split("_")[-1]
-
-                    if pos_true in dict_pos2tag_pred.keys():
-                        tag_pred = dict_pos2tag_pred[pos_true]
-                        if tag_pred != tag_true:
-                            error_entity_list.append(
-                                ea.format4json2(dict_chunkid2span[span_true]) + "|||" + tag_true + "|||" +
-                                dict_pos2tag_pred[pos_true])
-                    else:
-                        # error_entity_list.append(format4json_tc(dict_chunkid2span[span_true]) + "|||" + tag_true + "|||" + "O")
-                        continue
-
-        # print("confidence_low:\t", confidence_low)
-        # print("confidence_up:\t", confidence_up)
-        # print("F1:\t", f1)
-        # print(error_entity_list)
-
-        dict_bucket2f1[bucket_interval] = [f1, len(spans_true), confidence_low, confidence_up, error_entity_list]
-
-    # if bucket_interval[0] == 1.0:
-    # 	print("debug-f1:",f1)
-    # 	print(spans_pred[0:20])
-    # 	print(spans_true[0:20])
-    # print("dict_bucket2f1: ",dict_bucket2f1)
-    return ea.sort_dict(dict_bucket2f1), error_case_list
+    ea.save_json(obj_json, output_filename, case_writer)
+    return obj_json
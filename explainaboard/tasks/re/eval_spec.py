@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+import explainaboard.case_sampling as cs
 import explainaboard.error_analysis as ea
+import functools
 import numpy
 import os
 
@@ -70,7 +72,11 @@ def get_aspect_value(sample_list, dict_aspect_func):
 
 
 def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name = 'dataset_name', model_name = 'model_name', output_filename="./output.json", is_print_ci=False,
-             is_print_case=False, is_print_ece=False):
+             is_print_case=False, is_print_ece=False, ci_mode="independent", n_workers=1,
+             cache_dir=None, case_file=None, max_cases=None, stratify_cases=False, stats_file=None,
+             bucket_intervals=None):
+    # every list of error cases, overall and per bucket, is kept by a CaseSampler of its own
+    new_sampler = functools.partial(cs.CaseSampler, max_cases, stratify_cases)
 
     path_text = systems[0] if analysis_type == "single" else ""
     path_comb_output = "model_name" + "/" + path_text.split("/")[-1]
@@ -80,7 +86,7 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name =
 
     error_case_list = []
     if is_print_case:
-        error_case_list = get_error_case(sent_list, entity_list, true_list, pred_list)
+        error_case_list = get_error_case(sent_list, entity_list, true_list, pred_list, sampler=new_sampler())
         print(" -*-*-*- the number of error casse:\t", len(error_case_list))
 
     dict_span2aspect_val, dict_span2aspect_val_pred, dict_sid2sent = get_aspect_value(sample_list, dict_aspect_func)
@@ -89,8 +95,10 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name =
     holistic_performance = format(holistic_performance, '.3g')
 
     # Confidence Interval of Holistic Performance
+    is_shared_ci = is_print_ci and ci_mode == "shared"
+    is_independent_ci = is_print_ci and not is_shared_ci
     confidence_low, confidence_up = 0, 0
-    if is_print_ci:
+    if is_independent_ci:
         confidence_low, confidence_up = ea.compute_confidence_interval_acc(true_list, pred_list, n_times=1000)
 
     dict_span2aspect_val, dict_span2aspect_val_pred, dict_sid2sent = get_aspect_value(sample_list, dict_aspect_func)
@@ -102,7 +110,6 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name =
 
     dict_bucket2span = {}
     dict_bucket2span_pred = {}
-    dict_bucket2f1 = {}
     aspect_names = []
 
     for aspect, func in dict_aspect_func.items():
@@ -113,12 +120,19 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name =
         dict_bucket2span_pred[aspect] = ea.bucket_attribute_specified_bucket_interval(dict_span2aspect_val_pred[aspect],
                                                                                       dict_bucket2span[aspect].keys())
         # dict_bucket2span_pred[aspect] = __select_bucketing_func(func[0], func[1], dict_span2aspect_val_pred[aspect])
-        dict_bucket2f1[aspect] = get_bucket_acc_with_error_case(dict_bucket2span[aspect],
-                                                                dict_bucket2span_pred[aspect], dict_sid2sent,
-                                                                is_print_ci, is_print_case)
         aspect_names.append(aspect)
     print("aspect_names: ", aspect_names)
 
+    dict_bucket2f1 = ea.get_aspect_bucket_perf(
+        functools.partial(get_bucket_acc_with_error_case, dict_sid2sent=dict_sid2sent,
+                          is_print_ci=is_independent_ci, is_print_case=is_print_case, new_sampler=new_sampler),
+        dict_bucket2span, dict_bucket2span_pred, n_workers)
+
+    if is_shared_ci:
+        (confidence_low, confidence_up), dict_aspect2ci = ea.compute_shared_confidence_interval_acc(
+            dict_bucket2span, dict_bucket2span_pred, true_list, pred_list)
+        ea.update_bucket_confidence_interval(dict_bucket2f1, dict_aspect2ci)
+
     print("------------------ Breakdown Performance")
     for aspect in dict_aspect_func.keys():
         ea.print_dict(dict_bucket2f1[aspect], aspect)
@@ -234,7 +248,8 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name =
 # # python eval_spec.py  --task re --systems ./test_re.tsv --output ./a.json
 # if __name__ == '__main__':
 # 	main()
-def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict_sid2sent, is_print_ci, is_print_case):
+def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict_sid2sent, is_print_ci, is_print_case,
+                                   new_sampler=cs.CaseSampler):
     # The structure of span_true or span_pred
     # 2345|||Positive
     # 2345 represents sentence id
@@ -252,16 +267,18 @@ def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict
         # loop over samples from a given bucket
         error_case_bucket_list = []
         if is_print_case:
+            sampler = new_sampler()
             for info_true, info_pred in zip(spans_true, spans_pred):
                 sid_true, label_true = info_true.split("|||")
                 sid_pred, label_pred = info_pred.split("|||")
                 if sid_true != sid_pred:
                     continue
 
-                sent_entities = dict_sid2sent[sid_true]
                 if label_true != label_pred:
-                    error_case_info = label_true + "|||" + label_pred + "|||" + sent_entities
-                    error_case_bucket_list.append(error_case_info)
+                    slot = sampler.offer((label_true, label_pred))
+                    if slot is not None:
+                        sampler.put(slot, label_true + "|||" + label_pred + "|||" + dict_sid2sent[sid_true])
+            error_case_bucket_list = sampler.get_cases()
 
         accuracy_each_bucket = ea.accuracy(spans_pred, spans_true)
         confidence_low, confidence_up = 0, 0
@@ -273,12 +290,14 @@ def get_bucket_acc_with_error_case(dict_bucket2span, dict_bucket2span_pred, dict
     return ea.sort_dict(dict_bucket2f1)
 
 
-def get_error_case(sent_list, entity_list, true_label_list, pred_label_list):
-    error_case_list = []
+def get_error_case(sent_list, entity_list, true_label_list, pred_label_list, sampler=None):
+    sampler = sampler or cs.CaseSampler()
     for sent, entities, true_label, pred_label in zip(sent_list, entity_list, true_label_list, pred_label_list):
         if true_label != pred_label:
-            error_case_list.append(true_label + "|||" + pred_label + "|||" + entities + "|||" + ea.format4json2(sent))
-    return error_case_list
+            slot = sampler.offer((true_label, pred_label))
+            if slot is not None:
+                sampler.put(slot, true_label + "|||" + pred_label + "|||" + entities + "|||" + ea.format4json2(sent))
+    return sampler.get_cases()
 
 
 def file_to_list(file_path):
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 from collections import OrderedDict
 
+import explainaboard.bucket_stats as bst
+import explainaboard.case_sampling as cs
 import explainaboard.error_analysis as ea
+import functools
 import explainaboard.data_utils as du
 import numpy
 import os
 
 
-def get_aspect_value(sent_list, sample_list_tag, sample_list_tag_pred, dict_aspect_func):
+def get_aspect_value(sent_list, true_label_codes, pred_label_codes, dict_aspect_func, label_names):
+    # sent_list may be a lazily decoded column: each sentence is decoded here and again only for error cases
+    # the labels are codes into label_names, which only the gold tags of the "tag" aspect are looked up in
     dict_span2aspect_val = {}
     dict_span2aspect_val_pred = {}
 
@@ -15,13 +20,8 @@ def get_aspect_value(sent_list, sample_list_tag, sample_list_tag_pred, dict_aspe
         dict_span2aspect_val[aspect] = {}
         dict_span2aspect_val_pred[aspect] = {}
 
-    # maintain it for print error case
-    dict_sid2sent = {}
-
     sample_id = 0
-    for sent, tag, tag_pred in zip(sent_list, sample_list_tag, sample_list_tag_pred):
-
-        dict_sid2sent[str(sample_id)] = ea.format4json2(sent)
+    for sent, tag, tag_pred in zip(sent_list, true_label_codes.tolist(), pred_label_codes.tolist()):
 
         word_list = ea.word_segment(sent).split(" ")
 
@@ -39,39 +39,61 @@ def get_aspect_value(sent_list, sample_list_tag, sample_list_tag_pred, dict_aspe
         # Tag: tag
         aspect = "tag"  ############## MUST Be Gold Tag for text classification task
         if aspect in dict_aspect_func.keys():
-            dict_span2aspect_val[aspect][sent_pos] = tag
-            dict_span2aspect_val_pred[aspect][sent_pos_pred] = tag
+            dict_span2aspect_val[aspect][sent_pos] = label_names[tag]
+            dict_span2aspect_val_pred[aspect][sent_pos_pred] = label_names[tag]
 
         sample_id += 1
 
     # print(dict_span2aspect_val["bleu"])
-    return dict_span2aspect_val, dict_span2aspect_val_pred, dict_sid2sent
+    return dict_span2aspect_val, dict_span2aspect_val_pred
+
+
+def get_gold_aspect_values(path_text, cache_dir=None):
+    # the gold aspect values of a system output, e.g. of one shard of a test set, see ``sharding``
+    dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=os.path.dirname(__file__))
+    with du.open_tsv(path_text) as tsv:
+        tsv.check_columns(3)
+        (true_label_codes, pred_label_codes), label_names = tsv.get_codes((1, 2))
+        return get_aspect_value(tsv.get_column(0), true_label_codes, pred_label_codes, dict_aspect_func, label_names)[0]
 
 
 def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='dataset_name', model_name='model_name',
              output_filename="./output.json", is_print_ci=False,
-             is_print_case=False, is_print_ece=False):
+             is_print_case=False, is_print_ece=False, ci_mode="independent", n_workers=1,
+             cache_dir=None, case_file=None, max_cases=None, stratify_cases=False, stats_file=None,
+             bucket_intervals=None):
+    # every list of error cases, overall and per bucket, is kept by a CaseSampler of its own, which writes it to
+    # the case file as soon as it is final
+    case_writer = cs.CaseWriter(case_file) if case_file is not None else None
+    new_sampler = functools.partial(cs.CaseSampler, max_cases, stratify_cases, writer=case_writer)
     path_text = systems[0] if analysis_type == "single" else ""
-    path_comb_output = "model_name" + "/" + path_text.split("/")[-1]
+    path_comb_output = "model_name" + "/" + du.get_file_name(path_text)
     dict_aspect_func, dict_precomputed_path, obj_json = ea.load_task_conf(task_dir=os.path.dirname(__file__))
 
-    sent_list, true_label_list, pred_label_list = du.tsv_to_lists(path_text, col_ids=(0,1,2))
+    tsv = du.open_tsv(path_text)
+    tsv.check_columns(3)
+    sent_list = tsv.get_column(0)
+    # the labels stay codes: they are only looked up in label_names for the error cases
+    (true_label_codes, pred_label_codes), label_names = tsv.get_codes((1, 2))
 
     error_case_list = []
     if is_print_case:
-        error_case_list = ea.get_error_case_classification(sent_list, true_label_list, pred_label_list)
-        print(" -*-*-*- the number of error casse:\t", len(error_case_list))
+        error_case_list = ea.get_error_case_classification(true_label_codes, pred_label_codes, sent_list,
+                                                           sampler=new_sampler(), label_names=label_names)
+        print(" -*-*-*- the number of error casse:\t", cs.count_cases(error_case_list))
 
     # Confidence Interval of Holistic Performance
+    is_shared_ci = is_print_ci and ci_mode == "shared"
+    is_independent_ci = is_print_ci and not is_shared_ci
     confidence_low, confidence_up = 0, 0
-    if is_print_ci:
-        confidence_low, confidence_up = ea.compute_confidence_interval_acc(true_label_list, pred_label_list,
+    if is_independent_ci:
+        confidence_low, confidence_up = ea.compute_confidence_interval_acc(true_label_codes, pred_label_codes,
                                                                            n_times=1000)
 
-    dict_span2aspect_val, dict_span2aspect_val_pred, dict_sid2sent = get_aspect_value(sent_list, true_label_list,
-                                                                                      pred_label_list, dict_aspect_func)
+    dict_span2aspect_val, dict_span2aspect_val_pred = get_aspect_value(sent_list, true_label_codes, pred_label_codes,
+                                                                       dict_aspect_func, label_names)
 
-    holistic_performance = ea.accuracy(true_label_list, pred_label_list)
+    holistic_performance = ea.accuracy(true_label_codes, pred_label_codes)
     holistic_performance = format(holistic_performance, '.3g')
 
     print("------------------ Holistic Result----------------------")
@@ -81,23 +103,31 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
 
     dict_bucket2span = {}
     dict_bucket2span_pred = {}
-    dict_bucket2f1 = {}
     aspect_names = []
 
     for aspect, func in dict_aspect_func.items():
         # print(aspect, dict_span2aspect_val[aspect])
-        dict_bucket2span[aspect] = ea.select_bucketing_func(func[0], func[1], dict_span2aspect_val[aspect])
+        dict_bucket2span[aspect] = ea.select_bucketing_func(func[0], func[1], dict_span2aspect_val[aspect],
+                                                            (bucket_intervals or {}).get(aspect))
         # print(aspect, dict_bucket2span[aspect])
         # exit()
         dict_bucket2span_pred[aspect] = ea.bucket_attribute_specified_bucket_interval(dict_span2aspect_val_pred[aspect],
                                                                                       dict_bucket2span[aspect].keys())
         # dict_bucket2span_pred[aspect] = __select_bucketing_func(func[0], func[1], dict_span2aspect_val_pred[aspect])
-        dict_bucket2f1[aspect] = ea.get_bucket_acc_with_error_case(dict_bucket2span[aspect],
-                                                                   dict_bucket2span_pred[aspect],
-                                                                   dict_sid2sent, is_print_ci, is_print_case)
         aspect_names.append(aspect)
     print("aspect_names: ", aspect_names)
 
+    dict_bucket2f1 = ea.get_aspect_bucket_perf(
+        functools.partial(ea.get_bucket_acc_with_error_case, sent_list=sent_list.map(ea.format4json2),
+                          is_print_ci=is_independent_ci, is_print_case=is_print_case, new_sampler=new_sampler,
+                          label_names=label_names),
+        dict_bucket2span, dict_bucket2span_pred, n_workers)
+
+    if is_shared_ci:
+        (confidence_low, confidence_up), dict_aspect2ci = ea.compute_shared_confidence_interval_acc(
+            dict_bucket2span, dict_bucket2span_pred, true_label_codes, pred_label_codes)
+        ea.update_bucket_confidence_interval(dict_bucket2f1, dict_aspect2ci)
+
     print("------------------ Breakdown Performance")
     for aspect in dict_aspect_func.keys():
         ea.print_dict(dict_bucket2f1[aspect], aspect)
@@ -127,13 +157,14 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
             # bucket_value = format(v[0]*100,'.4g')
             bucket_value = format(v[0], '.4g')
             n_sample = v[1]
-            confidence_low = format(v[2], '.4g')
-            confidence_up = format(v[3], '.4g')
+            confidence_low_bucket = format(v[2], '.4g')
+            confidence_up_bucket = format(v[3], '.4g')
             bucket_error_case = v[4]
 
             # instantiation
             dict_fine_grained[aspect].append({"bucket_name": bucket_name, "bucket_value": bucket_value, "num": n_sample,
-                                              "confidence_low": confidence_low, "confidence_up": confidence_up,
+                                              "confidence_low": confidence_low_bucket,
+                                              "confidence_up": confidence_up_bucket,
                                               "bucket_error_case": bucket_error_case})
 
     obj_json["task"] = task_type
@@ -151,12 +182,20 @@ def evaluate(task_type="ner", analysis_type="single", systems=[], dataset_name='
 
     ece = 0
     dic_calibration = None
+    ece_bins = None
     if is_print_ece:
-        ece, dic_calibration = ea.calculate_ece_by_file(path_text, prob_col=3, right_or_not_col=4,
-                                                        size_of_bin=10, dataset="dataset_name", model="model_name")
+        ece_bins = ea.get_ece_bins_by_file(path_text, prob_col=3, right_or_not_col=4, size_of_bin=10)
+        ece, dic_calibration = ea.get_calibration(ece_bins, dataset="dataset_name", model="model_name")
 
     obj_json["model"]["results"]["calibration"] = dic_calibration
     # print(dic_calibration)
 
-    ea.save_json(obj_json, output_filename)
+    if stats_file is not None:
+        overall_stats = bst.get_accuracy_stats(true_label_codes, pred_label_codes)
+        bst.save_stats(bst.get_stats(obj_json, overall_stats, dict_bucket2f1, dict_span2aspect_val, ece_bins, '.3g'),
+                       stats_file)
+
+    ea.save_json(obj_json, output_filename, case_writer)
+    tsv.close()
+    return obj_json
 
@@ -0,0 +1,63 @@
+import unittest
+import os
+import json
+import tempfile
+import numpy as np
+import explainaboard.api as api
+import explainaboard.data_utils as du
+import explainaboard.explainaboard_main as em
+
+
+class ApiTest(unittest.TestCase):
+    '''
+    Tests of the analysis of system outputs held in memory
+    '''
+    def __init__(self, *args, **kwargs):
+        super(ApiTest, self).__init__(*args, **kwargs)
+        path_file = os.path.dirname(__file__)
+        self.example_dir = os.path.join(path_file, os.pardir, 'example')
+
+    def get_file_report(self, task, path_text, **kwargs):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_output = os.path.join(tmp_dir, 'output.json')
+            obj_json = em.run_explainaboard(task, [path_text], path_output, **kwargs)
+            with open(path_output) as fin:
+                obj_json_file = json.load(fin)
+        # the returned report is the one written to the file
+        self.assertEqual(json.loads(json.dumps(obj_json)), obj_json_file)
+        return obj_json_file
+
+    def test_ner_sentences(self):
+        path_text = os.path.join(self.example_dir, 'test-conll03.tsv')
+        obj_json = self.get_file_report('ner', path_text, is_print_case=True)
+        (text_sent, _), (true_sent, _), (pred_sent, _) = du.conll_to_lists(path_text, col_ids=(0, 1, 2))
+        report = api.analyze('ner', [text_sent, true_sent, pred_sent], name='test-conll03.tsv', is_print_case=True)
+        self.assertEqual(json.loads(json.dumps(report.obj_json)), obj_json)
+        self.assertEqual(report.performance, obj_json['model']['results']['overall']['performance'])
+        self.assertEqual(sum(bucket.num for bucket in report.fine_grained['tag']),
+                         sum(bucket['num'] for bucket in obj_json['model']['results']['fine_grained']['tag']))
+        self.assertIsNone(report.ece)
+
+    def test_tc_arrays(self):
+        path_text = os.path.join(self.example_dir, 'test-atis.tsv')
+        obj_json = self.get_file_report('tc', path_text, is_print_ece=True)
+        sent_list, true_label_list, pred_label_list, prob_list, right_list = du.tsv_to_lists(path_text,
+                                                                                             (0, 1, 2, 3, 4))
+        report = api.analyze('tc', [np.array(sent_list), np.array(true_label_list), np.array(pred_label_list),
+                                    np.array(prob_list, dtype=np.float64), np.array(right_list, dtype=np.int64)],
+                             is_print_ece=True)
+        self.assertEqual(report.performance, float(obj_json['model']['results']['overall']['performance']))
+        self.assertEqual([[bucket.name, bucket.performance, bucket.num] for bucket in report.fine_grained['sLen']],
+                         [[bucket['bucket_name'], float(bucket['bucket_value']), bucket['num']]
+                          for bucket in obj_json['model']['results']['fine_grained']['sLen']])
+        # pandas reads the probabilities of the file to within the last digit
+        self.assertAlmostEqual(report.ece, obj_json['model']['results']['calibration']['ECE'])
+
+    def test_unsupported(self):
+        tsv = du.InMemoryTsv([['a'], ['b'], ['b']])
+        self.assertRaises(ValueError, em.run_explainaboard, 'tc', [tsv], None, report_cache_dir='.')
+        self.assertRaises(ValueError, em.run_explainaboard, 'tc', [tsv], None, case_file='cases.jsonl')
+
+
+if __name__ == '__main__':
+    unittest.main()
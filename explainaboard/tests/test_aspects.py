@@ -0,0 +1,40 @@
+import unittest
+import explainaboard.aspects as asp
+import explainaboard.span_table as st
+
+
+class AspectsTest(unittest.TestCase):
+    '''
+    Tests of the column-wise aspect functions
+    '''
+    def get_columns(self):
+        words_sent = [['EU', 'rejects', 'German', 'call'], ['Peter', 'Blackburn']]
+        words = [word for sent in words_sent for word in sent]
+        token_sent_id = st.get_token_sent_id([len(sent) for sent in words_sent])
+        span_table = st.SpanTable.from_chunks([('org', 0, 1), ('misc', 2, 3), ('per', 4, 6)], token_sent_id, {}, 2)
+        return asp.SpanColumns(span_table, words, words_sent, {})
+
+    def test_aspect_values(self):
+        dict_aspect_func = {aspect: None for aspect in ('sLen', 'rPos', 'eLen', 'eDen', 'tag', 'capital')}
+        dict_span2aspect_val = asp.get_aspect_values('ner', dict_aspect_func, self.get_columns())
+        self.assertEqual(list(dict_span2aspect_val.keys()), list(dict_aspect_func.keys()))
+        self.assertEqual(dict_span2aspect_val['sLen'].tolist(), [4.0, 4.0, 2.0])
+        self.assertEqual(dict_span2aspect_val['rPos'].tolist(), [0.0, 0.5, 0.0])
+        self.assertEqual(dict_span2aspect_val['eLen'].tolist(), [1.0, 1.0, 2.0])
+        self.assertEqual(dict_span2aspect_val['eDen'].tolist(), [0.5, 0.5, 1.0])
+        self.assertEqual(dict_span2aspect_val['tag'].tolist(), ['org', 'misc', 'per'])
+        self.assertEqual(dict_span2aspect_val['capital'].tolist(), ['full_caps', 'first_caps', 'first_caps'])
+
+    def test_register_aspect(self):
+        @asp.register_aspect('nWords', tasks=['ner'])
+        def get_n_words(columns):
+            return [text.count(' ') + 1 for text in columns.span_text]
+
+        self.assertEqual(asp.get_aspect_values('ner', {'nWords': None}, self.get_columns())['nWords'].tolist(),
+                         [1, 1, 2])
+        self.assertRaises(ValueError, asp.get_aspect_values, 'chunk', {'nWords': None}, self.get_columns())
+        self.assertRaises(ValueError, asp.get_aspect_values, 'ner', {'eFre': None}, self.get_columns())
+
+
+if __name__ == '__main__':
+    unittest.main()
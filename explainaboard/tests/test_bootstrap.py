@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+import explainaboard.bootstrap as bs
+import explainaboard.error_analysis as ea
+import explainaboard.span_table as st
+
+
+class BootstrapTest(unittest.TestCase):
+    '''
+    Tests of the vectorized bootstrap engine used for confidence intervals
+    '''
+    def test_resample_counts(self):
+        counts = bs.resample_counts(7, 5, 3, bs.get_rng(0))
+        self.assertEqual(counts.shape, (3, 7))
+        self.assertTrue(np.all(counts.sum(axis=1) == 5))
+
+    def test_resample_sums_columns(self):
+        stats = np.ones((10, 2))
+        stats[:, 1] = 2
+        sums = bs.resample_sums(stats, n_sampling=4, n_times=20, seed=0)
+        self.assertEqual(sums.shape, (20, 2))
+        self.assertTrue(np.all(sums[:, 0] == 4))
+        self.assertTrue(np.all(sums[:, 1] == 8))
+
+    def test_accuracy_interval(self):
+        rng = np.random.default_rng(1)
+        true_labels = list(rng.choice(['a', 'b', 'c'], size=2000))
+        pred_labels = [t if rng.random() < 0.7 else 'a' for t in true_labels]
+        accuracy = ea.accuracy(true_labels, pred_labels)
+        low, up = ea.compute_confidence_interval_acc(true_labels, pred_labels, seed=0)
+        self.assertLess(low, accuracy)
+        self.assertGreater(up, accuracy)
+        self.assertLess(up - low, 10)
+
+    def test_constant_correctness(self):
+        low, up = bs.accuracy_confidence_interval(np.ones(50), seed=0)
+        self.assertEqual((low, up), (100.0, 100.0))
+
+    def test_sentence_f1_stats(self):
+        token_sent_id = st.get_token_sent_id([6, 2, 3])
+        dict_type2code = {}
+        table_true = st.SpanTable.from_chunks([('per', 0, 1), ('loc', 3, 5), ('org', 7, 8)], token_sent_id,
+                                              dict_type2code)
+        table_pred = st.SpanTable.from_chunks([('per', 0, 1), ('org', 3, 5), ('org', 9, 10)], token_sent_id,
+                                              dict_type2code)
+        st.align_span_tables(table_true, table_pred)
+        self.assertEqual(table_true.match.tolist(), [0, -1, -1])
+        self.assertEqual(table_true.pos_match.tolist(), [0, 1, -1])
+        stats = ea.get_sentence_f1_stats(np.arange(3), np.arange(3), table_true, table_pred)
+        self.assertEqual(stats.tolist(), [[1, 2, 2], [0, 0, 1], [0, 1, 0]])
+        f1, p, r = ea.evaluate_chunk_level(['0_1_per', '3_5_org', '9_10_org'], ['0_1_per', '3_5_loc', '7_8_org'])
+        self.assertAlmostEqual(float(bs.f1_from_counts(*stats.sum(axis=0))), f1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import explainaboard.bucket_stats as bst
+
+
+class BucketStatsTest(unittest.TestCase):
+    '''
+    Tests of merging the bucket statistics of several runs
+    '''
+    def get_stats(self, overall, tag_buckets, len_buckets):
+        return {"format": bst.STATS_FORMAT, "task": "ner", "overall": overall,
+                "bias": {"eLen": {"sum": float(overall["n_true"]), "count": overall["n_true"]}},
+                "fine_grained": {"tag": [dict(interval=[tag], **counts) for tag, counts in tag_buckets],
+                                 "eLen": [dict(interval=interval, **counts) for interval, counts in len_buckets]},
+                "calibration": None}
+
+    def test_merge_stats(self):
+        counts = {"n_correct": 1, "n_pred": 2, "n_true": 2}
+        stats_a = self.get_stats(counts, [("per", counts)], [([1.0], counts), ([2.0, 5.0], counts)])
+        stats_b = self.get_stats(counts, [("loc", counts), ("per", counts)], [([1.0], counts), ([2.0, 5.0], counts)])
+        stats = bst.merge_stats([stats_a, stats_b])
+        self.assertEqual(stats["overall"], {"n_correct": 2, "n_pred": 4, "n_true": 4})
+        self.assertEqual(stats["bias"], {"eLen": {"sum": 4.0, "count": 4}})
+        self.assertEqual([(bucket["interval"], bucket["n_true"]) for bucket in stats["fine_grained"]["tag"]],
+                         [(["loc"], 2), (["per"], 4)])
+        self.assertEqual([bucket["n_correct"] for bucket in stats["fine_grained"]["eLen"]], [2, 2])
+        self.assertEqual(bst.get_performance(stats["overall"]), 50.)
+        # the inputs are left untouched
+        self.assertEqual(stats_a["overall"], counts)
+
+        stats_c = self.get_stats(counts, [], [([1.0], counts), ([2.0, 4.0], counts)])
+        self.assertRaises(ValueError, bst.merge_stats, [stats_a, stats_c])
+
+    def test_bucket_intervals(self):
+        counts = {"n_correct": 1, "n_total": 2}
+        stats = self.get_stats({"n_correct": 1, "n_pred": 2, "n_true": 2}, [("per", counts)],
+                               [([0.5, 1.0], counts), ([1.0], counts)])
+        # single values come first, as they are bucketed before the ranges
+        self.assertEqual(bst.get_bucket_intervals(stats), {"eLen": [(1.0,), (0.5, 1.0)]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import numpy as np
+import explainaboard.error_analysis as ea
+import explainaboard.span_table as st
+
+
+class BucketingTest(unittest.TestCase):
+    '''
+    Tests of the bucketing functions shared by all tasks
+    '''
+    def test_specified_bucket_interval(self):
+        dict_span2att_val = {'a': 0.5, 'b': 1.0, 'c': 0.0, 'd': 3.0, 'e': 1.0, 'f': 7.0}
+        intervals = [(1.0,), (0.0, 0.5), (0.6, 1.0), (2.0, 5.0)]
+        dict_bucket2span = ea.bucket_attribute_specified_bucket_interval(dict_span2att_val, intervals)
+        # the single value (1.0,) is listed first and wins over (0.6, 1.0); 7.0 falls into no bucket
+        self.assertEqual(dict_bucket2span, {(1.0,): ['b', 'e'], (0.0, 0.5): ['c', 'a'], (0.6, 1.0): [],
+                                            (2.0, 5.0): ['d']})
+
+    def test_specified_bucket_interval_discrete(self):
+        dict_span2att_val = {0: 'per', 1: 'loc', 2: 'per', 3: 'misc'}
+        dict_bucket2span = ea.bucket_attribute_specified_bucket_interval(dict_span2att_val,
+                                                                         [('per',), ('org',), ('loc',)])
+        self.assertEqual(dict_bucket2span, {('per',): [0, 2], ('org',): [], ('loc',): [1]})
+
+    def test_specified_bucket_value(self):
+        att_vals = np.array([0.0, 3.0, 1.0, 2.0, 0.0, 4.0, 2.0, 5.0])
+        dict_bucket2span = ea.bucket_attribute_specified_bucket_value(att_vals, 3, [0.0])
+        # 0.0 gets a bucket of its own, the remaining six spans are split into buckets of more than three
+        self.assertEqual([(interval, index.tolist()) for interval, index in dict_bucket2span.items()],
+                         [((0.0,), [0, 4]), ((1.0, 3.0), [2, 3, 6, 1]), ((4.0, 1000000), [5, 7])])
+        # spans named by dict keys are bucketed by their position and then named
+        dict_span2att_val = dict(zip('abcdefgh', att_vals.tolist()))
+        self.assertEqual(ea.select_bucketing_func('bucket_attribute_SpecifiedBucketValue', '3\t[0.0]',
+                                                  dict_span2att_val),
+                         {(0.0,): ['a', 'e'], (1.0, 3.0): ['c', 'd', 'g', 'b'], (4.0, 1000000): ['f', 'h']})
+
+    def test_discrete_value(self):
+        att_vals = np.array(['per', 'loc', 'per', 'misc', 'loc', 'org'])
+        # the most frequent values first, equally frequent ones in the order they first occur
+        self.assertEqual([(interval, index.tolist()) for interval, index in
+                          ea.bucket_attribute_discrete_value(att_vals, 3, 1).items()],
+                         [(('per',), [0, 2]), (('loc',), [1, 4]), (('misc',), [3])])
+        self.assertEqual(list(ea.bucket_attribute_discrete_value(att_vals, 10, 2).keys()), [('per',), ('loc',)])
+
+    def test_equal_frequency_buckets_indices(self):
+        intervals, bucket_spans = ea.get_equal_frequency_buckets([0.2, 0.1, 0.4, 0.3, 0.1], 2, [])
+        self.assertEqual(intervals, [(0.1, 0.2), (0.3, 1.0)])
+        self.assertEqual([list(index) for index in bucket_spans], [[1, 4, 0], [3, 2]])
+
+    def test_bucket_error_case(self):
+        token_sent_id = st.get_token_sent_id([6, 2, 3])
+        dict_type2code = {}
+        table_true = st.SpanTable.from_chunks([('per', 0, 1), ('loc', 3, 5), ('org', 7, 8)], token_sent_id,
+                                              dict_type2code)
+        table_pred = st.SpanTable.from_chunks([('per', 0, 1), ('org', 3, 5), ('org', 9, 10)], token_sent_id,
+                                              dict_type2code)
+        st.align_span_tables(table_true, table_pred)
+        spans_correct = ea.get_correct_spans([0, 1, 2], [0, 1, 2], table_true, table_pred)
+        error_case_list = ea.get_bucket_error_case([0, 1, 2], spans_correct, table_true, table_pred,
+                                                   lambda table, span: str(table.start[span]))
+        self.assertEqual(error_case_list, ['3|||loc|||org', '7|||org|||O'])
+
+    def test_aspect_bucket_perf_workers(self):
+        dict_aspect2bucket2span = {'len': {(1.0,): ['0|||a', '1|||b'], (2.0, 3.0): ['2|||a']},
+                                   'tag': {('a',): ['0|||a']}}
+        dict_aspect2bucket2span_pred = {'len': {(1.0,): ['0|||a', '1|||a'], (2.0, 3.0): ['2|||a']},
+                                        'tag': {('a',): ['0|||a']}}
+
+        def get_bucket_perf(dict_bucket2span, dict_bucket2span_pred):
+            return {bucket_interval: [ea.accuracy(dict_bucket2span_pred[bucket_interval], spans_true)]
+                    for bucket_interval, spans_true in dict_bucket2span.items()}
+
+        serial = ea.get_aspect_bucket_perf(get_bucket_perf, dict_aspect2bucket2span, dict_aspect2bucket2span_pred)
+        parallel = ea.get_aspect_bucket_perf(get_bucket_perf, dict_aspect2bucket2span, dict_aspect2bucket2span_pred,
+                                             n_workers=2)
+        self.assertEqual(serial, {'len': {(1.0,): [50.0], (2.0, 3.0): [100.0]}, 'tag': {('a',): [100.0]}})
+        self.assertEqual(parallel, serial)
+
+    def test_span_f1(self):
+        def get_tables(list_true_tags_sent, list_pred_tags_sent):
+            token_sent_id = st.get_token_sent_id([len(sent) for sent in list_true_tags_sent])
+            dict_type2code = {}
+            return [st.SpanTable.from_chunks([(chunk[0].lower(), chunk[1], chunk[2]) for chunk in
+                                              ea.get_chunks([tag for sent in tags_sent for tag in sent])],
+                                             token_sent_id, dict_type2code) for tags_sent in (list_true_tags_sent,
+                                                                                            list_pred_tags_sent)]
+
+        tags_true = [['B-PER', 'I-PER', 'O'], ['I-LOC', 'B-ORG'], ['O']]
+        tags_pred = [['B-PER', 'I-PER', 'O'], ['B-LOC', 'I-LOC'], ['O']]
+        tables = get_tables(tags_true, tags_pred)
+        self.assertTrue(ea.is_seqeval_spans(tags_true, tags_pred, *tables))
+        self.assertEqual(ea.span_f1(tags_true, tags_pred, *tables), ea.f1(tags_true, tags_pred))
+        # the predicted loc runs on into the next sentence, where seqeval ends it
+        tags_pred[0][2], tags_pred[1][0] = 'B-LOC', 'I-LOC'
+        tables = get_tables(tags_true, tags_pred)
+        self.assertFalse(ea.is_seqeval_spans(tags_true, tags_pred, *tables))
+        self.assertEqual(ea.span_f1(tags_true, tags_pred, *tables), ea.f1(tags_true, tags_pred))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+import explainaboard.case_sampling as cs
+import explainaboard.error_analysis as ea
+
+
+class CaseSamplingTest(unittest.TestCase):
+    '''
+    Tests of the bounded sampling of error cases
+    '''
+    def test_reservoir(self):
+        sampler = cs.CaseSampler(max_cases=10, seed=1)
+        for i in range(1000):
+            sampler.add(i)
+        cases = sampler.get_cases()
+        self.assertEqual(len(cases), 10)
+        self.assertEqual(cases.n_cases, 1000)
+        # the sample keeps the original order
+        self.assertEqual(cases, sorted(cases))
+        self.assertEqual(len(set(cases)), 10)
+        self.assertIsNone(cases.dict_stratum2count)
+
+    def test_uncapped(self):
+        sampler = cs.CaseSampler()
+        for i in range(100):
+            sampler.add(i, stratum=i % 3)
+        self.assertEqual(sampler.get_cases(), list(range(100)))
+
+    def test_stratified(self):
+        sampler = cs.CaseSampler(max_cases=2, is_stratified=True)
+        for i in range(100):
+            # the rare stratum is sampled as well as the frequent one
+            sampler.add(i, stratum=('a', 'b') if i % 50 else ('a', 'c'))
+        cases = sampler.get_cases()
+        self.assertEqual(len(cases), 4)
+        self.assertTrue(0 in cases and 50 in cases)
+        self.assertEqual(cases.dict_stratum2count, {('a', 'c'): 2, ('a', 'b'): 98})
+
+    def test_lazy_cases(self):
+        sampler = cs.CaseSampler(max_cases=5)
+        n_built = 0
+        for i in range(100):
+            slot = sampler.offer()
+            if slot is not None:
+                n_built += 1
+                sampler.put(slot, str(i))
+        self.assertLess(n_built, 100)
+        self.assertEqual(len(sampler.get_cases()), 5)
+
+    def test_label_codes(self):
+        label_names = ['a', 'b', 'c']
+        true_codes, pred_codes = np.array([0, 1, 2, 0, 1] * 20), np.array([0, 2, 2, 1, 1] * 20)
+        texts = ['text %d' % i for i in range(100)]
+        true_labels, pred_labels = [[label_names[code] for code in codes] for codes in (true_codes, pred_codes)]
+        # error cases of label codes are those of the labels they stand for
+        for args in ((3, True), (None, False)):
+            cases = ea.get_error_case_classification(true_codes, pred_codes, texts, sampler=cs.CaseSampler(*args),
+                                                     label_names=label_names)
+            cases_labels = ea.get_error_case_classification(true_labels, pred_labels, texts,
+                                                            sampler=cs.CaseSampler(*args))
+            self.assertEqual(cases, cases_labels)
+            self.assertEqual(cases.dict_stratum2count, cases_labels.dict_stratum2count)
+        self.assertEqual(ea.accuracy(true_codes, pred_codes), ea.accuracy(true_labels, pred_labels))
+
+    def test_case_writer(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_report, path_cases = os.path.join(tmp_dir, 'report.json'), os.path.join(tmp_dir, 'cases.jsonl')
+            case_writer = cs.CaseWriter(path_cases)
+            sampler = cs.CaseSampler(max_cases=2, is_stratified=True, writer=case_writer)
+            for i in range(10):
+                sampler.add('case %d' % i, stratum=('a', 'b'))
+            # the cases are written as soon as they are final, only their index stays in the report
+            obj_json = {'error_case': sampler.get_cases(), 'fine_grained': [{'bucket_error_case': ['case x']}]}
+            self.assertEqual(obj_json['error_case'], {'offset': 0, 'count': 2})
+            ea.save_json(obj_json, path_report, case_writer)
+            with open(path_report) as fin:
+                report = json.load(fin)
+            self.assertEqual((report['error_case_num'], report['error_case_strata']), (10, {'a|||b': 10}))
+            self.assertEqual(len(ea.load_error_cases(path_cases, report['error_case'])), 2)
+            self.assertEqual(ea.load_error_cases(path_cases, report['fine_grained'][0]['bucket_error_case']),
+                             ['case x'])
+
+
+if __name__ == '__main__':
+    unittest.main()
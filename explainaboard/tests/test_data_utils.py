@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import explainaboard.data_utils as du
+import explainaboard.error_analysis as ea
+
+
+class DataUtilsTest(unittest.TestCase):
+    '''
+    Tests of the system output readers
+    '''
+    def test_conll_to_lists(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_file = os.path.join(tmp_dir, 'test.tsv')
+            with open(path_file, 'w') as fout:
+                fout.write('EU\tB-ORG\tB-ORG\nrejects\tO\tO\n\n\nPeter\tB-PER\tB-LOC\n\n')
+            (text_sent, text_token), (pred_sent, pred_token) = du.conll_to_lists(path_file, col_ids=(0, 2))
+        self.assertEqual(text_sent, [['EU', 'rejects'], ['Peter']])
+        self.assertEqual(text_token, ['EU', 'rejects', 'Peter'])
+        self.assertEqual(pred_sent, [['B-ORG', 'O'], ['B-LOC']])
+        self.assertEqual(pred_token, ['B-ORG', 'O', 'B-LOC'])
+    def test_iter_conll_sentences(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_file = os.path.join(tmp_dir, 'train.conll')
+            with open(path_file, 'w') as fout:
+                fout.write('-DOCSTART- -X- O\n\nEU NNP B-ORG\nrejects VBZ O\n\n\nPeter NNP B-PER')
+            sents = list(du.iter_conll_sentences(path_file, col_ids=(0, -1)))
+        self.assertEqual(sents, [[['EU', 'rejects'], ['B-ORG', 'O']], [['Peter'], ['B-PER']]])
+
+    def test_mapped_tsv(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_file = os.path.join(tmp_dir, 'test.tsv')
+            with open(path_file, 'w') as fout:
+                fout.write('EU\tB-ORG\tB-ORG\nrejects\tO\tO\n\nPeter\tB-PER\tB-LOC')
+            tsv = du.MappedTsv(path_file)
+            self.assertEqual(len(tsv), 3)
+            self.assertEqual(tsv.line_start.dtype, np.uint32)
+            self.assertEqual(tsv.sent_starts.tolist(), [0, 2])
+            self.assertEqual(tsv.sent_ends.tolist(), [2, 3])
+            text = tsv.get_column(0)
+            self.assertEqual((text[2], text[0:2]), ('Peter', ['EU', 'rejects']))
+            self.assertEqual(list(text.map(str.lower)), ['eu', 'rejects', 'peter'])
+            (true_codes, pred_codes), label_names = tsv.get_codes((1, 2))
+            self.assertEqual([label_names[code] for code in true_codes], ['B-ORG', 'O', 'B-PER'])
+            self.assertEqual([label_names[code] for code in pred_codes], ['B-ORG', 'O', 'B-LOC'])
+            tsv.check_columns(3)
+            self.assertRaises(ValueError, tsv.check_columns, 4)
+            tsv.close()
+            with du.MappedTsv(path_file) as tsv:
+                self.assertEqual(tsv.get_column(2)[1], 'O')
+            self.assertRaises(ValueError, tsv.get_column(0).__getitem__, 0)
+
+    def test_label_code_error_cases(self):
+        label_names = ['a', 'b', 'c']
+        true_codes, pred_codes = np.array([0, 1, 2, 0, 1] * 20), np.array([0, 2, 2, 1, 1] * 20)
+        texts = ['text %d' % i for i in range(100)]
+        true_labels, pred_labels = [[label_names[code] for code in codes] for codes in (true_codes, pred_codes)]
+        # error cases of label codes are those of the labels they stand for
+        self.assertEqual(ea.get_error_case_classification(true_codes, pred_codes, texts, label_names=label_names),
+                         ea.get_error_case_classification(true_labels, pred_labels, texts))
+        self.assertEqual(ea.accuracy(true_codes, pred_codes), ea.accuracy(true_labels, pred_labels))
+
+    def test_in_memory_tsv(self):
+        tsv = du.InMemoryTsv.from_sentences([[['EU', 'rejects'], ['Peter']], [['B-ORG', 'O'], ['B-PER']],
+                                             [['B-ORG', 'O'], ['B-LOC']]])
+        self.assertEqual((tsv.sent_starts.tolist(), tsv.sent_ends.tolist()), ([0, 2], [2, 3]))
+        (text_sent, text_token), (pred_sent, pred_token) = du.conll_to_lists(tsv, col_ids=(0, 2))
+        self.assertEqual(text_sent, [['EU', 'rejects'], ['Peter']])
+        self.assertEqual(pred_token, ['B-ORG', 'O', 'B-LOC'])
+        self.assertEqual(list(tsv.get_column(0).map(str.lower)), ['eu', 'rejects', 'peter'])
+        (true_codes, pred_codes), label_names = tsv.get_codes((1, 2))
+        self.assertEqual([label_names[code] for code in pred_codes], ['B-ORG', 'O', 'B-LOC'])
+        self.assertRaises(ValueError, tsv.check_columns, 4)
+        self.assertRaises(ValueError, du.tsv_to_lists, tsv, col_ids=(0, 3))
+        self.assertRaises(ValueError, du.InMemoryTsv, [['EU', 'rejects'], ['B-ORG']])
+
+        # fields are kept as the strings of a tsv file, numbers are parsed where a file would be
+        tsv = du.InMemoryTsv([['a', 'b'], np.array([0.25, 0.75]), [1, 0]])
+        self.assertEqual(du.tsv_to_lists(tsv, col_ids=(1,)), (['0.25', '0.75'],))
+        self.assertEqual(du.get_probability_right_or_not(tsv, prob_col=1, right_or_not_col=2), ([0.25, 0.75], [1, 0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,10 @@
 import unittest
 import os
+import json
+import tempfile
+import subprocess
+import sys
+import explainaboard.error_analysis as ea
 import explainaboard.explainaboard_main as em
 
 
@@ -16,23 +21,19 @@ class IntegrationTest(unittest.TestCase):
         em.run_explainaboard('absa', [os.path.join(self.example_dir, 'test-laptop.tsv')], os.devnull, is_print_ece=True, is_print_case=True)
 
     def test_chunk_single(self):
-        # TODO: currently testing is_print_case is too slow, so it's turned off but probably shouldn't be
-        em.run_explainaboard('chunk', [os.path.join(self.example_dir, 'test-conll00.tsv')], os.devnull, is_print_case=False)
+        em.run_explainaboard('chunk', [os.path.join(self.example_dir, 'test-conll00.tsv')], os.devnull, is_print_case=True)
 
     def test_cws_single(self):
-        # TODO: currently testing is_print_case is too slow, so it's turned off but probably shouldn't be
-        em.run_explainaboard('cws', [os.path.join(self.example_dir, 'test-ctb.tsv')], os.devnull, is_print_case=False)
+        em.run_explainaboard('cws', [os.path.join(self.example_dir, 'test-ctb.tsv')], os.devnull, is_print_case=True)
 
     def test_ner_single(self):
-        # TODO: currently testing is_print_case is too slow, so it's turned off but probably shouldn't be
-        em.run_explainaboard('ner', [os.path.join(self.example_dir, 'test-conll03.tsv')], os.devnull, is_print_case=False)
+        em.run_explainaboard('ner', [os.path.join(self.example_dir, 'test-conll03.tsv')], os.devnull, is_print_case=True)
 
     def test_nli_single(self):
         em.run_explainaboard('nli', [os.path.join(self.example_dir, 'test-snli.tsv')], os.devnull, is_print_ece=True, is_print_case=True)
 
     def test_pos_single(self):
-        # TODO: currently testing is_print_case is too slow, so it's turned off but probably shouldn't be
-        em.run_explainaboard('pos', [os.path.join(self.example_dir, 'test-ptb2.tsv')], os.devnull, is_print_case=False)
+        em.run_explainaboard('pos', [os.path.join(self.example_dir, 'test-ptb2.tsv')], os.devnull, is_print_case=True)
 
     # TODO: There is no example for relation extraction?
     # def test_re_single(self):
@@ -41,5 +42,259 @@ class IntegrationTest(unittest.TestCase):
     def test_tc_single(self):
         em.run_explainaboard('tc', [os.path.join(self.example_dir, 'test-atis.tsv')], os.devnull, is_print_ece=True, is_print_case=True)
 
+    def test_ner_shared_ci(self):
+        em.run_explainaboard('ner', [os.path.join(self.example_dir, 'test-conll03.tsv')], os.devnull, is_print_ci=True,
+                             ci_mode='shared')
+
+    def test_tc_shared_ci(self):
+        em.run_explainaboard('tc', [os.path.join(self.example_dir, 'test-atis.tsv')], os.devnull, is_print_ci=True,
+                             ci_mode='shared')
+
+    def test_ner_workers(self):
+        em.run_explainaboard('ner', [os.path.join(self.example_dir, 'test-conll03.tsv')], os.devnull, is_print_ci=True,
+                             is_print_case=True, n_workers=2)
+
+    def test_tc_workers(self):
+        em.run_explainaboard('tc', [os.path.join(self.example_dir, 'test-atis.tsv')], os.devnull, is_print_case=True,
+                             n_workers=2)
+
+    def run_pair(self, task, file_name):
+        # compare the example system with a system that predicts the gold tags
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_gold = os.path.join(tmp_dir, 'gold.tsv')
+            with open(os.path.join(self.example_dir, file_name)) as fin, open(path_gold, 'w') as fout:
+                for line in fin:
+                    cols = line.rstrip('\n').split('\t')
+                    fout.write('\t'.join(cols[:2] + cols[1:2]) + '\n' if len(cols) == 3 else line)
+            path_output = os.path.join(tmp_dir, 'pair.json')
+            em.run_explainaboard(task, [os.path.join(self.example_dir, file_name), path_gold], path_output,
+                                 analysis_type='pair', is_print_ci=True, is_print_case=True)
+            with open(path_output) as fin:
+                obj_json = json.load(fin)
+        self.assertEqual(len(obj_json['models']), 2)
+        self.assertAlmostEqual(obj_json['models'][1]['results']['overall']['performance'], 100)
+        self.assertGreaterEqual(obj_json['pair']['overall']['performance_delta'], 0)
+        self.assertEqual(obj_json['pair']['fine_grained'].keys(),
+                         obj_json['models'][0]['results']['fine_grained'].keys())
+
+    def test_chunk_pair(self):
+        self.run_pair('chunk', 'test-conll00.tsv')
+
+    def test_cws_pair(self):
+        self.run_pair('cws', 'test-ctb.tsv')
+
+    def test_ner_pair(self):
+        self.run_pair('ner', 'test-conll03.tsv')
+
+    def test_pos_pair(self):
+        self.run_pair('pos', 'test-ptb2.tsv')
+
+    def test_ner_combine(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_output = os.path.join(tmp_dir, 'combine.json')
+            em.run_explainaboard('ner', [os.path.join(self.example_dir, 'test-conll03.tsv')] * 3, path_output,
+                                 analysis_type='combine', model_name='a,b,c')
+            with open(path_output) as fin:
+                obj_json = json.load(fin)
+        self.assertEqual([obj_model['name'] for obj_model in obj_json['models']], ['a', 'b', 'c'])
+        # identical systems never win a span alone
+        self.assertEqual(obj_json['combine']['overall']['unique_win'], {'a': 0, 'b': 0, 'c': 0})
+        self.assertEqual(obj_json['combine']['overall']['oracle'], obj_json['combine']['overall']['avg_correct'])
+
+    def test_chunk_gold_cache(self):
+        # the first run fills the cache, the second one reads the gold side from it
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            reports = []
+            for path_output in [os.path.join(tmp_dir, name) for name in ('none.json', 'miss.json', 'hit.json')]:
+                em.run_explainaboard('chunk', [os.path.join(self.example_dir, 'test-conll00.tsv')], path_output,
+                                     is_print_case=True, cache_dir=None if not reports else cache_dir)
+                with open(path_output) as fin:
+                    reports.append(json.load(fin))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(reports[0], reports[1])
+        self.assertEqual(reports[0], reports[2])
+
+    def test_tc_report_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            path_system = os.path.join(self.example_dir, 'test-atis.tsv')
+            reports = []
+            for name, is_print_case in (('miss.json', True), ('hit.json', True), ('flags.json', False)):
+                path_output = os.path.join(tmp_dir, name)
+                em.run_explainaboard('tc', [path_system], path_output, is_print_ci=True, is_print_case=is_print_case,
+                                     report_cache_dir=cache_dir)
+                with open(path_output) as fin:
+                    reports.append(json.load(fin))
+            # other flags make another report
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        # the confidence intervals are random, so only a cache hit reproduces them
+        self.assertEqual(reports[0], reports[1])
+
+    def test_report_cache_system_name(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            with open(os.path.join(self.example_dir, 'test-atis.tsv')) as fin:
+                text = fin.read()
+            for name in ('sysA', 'sysB'):
+                with open(os.path.join(tmp_dir, name + '.tsv'), 'w') as fout:
+                    fout.write(text)
+                path_output = os.path.join(tmp_dir, name + '.json')
+                em.run_explainaboard('tc', [os.path.join(tmp_dir, name + '.tsv')], path_output,
+                                     report_cache_dir=cache_dir)
+                with open(path_output) as fin:
+                    obj_json = json.load(fin)
+                # an equal file under another name is not a cache hit on the report naming the first one
+                self.assertEqual(obj_json['data']['output'], 'model_name/' + name + '.tsv')
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_ner_case_file(self):
+        path_text = os.path.join(self.example_dir, 'test-conll03.tsv')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_inline, path_output = os.path.join(tmp_dir, 'inline.json'), os.path.join(tmp_dir, 'output.json')
+            path_cases = os.path.join(tmp_dir, 'output.cases.jsonl')
+            em.run_explainaboard('ner', [path_text], path_inline, is_print_case=True)
+            em.run_explainaboard('ner', [path_text], path_output, is_print_case=True, case_file=path_cases)
+            with open(path_inline) as fin:
+                report_inline = json.load(fin)
+            with open(path_output) as fin:
+                report = json.load(fin)
+            self.assertEqual(report['error_case_file'], 'output.cases.jsonl')
+            overall = report['model']['results']['overall']
+            overall_inline = report_inline['model']['results']['overall']
+            self.assertEqual(overall['error_case']['count'], len(overall_inline['error_case']))
+            self.assertEqual(ea.load_error_cases(path_cases, overall['error_case']), overall_inline['error_case'])
+            bucket, bucket_inline = [results['fine_grained']['eLen'][-1] for results in
+                                     (report['model']['results'], report_inline['model']['results'])]
+            self.assertEqual(ea.load_error_cases(path_cases, bucket['bucket_error_case']),
+                             bucket_inline['bucket_error_case'])
+
+    def test_ner_max_cases(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_output = os.path.join(tmp_dir, 'output.json')
+            em.run_explainaboard('ner', [os.path.join(self.example_dir, 'test-conll03.tsv')], path_output,
+                                 is_print_case=True, max_cases=5, stratify_cases=True)
+            with open(path_output) as fin:
+                report = json.load(fin)
+        overall = report['model']['results']['overall']
+        self.assertGreater(overall['error_case_num'], len(overall['error_case']))
+        self.assertEqual(sum(overall['error_case_strata'].values()), overall['error_case_num'])
+        self.assertLessEqual(len(overall['error_case']), 5 * len(overall['error_case_strata']))
+        for bucket in report['model']['results']['fine_grained']['eLen']:
+            self.assertLessEqual(len(bucket['bucket_error_case']), 5 * len(bucket['bucket_error_case_strata']))
+
+    def test_cws_max_cases(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_output = os.path.join(tmp_dir, 'output.json')
+            em.run_explainaboard('cws', [os.path.join(self.example_dir, 'test-ctb.tsv')], path_output,
+                                 is_print_case=True, max_cases=50)
+            with open(path_output) as fin:
+                report = json.load(fin)
+        # a capped sample is reported whole, not cut to the first tenth as the uncapped cases are
+        overall = report['model']['results']['overall']
+        self.assertEqual(len(overall['error_case']), 50)
+        self.assertGreater(overall['error_case_num'], 50)
+        for bucket in report['model']['results']['fine_grained']['eLen']:
+            self.assertEqual(len(bucket['bucket_error_case']), min(50, bucket['bucket_error_case_num']))
+
+    def test_tc_max_cases(self):
+        path_text = os.path.join(self.example_dir, 'test-atis.tsv')
+        with open(path_text) as fin:
+            rows = [line.rstrip('\n').split('\t') for line in fin if line.strip()]
+        n_errors = sum(cols[1] != cols[2] for cols in rows)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_output = os.path.join(tmp_dir, 'output.json')
+            em.run_explainaboard('tc', [path_text], path_output, is_print_case=True, max_cases=2,
+                                 stratify_cases=True)
+            with open(path_output) as fin:
+                report = json.load(fin)
+        overall = report['model']['results']['overall']
+        # only the wrong predictions are error cases, stratified by their gold and predicted labels
+        self.assertEqual(overall['error_case_num'], n_errors)
+        self.assertEqual(sum(overall['error_case_strata'].values()), n_errors)
+        self.assertLessEqual(len(overall['error_case']), 2 * len(overall['error_case_strata']))
+        for case in overall['error_case']:
+            true_label, pred_label = case.split('|||')[:2]
+            self.assertNotEqual(true_label, pred_label)
+            self.assertIn(true_label + '|||' + pred_label, overall['error_case_strata'])
+        self.assertEqual(sum(bucket['bucket_error_case_num'] for bucket in
+                             report['model']['results']['fine_grained']['sLen']), n_errors)
+
+    def test_tc_merge_stats(self):
+        with open(os.path.join(self.example_dir, 'test-atis.tsv')) as fin:
+            lines = fin.readlines()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = {name: os.path.join(tmp_dir, name) for name in ('a.tsv', 'b.tsv', 'a.stats.json', 'b.stats.json',
+                                                                    'full.json', 'full.stats.json', 'merged.json')}
+            for name, shard in (('a.tsv', lines[:len(lines) // 2]), ('b.tsv', lines[len(lines) // 2:])):
+                with open(paths[name], 'w') as fout:
+                    fout.writelines(shard)
+            em.run_explainaboard('tc', [paths['a.tsv']], os.devnull, is_print_ece=True,
+                                 stats_file=paths['a.stats.json'])
+            # the second shard and the whole test set are bucketed by the intervals of the first shard
+            em.run_explainaboard('tc', [paths['b.tsv']], os.devnull, is_print_ece=True,
+                                 stats_file=paths['b.stats.json'], bucket_stats=paths['a.stats.json'])
+            em.run_explainaboard('tc', [os.path.join(self.example_dir, 'test-atis.tsv')], paths['full.json'],
+                                 is_print_ece=True, stats_file=paths['full.stats.json'],
+                                 bucket_stats=paths['a.stats.json'])
+            em.run_merge([paths['a.stats.json'], paths['b.stats.json']], paths['merged.json'])
+            reports = []
+            for name in ('full.json', 'merged.json'):
+                with open(paths[name]) as fin:
+                    reports.append(json.load(fin)['model']['results'])
+            full, merged = reports
+            self.assertEqual(merged['overall']['performance'], full['overall']['performance'])
+            # the bin sums are only added up in another order
+            self.assertAlmostEqual(merged['calibration']['ECE'], full['calibration']['ECE'])
+            self.assertEqual([row['samples_number_in_this_bin'] for row in merged['calibration']['details']],
+                             [row['samples_number_in_this_bin'] for row in full['calibration']['details']])
+            for bucket, bucket_full in zip(merged['fine_grained']['sLen'], full['fine_grained']['sLen']):
+                self.assertEqual([bucket[key] for key in ('bucket_name', 'bucket_value', 'num')],
+                                 [bucket_full[key] for key in ('bucket_name', 'bucket_value', 'num')])
+
+            # shards bucketed independently can not be merged
+            em.run_explainaboard('tc', [paths['b.tsv']], os.devnull, stats_file=paths['b.stats.json'])
+            self.assertRaises(ValueError, em.run_merge, [paths['a.stats.json'], paths['b.stats.json']], os.devnull)
+
+    def run_shards(self, task, file_name, is_print_ece=False):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reports = []
+            for name, n_shards in (('single.json', None), ('sharded.json', 3)):
+                path_output = os.path.join(tmp_dir, name)
+                em.run_explainaboard(task, [os.path.join(self.example_dir, file_name)], path_output,
+                                     is_print_ece=is_print_ece, n_shards=n_shards)
+                with open(path_output) as fin:
+                    reports.append(json.load(fin))
+        single, sharded = reports
+        self.assertEqual(sharded['data'], single['data'])
+        results, results_single = sharded['model']['results'], single['model']['results']
+        self.assertEqual(results['overall']['performance'], results_single['overall']['performance'])
+        for aspect, buckets in results_single['fine_grained'].items():
+            self.assertEqual([[bucket[key] for key in ('bucket_name', 'bucket_value', 'num')]
+                              for bucket in results['fine_grained'][aspect]],
+                             [[bucket[key] for key in ('bucket_name', 'bucket_value', 'num')] for bucket in buckets])
+        if is_print_ece:
+            # the bin sums are only added up in another order
+            self.assertAlmostEqual(results['calibration']['ECE'], results_single['calibration']['ECE'])
+
+    def test_cws_shards(self):
+        # words may run across the blank lines between sentences, the shards must not split them
+        self.run_shards('cws', 'test-ctb.tsv')
+
+    def test_tc_shards(self):
+        self.run_shards('tc', 'test-atis.tsv', is_print_ece=True)
+
+    def test_tc_pair_unsupported(self):
+        self.assertRaises(ValueError, em.run_explainaboard, 'tc', [os.path.join(self.example_dir, 'test-atis.tsv')] * 2,
+                          os.devnull, analysis_type='pair')
+
+    def test_lazy_imports(self):
+        # the heavy dependencies and the task modules are only imported by the runs that need them
+        code = ('import sys, explainaboard; '
+                'print(sorted(m for m in ("scipy", "seqeval", "nltk", "pandas", "explainaboard.tasks.ner") '
+                'if m in sys.modules))')
+        self.assertEqual(subprocess.check_output([sys.executable, '-c', code], text=True).strip(), '[]')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import numpy as np
+import explainaboard.multi_system as ms
+
+
+class MultiSystemTest(unittest.TestCase):
+    '''
+    Tests of the statistics shared by the pair and combine analyses
+    '''
+    def test_combine_stats(self):
+        # 10 systems, so the bit-matrix spans two bytes per row
+        is_correct = np.zeros((4, 10), dtype=bool)
+        is_correct[0, :] = True
+        is_correct[1, 9] = True
+        is_correct[2, [0, 3]] = True
+        bits = np.zeros((4, 2), dtype=np.uint8)
+        for i_system in range(10):
+            ms.set_correctness_bits(bits, i_system, is_correct[:, i_system])
+        self.assertTrue(np.array_equal(bits, np.packbits(is_correct, axis=1)))
+
+        groups, stats = ms.get_combine_stats(bits, 10, {'len': {(1,): [0, 1], (2, 3): [2, 3]}})
+        self.assertEqual(groups, [(None, None), ('len', (1,)), ('len', (2, 3))])
+        self.assertEqual(stats['num'].tolist(), [4, 2, 2])
+        self.assertEqual(stats['n_oracle'].tolist(), [3, 2, 1])
+        self.assertEqual(stats['n_all_fail'].tolist(), [1, 0, 1])
+        self.assertEqual(stats['n_correct'].tolist(), [13, 11, 2])
+        self.assertEqual(stats['unique_win'][:, 9].tolist(), [1, 1, 0])
+        self.assertEqual(stats['unique_win'].sum(axis=1).tolist(), [1, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import pickle
+import tempfile
+import unittest
+import explainaboard.precomputed as pc
+import explainaboard.explainaboard_main as em
+
+
+class PrecomputedTest(unittest.TestCase):
+    '''
+    Tests of the store of precomputed statistics
+    '''
+    def test_lookup(self):
+        store = pc.PrecomputedStore.from_pairs(pc.flatten_precomputed({'eu': 2, 'peter': 0.5, 'é': 1}))
+        self.assertEqual(store.lookup(['peter', 'john', 'eu', 'é'], default=-1).tolist(), [0.5, -1, 2, 1])
+        self.assertEqual(store.contains(['eu', 'EU', '']).tolist(), [True, False, False])
+        self.assertEqual(pc.PrecomputedStore.from_pairs([]).lookup(['eu']).tolist(), [0])
+
+    def test_flatten(self):
+        self.assertEqual(pc.flatten_precomputed({'peter': {'per': 0.75, 'org': 0.25}}),
+                         [('peter\tper', 0.75), ('peter\torg', 0.25)])
+        self.assertEqual(pc.flatten_precomputed(['eu']), [('eu', 1.0)])
+
+    def test_convert_pickle(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, '_eFre.pkl')
+            with open(path, 'wb') as fout:
+                pickle.dump({'eu': 3, 'peter': 1}, fout)
+            from_pickle = pc.load_store(path)
+            path_store = pc.convert_pickle(path)
+            self.assertEqual(path_store, os.path.join(tmp_dir, '_eFre.stats'))
+            # the store now takes the place of the pickle
+            os.remove(path)
+            from_store = pc.load_store(path)
+            self.assertIsNot(from_store, from_pickle)
+            self.assertIs(pc.load_store(path), from_store)
+            self.assertEqual(from_store.lookup(['peter', 'eu', 'john']).tolist(), [1, 3, 0])
+            self.assertRaises(ValueError, pc.load_store, os.path.join(tmp_dir, '_eCon.pkl'))
+
+    def test_build_precomputed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_train = os.path.join(tmp_dir, 'train.conll')
+            with open(path_train, 'w') as fout:
+                fout.write('-DOCSTART- -X- O\n\nEU NNP B-ORG\nrejects VBZ O\n\n'
+                           'Peter NNP B-PER\nBlack NNP I-PER\n\nEU NNP B-LOC\nPeter NNP B-PER\n')
+            # a tiny memory budget forces the counts through sorted runs on disk
+            dict_path_store = em.run_precompute('ner', path_train, tmp_dir, max_items=2)
+            self.assertEqual(dict_path_store['eFre'], os.path.join(tmp_dir, '_eFre.stats'))
+            stores = {aspect: pc.load_store(os.path.join(tmp_dir, '_' + aspect + '.pkl'))
+                      for aspect in dict_path_store}
+            self.assertEqual(stores['eFre'].lookup(['eu', 'peter black', 'peter', 'black']).tolist(), [2, 1, 1, 0])
+            self.assertEqual(stores['eCon'].lookup(['eu\torg', 'eu\tloc', 'peter\tper', 'eu\tper']).tolist(),
+                             [0.5, 0.5, 1, 0])
+            self.assertEqual(stores['oDen'].contains(['EU', 'rejects', 'Black', 'eu']).tolist(),
+                             [True, True, True, False])
+            self.assertEqual(len(stores['oDen']), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
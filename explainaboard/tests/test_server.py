@@ -0,0 +1,88 @@
+import unittest
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+import explainaboard.data_utils as du
+import explainaboard.explainaboard_main as em
+import explainaboard.server as srv
+
+
+class ServerTest(unittest.TestCase):
+    '''
+    Tests of the analysis server on localhost
+    '''
+    @classmethod
+    def setUpClass(cls):
+        cls.example_dir = os.path.join(os.path.dirname(__file__), os.pardir, 'example')
+        cls.server = srv.AnalysisServer(('127.0.0.1', 0), tasks=('tc', 'ner'))
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+
+    def post(self, submission):
+        request = urllib.request.Request(self.url + '/analyze', json.dumps(submission).encode('utf-8'),
+                                         {'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_health(self):
+        with urllib.request.urlopen(self.url + '/health') as response:
+            self.assertEqual(json.loads(response.read())['status'], 'ok')
+
+    def test_tc_tsv(self):
+        path_text = os.path.join(self.example_dir, 'test-atis.tsv')
+        obj_json = em.run_explainaboard('tc', [path_text], None, is_print_ece=True, is_print_case=True)
+        with open(path_text) as fin:
+            status, obj_json_server = self.post({'task': 'tc', 'tsv': fin.read(), 'name': 'test-atis.tsv',
+                                                 'is_print_ece': True, 'is_print_case': True})
+        self.assertEqual(status, 200)
+        self.assertEqual(obj_json_server, json.loads(json.dumps(obj_json)))
+
+    def test_ner_columns(self):
+        path_text = os.path.join(self.example_dir, 'test-conll03.tsv')
+        obj_json = em.run_explainaboard('ner', [path_text], None)
+        (text_sent, _), (true_sent, _), (pred_sent, _) = du.conll_to_lists(path_text, col_ids=(0, 1, 2))
+        # the second submission reads the gold side from the cache of the server
+        for _ in range(2):
+            status, obj_json_server = self.post({'task': 'ner', 'columns': [text_sent, true_sent, pred_sent],
+                                                 'name': 'test-conll03.tsv'})
+            self.assertEqual(status, 200)
+            self.assertEqual(obj_json_server, json.loads(json.dumps(obj_json)))
+
+    def test_concurrent(self):
+        with open(os.path.join(self.example_dir, 'test-atis.tsv')) as fin:
+            tsv = fin.read()
+        results = [None] * 4
+
+        def submit(i):
+            results[i] = self.post({'task': 'tc', 'tsv': tsv, 'model_name': 'model-%d' % i})
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([status for status, _ in results], [200] * len(results))
+        self.assertEqual([obj_json['model']['name'] for _, obj_json in results],
+                         ['model-%d' % i for i in range(len(results))])
+        self.assertEqual(len({json.dumps(obj_json['model']['results']) for _, obj_json in results}), 1)
+
+    def test_bad_submission(self):
+        self.assertEqual(self.post({'task': 'unknown', 'tsv': ''})[0], 400)
+        self.assertEqual(self.post({'tsv': ''})[0], 400)
+        self.assertEqual(self.post({'task': 'tc', 'tsv': '', 'output': '/tmp/report.json'})[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()